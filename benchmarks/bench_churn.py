@@ -0,0 +1,66 @@
+"""
+Churn training cost: a fresh in-memory fit, a model cache hit, the grid
+search on one core against all cores, and the out-of-core SGD fit, on
+synthetic customer summaries.
+
+    python -m benchmarks.bench_churn --customers 1000000
+"""
+import argparse
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from src.analysis.churn import fit_incremental, search_pipeline, train_churn
+
+from .common import timer
+
+def synthetic_summary(customers, seed=42):
+    """
+    Random recency/frequency/monetary features with a churn flag that
+    mostly follows recency, and a few missing values
+    """
+    rng = np.random.default_rng(seed)
+    recency = rng.integers(0, 730, customers).astype(float)
+    recency[rng.random(customers) < 0.01] = np.nan
+    return pd.DataFrame({
+        'recency': recency,
+        'total_transactions': rng.poisson(5, customers),
+        'total_spent': rng.gamma(2.0, 2500.0, customers).round(2),
+        'churn_flag': (np.nan_to_num(recency, nan=0) + rng.normal(0, 30, customers)) > 180,
+    })
+
+def batches_of(df, batch_size):
+    return lambda: (df.iloc[start:start + batch_size] for start in range(0, len(df), batch_size))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark churn model training')
+    parser.add_argument('--customers', type=int, default=1000000)
+    parser.add_argument('--batch-size', type=int, default=100000)
+    parser.add_argument('--search-customers', type=int, default=200000,
+                        help='Rows used for the grid search timings')
+    args = parser.parse_args()
+
+    df = synthetic_summary(args.customers)
+    search_df = df.iloc[:args.search_customers]
+    timings, accuracy = {}, {}
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        with timer(timings, 'fit (cache miss)'):
+            _, accuracy['fit (cache miss)'] = train_churn(df, model_dir=model_dir)
+        with timer(timings, 'fit (cache hit)'):
+            _, accuracy['fit (cache hit)'] = train_churn(df, model_dir=model_dir)
+        with timer(timings, 'SGD out of core'):
+            _, accuracy['SGD out of core'] = fit_incremental(batches_of(df, args.batch_size), model_dir=model_dir)
+
+    for n_jobs in (1, -1):
+        name = f'search, n_jobs={n_jobs}'
+        with timer(timings, name):
+            _, accuracy[name] = search_pipeline(search_df, n_jobs=n_jobs)
+
+    print(f"{args.customers} customers (grid search on {len(search_df)}):")
+    for name, elapsed in timings.items():
+        print(f"  {name:<20} {elapsed:8.2f}s  accuracy {accuracy[name] * 100:6.2f}%")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Regression check and timing benchmark for the vectorized cleaners.
+
+The row-by-row cleaners below are the implementations clean.py shipped with
+before vectorization, minus the random customer_id reassignment that the
+key-mapping stage replaced. Both must write byte-identical files for the
+bundled data/raw CSVs.
+
+    python -m benchmarks.bench_clean --scale 100
+"""
+import argparse
+import filecmp
+import os
+import tempfile
+
+import pandas as pd
+
+from src.preprocess.clean import clean_customers, clean_engagement, clean_transactions
+
+from .common import RAW_DIR, tile_csv, timer
+
+def convert_date(date_str):
+    try:
+        return pd.to_datetime(date_str, format="%m/%d/%Y")
+    except:
+        return None
+
+def legacy_clean_customers(file_path, dest_path):
+    customers = pd.read_csv(file_path)
+
+    customers['city'] = customers['city'].fillna('Unknown')
+    customers['state'] = customers['state'].fillna('Unknown')
+    customers['country'] = customers['country'].fillna('Unknown')
+
+    customers['is_active'] = customers['is_active'].apply( lambda x: True if ( x ) else False )
+
+    customers['dob'] = customers['dob'].apply(convert_date)
+    customers['signup_date'] = customers['signup_date'].apply(convert_date)
+
+    customers.drop_duplicates(subset='customer_id', inplace=True)
+
+    valid_genders = ['Male', 'Female', 'Other']
+    customers['gender'] = customers['gender'].apply(lambda x: x if x in valid_genders else 'Other')
+
+    customers.to_csv(dest_path, index=False)
+
+def legacy_clean_engagement(file_path, dest_path):
+    engagements = pd.read_csv(file_path)
+
+    engagements.fillna(0, inplace=True)
+
+    engagements['engagement_date'] = engagements['engagement_date'].apply(convert_date)
+
+    numeric_columns = ['login_frequency', 'time_spent', 'pages_visited',
+                       'purchase_clicks', 'feedback_score', 'email_open_rate',
+                       'promo_redemptions']
+    engagements[numeric_columns] = engagements[numeric_columns].apply(pd.to_numeric)
+
+    engagements['time_spent'] = ( engagements['time_spent'] / 60 ).round(2)
+
+    engagements.drop_duplicates(subset='engagement_id', inplace=True)
+
+    engagements.to_csv(dest_path, index=False)
+
+def legacy_clean_transactions(file_path, dest_path):
+    transactions = pd.read_csv(file_path)
+
+    transactions['product_category'] = transactions['product_category'].fillna('Unknown')
+    transactions['transaction_status'] = transactions['transaction_status'].fillna('unknown')
+
+    transactions['transaction_date'] = transactions['transaction_date'].apply(convert_date)
+
+    numeric_columns = ['amount', 'quantity']
+    transactions[numeric_columns] = transactions[numeric_columns].apply(pd.to_numeric)
+
+    transactions['discount_applied'] = transactions['discount_applied'].apply( lambda x: True if x > 0 else False )
+
+    transactions.drop_duplicates(subset='transaction_id', inplace=True)
+
+    valid_statuses = ['completed', 'pending', 'refunded']
+    transactions['transaction_status'] = transactions['transaction_status'].apply(
+        lambda x: x if x in valid_statuses else 'unknown'
+    )
+
+    transactions.to_csv(dest_path, index=False)
+
+CLEANERS = {
+    'customers': (legacy_clean_customers, clean_customers),
+    'engagements': (legacy_clean_engagement, clean_engagement),
+    'transactions': (legacy_clean_transactions, clean_transactions),
+}
+
+def run_both(name, source, workdir):
+    """
+    Run the legacy and vectorized cleaner on the same input
+    """
+    legacy, vectorized = CLEANERS[name]
+    timings = {}
+    legacy_dest = os.path.join(workdir, f'legacy_{name}.csv')
+    vectorized_dest = os.path.join(workdir, f'vectorized_{name}.csv')
+
+    with timer(timings, 'legacy'):
+        legacy(source, legacy_dest)
+
+    with timer(timings, 'vectorized'):
+        vectorized(source, vectorized_dest)
+
+    identical = filecmp.cmp(legacy_dest, vectorized_dest, shallow=False)
+    return identical, timings
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare legacy and vectorized cleaners')
+    parser.add_argument('--scale', type=int, default=100,
+                        help='Copies of the bundled raw files to time against')
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as workdir:
+        print("Regression check on data/raw:")
+        for name in CLEANERS:
+            identical, _ = run_both(name, os.path.join(RAW_DIR, f'{name}.csv'), workdir)
+            failed |= not identical
+            print(f"  {name:<13} {'identical' if identical else 'DIFFERENT'}")
+
+        print(f"Timing at {args.scale}x the bundled data:")
+        for name in CLEANERS:
+            source = tile_csv(RAW_DIR, name, args.scale, os.path.join(workdir, f'{name}.csv'))
+            identical, timings = run_both(name, source, workdir)
+            failed |= not identical
+            speedup = timings['legacy'] / timings['vectorized']
+            print(f"  {name:<13} legacy {timings['legacy']:8.3f}s  vectorized "
+                  f"{timings['vectorized']:8.3f}s  ({speedup:.1f}x)")
+
+    if failed:
+        raise SystemExit("Vectorized cleaners do not match the legacy output")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Fit and assignment time of the MiniBatchKMeans segmentation against
+customer count, on synthetic per-customer features held in memory.
+
+    python -m benchmarks.bench_clusters --customers 10000 100000 1000000
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from src.analysis.clusters import ClusterSegmenter
+
+from .common import timer
+
+def synthetic_features(customers, seed=42):
+    """
+    Random transaction and engagement aggregates, with a tenth of the
+    customers missing engagements
+    """
+    rng = np.random.default_rng(seed)
+    total_transactions = rng.poisson(5, customers)
+    total_spent = rng.gamma(2.0, 2500.0, customers)
+    engaged = rng.random(customers) > 0.1
+
+    def engagement(values):
+        return np.where(engaged, values, np.nan)
+
+    return pd.DataFrame({
+        'customer_id': np.arange(1, customers + 1),
+        'total_transactions': total_transactions,
+        'total_spent': total_spent,
+        'avg_transaction_amount': total_spent / np.maximum(total_transactions, 1),
+        'login_frequency': engagement(rng.integers(1, 100, customers)),
+        'time_spent': engagement(rng.uniform(0, 20, customers)),
+        'pages_visited': engagement(rng.integers(1, 1000, customers)),
+        'email_open_rate': engagement(rng.uniform(0, 100, customers)),
+        'promo_redemptions': engagement(rng.integers(0, 1000, customers)),
+    })
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark clustering segmentation')
+    parser.add_argument('--customers', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--clusters', type=int, default=6)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    for customers in args.customers:
+        df = synthetic_features(customers)
+        batches = lambda: iter([df])
+        timings = {}
+
+        with timer(timings, 'fit'):
+            segmenter = ClusterSegmenter(args.clusters, args.batch_size).fit(batches)
+        with timer(timings, 'assign'):
+            assigned = sum(len(batch) for batch in segmenter.assign(batches))
+
+        print(f"  {customers:>10} customers  fit {timings['fit']:7.2f}s  "
+              f"assign {timings['assign']:7.2f}s ({assigned / timings['assign']:,.0f} customers/s)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Time of the BG/NBD and Gamma-Gamma CLV estimates against customer count:
+building the per-customer arrays from transactions, fitting overall and
+per signup-month cohort, and predicting and writing the estimates in
+chunks. Transactions are simulated from the BG/NBD process itself, so the
+fitted parameters can be checked against the true ones. First checks on
+data/raw, where every customer has bought once, that the models refuse to
+fit and the analyzer falls back to the formula instead of exporting NaN.
+
+    python -m benchmarks.bench_clv --customers 10000 100000 1000000 --workers 4
+"""
+import argparse
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from src.analysis.analyzer import run
+from src.analysis.backends import SUMMARY_AS_OF, LocalBackend
+from src.analysis.clv import DEFAULT_CHUNK_SIZE, FitError, customer_arrays, export, fit, load_inputs
+from src.preprocess.clean import clean_customers, clean_engagement, clean_transactions
+from src.preprocess.key_mapping import MAPPED_TABLES, CustomerKeyMap, map_customer_keys
+
+from .common import RAW_DIR, timer
+
+AS_OF = '2021-12-31'
+DAYS = 730
+
+# Parameters the purchases are simulated with
+TRUE_PARAMETERS = {'r': 0.5, 'alpha': 20.0, 'a': 0.8, 'b': 2.5}
+REPEATS = 60
+
+def synthetic_data(customers, seed=42):
+    """
+    Customers signing up over two years, buying at gamma-distributed rates
+    until they drop out with a beta-distributed chance after each purchase
+    """
+    rng = np.random.default_rng(seed)
+    r, alpha, a, b = TRUE_PARAMETERS.values()
+    start = np.datetime64(AS_OF) - DAYS
+    signup = rng.integers(0, DAYS, customers)
+
+    rate = rng.gamma(r, 1 / alpha, customers)
+    dropout = rng.beta(a, b, customers)
+    # The first purchase is on signup and the customer may drop out after
+    # each repeat purchase; 60 repeats cover the window for nearly everyone
+    gaps = rng.exponential(1 / rate[:, None], (customers, REPEATS))
+    times = signup[:, None] + np.concatenate([np.zeros((customers, 1)), np.cumsum(gaps, axis=1)], axis=1)
+    stays = np.cumprod(rng.random((customers, REPEATS - 1)) > dropout[:, None], axis=1).astype(bool)
+    alive = np.concatenate([np.ones((customers, 2), dtype=bool), stays], axis=1)
+    bought = alive & (times < DAYS)
+
+    rows, columns = np.nonzero(bought)
+    transactions = pd.DataFrame({
+        'customer_id': rows + 1,
+        'transaction_date': start + times[rows, columns].astype('timedelta64[D]'),
+        'amount': np.round(rng.gamma(4.0, 25.0, customers)[rows] * rng.gamma(10.0, 0.1, len(rows)), 2),
+    })
+    signups = pd.DataFrame({'customer_id': np.arange(1, customers + 1), 'signup_date': start + signup})
+    return transactions, signups
+
+def bundled_check(workdir):
+    """
+    Clean data/raw into workdir and run the BG/NBD analysis on it with the
+    sqlite backend. Returns the problems found.
+    """
+    for name, cleaner in (('customers', clean_customers), ('transactions', clean_transactions),
+                          ('engagements', clean_engagement)):
+        cleaner(os.path.join(RAW_DIR, f'{name}.csv'), os.path.join(workdir, f'cleaned_{name}.csv'))
+    key_map = CustomerKeyMap.from_staged(os.path.join(workdir, 'cleaned_customers.csv'))
+    for table in MAPPED_TABLES:
+        map_customer_keys(table, os.path.join(workdir, f'cleaned_{table}.csv'), key_map)
+
+    problems = []
+    with LocalBackend('sqlite', workdir) as backend:
+        try:
+            fit(load_inputs(backend.engine, SUMMARY_AS_OF))
+            problems.append('models fitted without repeat purchases')
+        except FitError:
+            pass
+        scored = run(backend.engine, os.path.join(workdir, 'clv.csv'), model_dir=workdir, use_cache=False,
+                     clv_model='bgnbd')
+    missing = int(scored['predicted_clv'].isna().sum())
+    if missing:
+        problems.append(f'{missing} of {len(scored)} customers exported without a CLV')
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the BG/NBD and Gamma-Gamma CLV estimates')
+    parser.add_argument('--customers', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--workers', type=int, default=1, help='Processes fitting the cohorts')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        problems = bundled_check(workdir)
+    print(f"Regression check on data/raw: {'; '.join(problems) or 'ok'}")
+    if problems:
+        raise SystemExit("BG/NBD estimates on the bundled data are not usable")
+
+    print(f"True BG/NBD parameters: {TRUE_PARAMETERS}")
+    for customers in args.customers:
+        transactions, signups = synthetic_data(customers)
+        timings = {}
+
+        with timer(timings, 'arrays'):
+            arrays = customer_arrays(transactions, signups, AS_OF)
+        with timer(timings, 'fit'):
+            params = fit(arrays)
+        with timer(timings, 'cohorts'):
+            cohort_params = fit(arrays, by_cohort=True, workers=args.workers)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with timer(timings, 'export'):
+                export(arrays, cohort_params, os.path.join(tmp_dir, f'clv.{args.format}'), args.chunk_size)
+
+        fitted = ', '.join(f'{name} {params.loc[None, name]:.3f}' for name in TRUE_PARAMETERS)
+        print(f"  {customers:>10} customers, {len(transactions):>10} transactions  "
+              f"arrays {timings['arrays']:6.2f}s  fit {timings['fit']:6.2f}s  "
+              f"{len(cohort_params) - 1} cohorts {timings['cohorts']:6.2f}s  "
+              f"export {timings['export']:6.2f}s ({customers / timings['export']:,.0f} customers/s)  [{fitted}]")
+
+if __name__ == '__main__':
+    main()
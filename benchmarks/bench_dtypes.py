@@ -0,0 +1,91 @@
+"""
+Memory footprint of the customer, transaction and engagement frames with
+pandas' default dtypes against the dtypes of src/schema.py, per table and
+per column.
+
+Synthetic raw files of --rows rows per table are generated and cleaned,
+unless --raw-dir points at existing ones. Each file is then read in
+chunks both ways and the deep memory usage of the chunks summed, which is
+the footprint of the whole table without holding it: default read_csv
+against the registry's dtypes for the cleaned files, and against the
+cleaners' text dtypes for the raw files.
+
+    python -m benchmarks.bench_dtypes --rows 10000000
+"""
+import argparse
+import os
+import tempfile
+
+import pandas as pd
+
+from src.preprocess.clean import clean_customers, clean_engagement, clean_transactions
+from src.schema import FILE_TABLES, read_csv
+
+from .common import timer
+from .generate import generate
+
+CLEANERS = {
+    'customers': clean_customers,
+    'engagements': clean_engagement,
+    'transactions': clean_transactions,
+}
+
+CHUNK_ROWS = 1000000
+
+MB = 2 ** 20
+
+def footprint(chunks):
+    """
+    Rows and bytes per column over every chunk of a reader
+    """
+    rows, columns = 0, {}
+    for chunk in chunks:
+        rows += len(chunk)
+        for name, size in chunk.memory_usage(index=False, deep=True).items():
+            columns[name] = columns.get(name, 0) + int(size)
+    return rows, columns
+
+def report(label, rows, before, after, per_column):
+    total_before, total_after = sum(before.values()), sum(after.values())
+    print(f"  {label:<22} {rows:>10} rows  {total_before / MB:9.1f} MB -> {total_after / MB:9.1f} MB  "
+          f"({total_before / max(rows, 1):6.1f} -> {total_after / max(rows, 1):5.1f} bytes/row, "
+          f"{1 - total_after / max(total_before, 1):.0%} smaller)")
+    if per_column:
+        for name, size in before.items():
+            print(f"    {name:<20} {size / MB:9.1f} MB -> {after.get(name, 0) / MB:9.1f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the memory footprint of the dtype registry')
+    parser.add_argument('--rows', type=int, default=10000000, help='Rows of each generated table')
+    parser.add_argument('--raw-dir', default=None, help='Measure these raw files instead of generating them')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help='Rows read per chunk')
+    parser.add_argument('--per-column', action='store_true', help='Break each table down by column')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        raw_dir = args.raw_dir or os.path.join(workdir, 'raw')
+        timings = {}
+        if not args.raw_dir:
+            with timer(timings, 'generate'):
+                generate(raw_dir, args.rows, customers=args.rows, engagements=args.rows)
+        with timer(timings, 'clean'):
+            for table in FILE_TABLES:
+                CLEANERS[table](os.path.join(raw_dir, f'{table}.csv'),
+                                os.path.join(workdir, f'cleaned_{table}.csv'), args.chunk_rows)
+        print(', '.join(f"{name} {seconds:.1f}s" for name, seconds in timings.items()))
+
+        print("Default dtypes -> src/schema.py dtypes, summed over chunks of "
+              f"{args.chunk_rows} rows")
+        for table in FILE_TABLES:
+            raw_path = os.path.join(raw_dir, f'{table}.csv')
+            rows, before = footprint(pd.read_csv(raw_path, chunksize=args.chunk_rows))
+            _, after = footprint(read_csv(raw_path, table, raw=True, chunksize=args.chunk_rows))
+            report(f'{table} (raw)', rows, before, after, args.per_column)
+
+            cleaned_path = os.path.join(workdir, f'cleaned_{table}.csv')
+            rows, before = footprint(pd.read_csv(cleaned_path, chunksize=args.chunk_rows))
+            _, after = footprint(read_csv(cleaned_path, table, chunksize=args.chunk_rows))
+            report(f'{table} (cleaned)', rows, before, after, args.per_column)
+
+if __name__ == '__main__':
+    main()
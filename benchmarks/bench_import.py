@@ -0,0 +1,50 @@
+"""
+Startup cost of importing the analysis package and analyzer.py, measured
+in fresh interpreters, next to the libraries analyzer.py used to import
+eagerly and now imports inside the functions that use them.
+
+    python -m benchmarks.bench_import
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+from .common import PROJECT_ROOT
+
+MODULES = [
+    'src.analysis',
+    'src.analysis.analyzer',
+    # Reference points: what analyzer.py used to pull in at import
+    'src.analysis.churn',
+    'pandas',
+    'sqlalchemy',
+    'sklearn.linear_model',
+]
+
+def import_time(module, repeat):
+    """
+    Median wall-clock time of a fresh interpreter importing a module,
+    minus the time of an interpreter that imports nothing
+    """
+    def run(code):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', code], cwd=PROJECT_ROOT, check=True)
+            timings.append(time.perf_counter() - start)
+        return statistics.median(timings)
+
+    return run(f'import {module}') - run('pass')
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure import time of the analysis modules')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for module in MODULES:
+        print(f"  {module:<24} {import_time(module, args.repeat) * 1000:8.1f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Load test of the scoring service: concurrent clients post batches of
+random customer IDs and the script reports p50/p99 latency and throughput.
+
+Against a running service:
+
+    python -m benchmarks.bench_scoring --url http://127.0.0.1:8080 --customers 1000
+
+Or starting one in-process on a free port:
+
+    python -m benchmarks.bench_scoring --db-url postgresql+psycopg2://... --customers 1000
+"""
+import argparse
+import json
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+def post_scores(url, customer_ids):
+    request = urllib.request.Request(
+        f'{url}/score', data=json.dumps({'customer_ids': customer_ids}).encode(),
+        headers={'Content-Type': 'application/json'},
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())['scores']
+
+def client(url, customers, batch_size, requests, seed):
+    """
+    Send requests one after the other, returning the latency of each
+    """
+    rng = np.random.default_rng(seed)
+    latencies = []
+    for _ in range(requests):
+        customer_ids = rng.integers(1, customers + 1, batch_size).tolist()
+        start = time.perf_counter()
+        post_scores(url, customer_ids)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def start_service(db_url, model_dir):
+    from src.analysis.churn import MODEL_DIR, load_model
+    from src.analysis.scoring import ScoringService, serve
+    from src.db_connection import get_engine
+
+    service = ScoringService(get_engine(db_url), load_model(model_dir=model_dir or MODEL_DIR))
+    server = serve(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, service, f'http://127.0.0.1:{server.server_port}'
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the churn/CLV scoring service')
+    parser.add_argument('--url', default=None, help='Base URL of a running scoring service')
+    parser.add_argument('--db-url', default=None, help='Start a service in-process against this warehouse')
+    parser.add_argument('--model-dir', default=None, help='Model directory of the in-process service')
+    parser.add_argument('--customers', type=int, default=1000, help='Customer IDs are drawn from 1..customers')
+    parser.add_argument('--clients', type=int, default=16, help='Concurrent clients')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per client')
+    parser.add_argument('--batch-size', type=int, default=10, help='Customer IDs per request')
+    args = parser.parse_args()
+
+    server = service = None
+    url = args.url
+    if url is None:
+        server, service, url = start_service(args.db_url, args.model_dir)
+
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.clients) as pool:
+            results = pool.map(
+                lambda seed: client(url, args.customers, args.batch_size, args.requests, seed),
+                range(args.clients),
+            )
+            latencies = np.concatenate([np.array(result) for result in results])
+        elapsed = time.perf_counter() - start
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+            service.stop()
+
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    print(f"{len(latencies)} requests of {args.batch_size} customers from {args.clients} clients "
+          f"in {elapsed:.2f}s")
+    print(f"  latency p50 {p50:.1f} ms, p99 {p99:.1f} ms")
+    print(f"  throughput {len(latencies) / elapsed:,.0f} requests/s, "
+          f"{len(latencies) * args.batch_size / elapsed:,.0f} customers/s")
+    if service is not None:
+        print(f"  {service.batches} micro-batches, feature cache {service.cache.stats()}")
+
+if __name__ == '__main__':
+    main()
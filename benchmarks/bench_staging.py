@@ -0,0 +1,94 @@
+"""
+CSV against Parquet as the staging format between the cleaners and the
+loaders: write time, size on disk, and the time and peak RSS of reading
+the cleaned files back, in full and with a column projection.
+
+Reads run in fresh interpreters so peak RSS is not shared:
+
+    python -m benchmarks.bench_staging --scale 1000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from src.preprocess.clean import clean_customers, clean_engagement, clean_transactions
+from src.staging import STAGING_FORMATS
+
+from .common import PROJECT_ROOT, RAW_DIR, tile_csv, timer
+
+CLEANERS = {
+    'customers': clean_customers,
+    'engagements': clean_engagement,
+    'transactions': clean_transactions,
+}
+
+# Columns read by the projection timing, what an analysis typically needs
+PROJECTIONS = {
+    'customers': ['customer_id', 'signup_date'],
+    'engagements': ['customer_id', 'engagement_date', 'time_spent'],
+    'transactions': ['customer_id', 'transaction_date', 'amount'],
+}
+
+# Run inside the child interpreter: read a staged file, print time and peak RSS as JSON
+CHILD = """
+import json, sys, time
+from benchmarks.common import peak_rss_mb
+from src.staging import read_staged
+path, columns = sys.argv[1], json.loads(sys.argv[2])
+start = time.perf_counter()
+rows = len(read_staged(path, columns=columns))
+elapsed = time.perf_counter() - start
+print(json.dumps({'rows': rows, 'seconds': elapsed,
+                  'peak_rss_mb': peak_rss_mb()}))
+"""
+
+def size_on_disk(path):
+    """
+    Size of a file, or of every file under a dataset directory, in bytes
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path) for name in names
+    )
+
+def measure_read(path, columns=None):
+    """
+    Read a staged file in a child interpreter and return its timing and peak RSS
+    """
+    result = subprocess.run(
+        [sys.executable, '-c', CHILD, path, json.dumps(columns)],
+        cwd=PROJECT_ROOT, check=True, capture_output=True, text=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CSV vs Parquet staging')
+    parser.add_argument('--scale', type=int, default=1000,
+                        help='Copies of the bundled raw files to stage')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, cleaner in CLEANERS.items():
+            source = tile_csv(RAW_DIR, name, args.scale, os.path.join(workdir, f'raw_{name}.csv'))
+            print(f"{name} ({args.scale}x):")
+
+            for staging, extension in STAGING_FORMATS.items():
+                dest = os.path.join(workdir, f'cleaned_{name}{extension}')
+                timings = {}
+                with timer(timings, 'write'):
+                    cleaner(source, dest)
+
+                full = measure_read(dest)
+                projected = measure_read(dest, PROJECTIONS[name])
+                print(f"  {staging:<8} write {timings['write']:7.2f}s  "
+                      f"size {size_on_disk(dest) / 2**20:8.1f} MB  "
+                      f"read {full['seconds']:6.2f}s / {full['peak_rss_mb']:6.0f} MB RSS  "
+                      f"projected read {projected['seconds']:6.2f}s / {projected['peak_rss_mb']:6.0f} MB RSS")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Peak memory and wall-clock time of the analyzer reading the whole
+customer summary at once against streaming it in batches.
+
+Each mode runs in a fresh interpreter so peak RSS is not shared. Works in
+its own PostgreSQL schema, which is dropped afterwards:
+
+    python -m benchmarks.bench_streaming --db-url postgresql+psycopg2://... --customers 1000000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from sqlalchemy import text
+
+from src.db_connection import get_engine
+from src.etl.summary import install_summary
+from src.models import Base
+
+from .common import PROJECT_ROOT
+
+SCHEMA = 'bench_streaming'
+
+# Run inside the child interpreter: score the summary, print time and peak RSS as JSON
+CHILD = """
+import json, sys, time
+from benchmarks.common import peak_rss_mb
+from src.db_connection import get_engine
+from src.analysis.analyzer import run, run_streaming
+url, schema, mode, output, batch_size = sys.argv[1:6]
+engine = get_engine(url, connect_args={'options': f'-csearch_path={schema}'})
+start = time.perf_counter()
+if mode == 'stream':
+    run_streaming(engine, output, batch_size=int(batch_size))
+else:
+    run(engine, output)
+elapsed = time.perf_counter() - start
+print(json.dumps({'seconds': elapsed, 'peak_rss_mb': peak_rss_mb()}))
+"""
+
+def generate(connection, customers):
+    """
+    Fill customer_summary_mat with random rows server-side
+    """
+    connection.execute(text(
+        "INSERT INTO customer_summary_mat "
+        "SELECT g, 'first' || g, 'last' || g, "
+        "timestamp '2020-01-01' + random() * interval '730 days', "
+        "1 + floor(random() * 50)::int, round((random() * 50000)::numeric, 2), "
+        "round((random() * 5000)::numeric, 2), floor(random() * 730), random() < 0.3 "
+        "FROM generate_series(1, :customers) g"
+    ), {'customers': customers})
+
+def measure(url, mode, batch_size):
+    """
+    Run the analyzer in a child interpreter and return its timing and peak RSS
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, 'clv.csv')
+        result = subprocess.run(
+            [sys.executable, '-c', CHILD, url, SCHEMA, mode, output, str(batch_size)],
+            cwd=PROJECT_ROOT, check=True, capture_output=True, text=True,
+        )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark in-memory vs streaming analyzer runs')
+    parser.add_argument('--db-url', required=True, help='SQLAlchemy URL of a PostgreSQL database')
+    parser.add_argument('--customers', type=int, default=1000000)
+    parser.add_argument('--batch-size', type=int, default=50000)
+    args = parser.parse_args()
+
+    admin = get_engine(args.db_url)
+    with admin.begin() as connection:
+        connection.exec_driver_sql(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}")
+
+    engine = get_engine(args.db_url, connect_args={'options': f'-csearch_path={SCHEMA}'})
+    try:
+        Base.metadata.create_all(engine)
+        with engine.begin() as connection:
+            install_summary(connection)
+            generate(connection, args.customers)
+
+        for mode in ('full', 'stream'):
+            result = measure(args.db_url, mode, args.batch_size)
+            print(f"  {mode:<8} {result['seconds']:8.2f} s  {result['peak_rss_mb']:8.0f} MB peak RSS")
+    finally:
+        engine.dispose()
+        with admin.begin() as connection:
+            connection.exec_driver_sql(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+
+if __name__ == '__main__':
+    main()
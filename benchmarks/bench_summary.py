@@ -0,0 +1,104 @@
+"""
+Query latency of the customer_summary view against the materialized
+customer_summary_mat table, and the cost of refreshing it.
+
+Runs in its own PostgreSQL schema, which is dropped afterwards:
+
+    python -m benchmarks.bench_summary --db-url postgresql+psycopg2://... --transactions 1000000
+"""
+import argparse
+import statistics
+import time
+
+from sqlalchemy import text
+
+from src.db_connection import get_engine
+from src.etl.summary import install_summary, refresh_customer_summary
+from src.models import Base
+
+SCHEMA = 'bench_summary'
+
+def generate(connection, customers, transactions):
+    """
+    Fill customers and transactions with random rows server-side
+    """
+    connection.execute(text(
+        "INSERT INTO customers (customer_id, first_name, last_name) "
+        "SELECT g, 'first' || g, 'last' || g FROM generate_series(1, :customers) g"
+    ), {'customers': customers})
+    connection.execute(text(
+        "INSERT INTO transactions (transaction_id, customer_id, transaction_date, amount) "
+        "SELECT g, 1 + floor(random() * :customers)::int, "
+        "timestamp '2020-01-01' + random() * interval '730 days', "
+        "round((random() * 10000)::numeric, 2) "
+        "FROM generate_series(1, :transactions) g"
+    ), {'customers': customers, 'transactions': transactions})
+    connection.exec_driver_sql("ANALYZE customers; ANALYZE transactions")
+
+def time_query(engine, sql, repeat, params=None):
+    """
+    Median wall-clock time of running a query and fetching every row
+    """
+    timings = []
+    with engine.connect() as connection:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            connection.execute(text(sql), params or {}).fetchall()
+            timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark customer_summary view vs materialized table')
+    parser.add_argument('--db-url', required=True, help='SQLAlchemy URL of a PostgreSQL database')
+    parser.add_argument('--customers', type=int, default=100000)
+    parser.add_argument('--transactions', type=int, default=1000000)
+    parser.add_argument('--touched', type=int, default=1000,
+                        help='Customers refreshed in the incremental refresh timing')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    admin = get_engine(args.db_url)
+    with admin.begin() as connection:
+        connection.exec_driver_sql(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}")
+
+    engine = get_engine(args.db_url, connect_args={'options': f'-csearch_path={SCHEMA}'})
+    try:
+        Base.metadata.create_all(engine)
+        with engine.begin() as connection:
+            start = time.perf_counter()
+            generate(connection, args.customers, args.transactions)
+            print(f"Generated {args.customers} customers and {args.transactions} transactions "
+                  f"in {time.perf_counter() - start:.1f}s")
+            install_summary(connection)
+
+        with engine.begin() as connection:
+            start = time.perf_counter()
+            refresh_customer_summary(connection)
+            full_refresh = time.perf_counter() - start
+
+        touched = list(range(1, args.customers + 1, max(1, args.customers // args.touched)))[:args.touched]
+        with engine.begin() as connection:
+            start = time.perf_counter()
+            refresh_customer_summary(connection, touched)
+            partial_refresh = time.perf_counter() - start
+
+        results = {
+            'view, all customers': time_query(engine, "SELECT * FROM customer_summary", args.repeat),
+            'table, all customers': time_query(engine, "SELECT * FROM customer_summary_mat", args.repeat),
+            'view, one customer': time_query(
+                engine, "SELECT * FROM customer_summary WHERE customer_id = :id", args.repeat, {'id': 42}),
+            'table, one customer': time_query(
+                engine, "SELECT * FROM customer_summary_mat WHERE customer_id = :id", args.repeat, {'id': 42}),
+        }
+
+        print(f"Full refresh: {full_refresh:.3f}s, refresh of {len(touched)} touched customers: "
+              f"{partial_refresh:.3f}s")
+        for name, elapsed in results.items():
+            print(f"  {name:<22} {elapsed * 1000:10.1f} ms")
+    finally:
+        engine.dispose()
+        with admin.begin() as connection:
+            connection.exec_driver_sql(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+
+if __name__ == '__main__':
+    main()
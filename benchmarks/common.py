@@ -0,0 +1,47 @@
+import os
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+# Re-exported for the benchmarks that measure child processes
+from src.instrumentation import peak_rss_mb
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RAW_DIR = os.path.join(PROJECT_ROOT, 'data', 'raw')
+PROCESSED_DIR = os.path.join(PROJECT_ROOT, 'data', 'processed')
+
+# ID columns to offset when a sample file is repeated
+ID_COLUMNS = {
+    'customers': ['customer_id'],
+    'transactions': ['transaction_id'],
+    'engagements': ['engagement_id'],
+}
+
+def tile_csv(source_dir, name, scale, dest_path, prefix=''):
+    """
+    Write a file with `scale` copies of a bundled sample, offsetting the IDs
+    of each copy and tagging its emails so they stay unique
+    """
+    sample = pd.read_csv(os.path.join(source_dir, f'{prefix}{name}.csv'))
+    step = len(sample)
+    copies = []
+    for copy in range(scale):
+        frame = sample.copy()
+        for column in ID_COLUMNS[name]:
+            frame[column] = frame[column] + copy * step
+        if copy and 'email' in frame.columns:
+            # The cleaners drop repeated emails, so user@host becomes user+1@host
+            frame['email'] = frame['email'].str.replace('@', f'+{copy}@', n=1, regex=False)
+        copies.append(frame)
+    pd.concat(copies, ignore_index=True).to_csv(dest_path, index=False)
+    return dest_path
+
+@contextmanager
+def timer(results, name):
+    """
+    Record the wall-clock time of a block in results[name]
+    """
+    start = time.perf_counter()
+    yield
+    results[name] = time.perf_counter() - start
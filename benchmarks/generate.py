@@ -0,0 +1,201 @@
+"""
+Synthetic customers, transactions and engagements CSVs in the schema of
+data/raw, at any scale from a thousand to hundreds of millions of rows.
+
+Rows are generated and appended in chunks, so memory stays flat. Names,
+cities and countries are drawn from the bundled sample. Purchases are
+skewed towards a minority of heavy customers, and a configurable share of
+values is dirty (unparseable dates, unknown genders and statuses, missing
+fields, unknown customer IDs) or repeated as duplicate rows.
+
+    python -m benchmarks.generate --dest /tmp/raw --transactions 10000000
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from .common import RAW_DIR
+
+CHUNK_ROWS = 1000000
+
+GENDERS = ['Male', 'Female', 'Other']
+DIRTY_GENDERS = ['M', 'f', 'unknown', '']
+TIERS = ['Bronze', 'Silver', 'Gold']
+TIER_WEIGHTS = [0.6, 0.3, 0.1]
+PAYMENT_METHODS = ['credit card', 'debit card', 'PayPal']
+PAYMENT_WEIGHTS = [0.5, 0.3, 0.2]
+CATEGORIES = ['electronics', 'clothing', 'home goods']
+STATUSES = ['completed', 'pending', 'refunded']
+STATUS_WEIGHTS = [0.85, 0.1, 0.05]
+DIRTY_STATUSES = ['cancelled', 'COMPLETED', '']
+DIRTY_DATES = ['13/45/2021', 'not a date', '']
+
+def date_strings(start, end):
+    """
+    m/d/Y string of every day from start to end, indexed by day offset
+    """
+    days = pd.date_range(start, end, freq='D')
+    return np.array([f'{day.month}/{day.day}/{day.year}' for day in days], dtype=object)
+
+def random_dates(rng, table, size, dirty):
+    values = table[rng.integers(0, len(table), size)]
+    return make_dirty(rng, values, dirty, DIRTY_DATES)
+
+def make_dirty(rng, values, share, dirty_values):
+    """
+    Replace a share of the values with random dirty ones
+    """
+    values = np.asarray(values, dtype=object)
+    mask = rng.random(len(values)) < share
+    values[mask] = np.asarray(dirty_values, dtype=object)[rng.integers(0, len(dirty_values), mask.sum())]
+    return values
+
+def skewed_customer_ids(rng, customers, size, skew):
+    """
+    Customer IDs where low IDs buy far more often: u ** skew concentrates
+    uniform draws near 0, so with skew 3 the top tenth of customers make
+    almost half of the purchases
+    """
+    return 1 + np.floor(customers * rng.random(size) ** skew).astype(np.int64)
+
+def with_duplicates(rng, frame, share):
+    """
+    Append copies of a share of the rows, then shuffle them in
+    """
+    copies = frame.sample(frac=share, random_state=int(rng.integers(1 << 31))) if share else frame.iloc[:0]
+    frame = pd.concat([frame, copies], ignore_index=True)
+    return frame.iloc[rng.permutation(len(frame))]
+
+def chunk_bounds(rows, chunk_rows):
+    for start in range(0, rows, chunk_rows):
+        yield start, min(rows, start + chunk_rows)
+
+def generate_customers(rng, path, rows, dirty, duplicates, chunk_rows=CHUNK_ROWS):
+    sample = pd.read_csv(os.path.join(RAW_DIR, 'customers.csv'), keep_default_na=False)
+    dobs = date_strings('1925-01-01', '2006-12-31')
+    signups = date_strings('2018-01-01', '2021-12-31')
+
+    for part, (start, end) in enumerate(chunk_bounds(rows, chunk_rows)):
+        size = end - start
+        ids = np.arange(start + 1, end + 1)
+        first = sample['first_name'].to_numpy()[rng.integers(0, len(sample), size)]
+        last = sample['last_name'].to_numpy()[rng.integers(0, len(sample), size)]
+        places = sample[['city', 'state', 'country']].to_numpy()[rng.integers(0, len(sample), size)]
+
+        frame = pd.DataFrame({
+            'customer_id': ids,
+            'first_name': first,
+            'last_name': last,
+            'email': [f'{f[0]}{l}{i}@example.com'.lower().replace("'", '') for f, l, i in zip(first, last, ids)],
+            'phone_number': [f'{a}-{b}-{c}' for a, b, c in zip(
+                rng.integers(200, 999, size), rng.integers(100, 999, size), rng.integers(1000, 9999, size))],
+            'gender': make_dirty(rng, np.array(GENDERS, dtype=object)[rng.integers(0, 3, size)], dirty,
+                                 DIRTY_GENDERS),
+            'dob': random_dates(rng, dobs, size, dirty),
+            'age': rng.integers(18, 101, size),
+            'city': make_dirty(rng, places[:, 0], dirty, ['']),
+            'state': places[:, 1],
+            'country': make_dirty(rng, places[:, 2], dirty, ['']),
+            'signup_date': random_dates(rng, signups, size, dirty),
+            'is_active': np.where(rng.random(size) < 0.7, 'true', 'false'),
+            'customer_tier': rng.choice(TIERS, size, p=TIER_WEIGHTS),
+        })
+        with_duplicates(rng, frame, duplicates).to_csv(path, mode='w' if part == 0 else 'a',
+                                                        header=part == 0, index=False)
+
+def generate_transactions(rng, path, rows, customers, dirty, duplicates, skew, chunk_rows=CHUNK_ROWS):
+    dates = date_strings('2020-01-01', '2021-12-30')
+
+    for part, (start, end) in enumerate(chunk_bounds(rows, chunk_rows)):
+        size = end - start
+        customer_ids = skewed_customer_ids(rng, customers, size, skew).astype(object)
+        # Facts pointing at customers that do not exist, or at none
+        orphans = rng.random(size) < dirty / 2
+        customer_ids[orphans] = customers + 1 + rng.integers(0, 1000, orphans.sum())
+        customer_ids[rng.random(size) < dirty / 2] = ''
+
+        frame = pd.DataFrame({
+            'transaction_id': np.arange(start + 1, end + 1),
+            'customer_id': customer_ids,
+            'transaction_date': random_dates(rng, dates, size, dirty),
+            'amount': np.minimum(rng.lognormal(7.5, 1.0, size), 9999.99).round(2),
+            'payment_method': rng.choice(PAYMENT_METHODS, size, p=PAYMENT_WEIGHTS),
+            'product_id': rng.integers(1, 10001, size),
+            'product_category': make_dirty(rng, rng.choice(CATEGORIES, size), dirty, ['']),
+            'quantity': rng.integers(1, 101, size),
+            'discount_applied': np.where(rng.random(size) < 0.3, 0.0, rng.uniform(0.01, 50, size).round(2)),
+            'transaction_status': make_dirty(rng, rng.choice(STATUSES, size, p=STATUS_WEIGHTS), dirty,
+                                             DIRTY_STATUSES),
+        })
+        with_duplicates(rng, frame, duplicates).to_csv(path, mode='w' if part == 0 else 'a',
+                                                        header=part == 0, index=False)
+
+def generate_engagements(rng, path, rows, customers, dirty, duplicates, skew, chunk_rows=CHUNK_ROWS):
+    dates = date_strings('2020-01-01', '2021-12-31')
+
+    for part, (start, end) in enumerate(chunk_bounds(rows, chunk_rows)):
+        size = end - start
+        frame = pd.DataFrame({
+            'engagement_id': np.arange(start + 1, end + 1),
+            'customer_id': skewed_customer_ids(rng, customers, size, skew),
+            'engagement_date': random_dates(rng, dates, size, dirty),
+            'login_frequency': rng.integers(0, 101, size),
+            'time_spent': rng.integers(7, 1440, size),
+            'pages_visited': rng.integers(0, 1001, size),
+            'purchase_clicks': rng.integers(0, 101, size),
+            'feedback_score': rng.uniform(0, 10, size).round(1),
+            'email_open_rate': rng.uniform(0, 100, size).round(1),
+            'promo_redemptions': rng.integers(0, 1001, size),
+        })
+        # Missing measurements, which the cleaner fills with 0
+        frame['login_frequency'] = frame['login_frequency'].where(rng.random(size) >= dirty).astype('Int64')
+        for column in ('feedback_score', 'email_open_rate'):
+            frame[column] = frame[column].where(rng.random(size) >= dirty)
+        with_duplicates(rng, frame, duplicates).to_csv(path, mode='w' if part == 0 else 'a',
+                                                        header=part == 0, index=False)
+
+def generate(dest_dir, transactions, customers=None, engagements=None, dirty=0.01, duplicates=0.005,
+             skew=3.0, seed=42, chunk_rows=CHUNK_ROWS):
+    """
+    Write customers.csv, transactions.csv and engagements.csv to dest_dir.
+    By default there is one customer per ten transactions and one
+    engagement per transaction. The same seed gives the same files.
+    """
+    customers = customers or max(1000, transactions // 10)
+    engagements = transactions if engagements is None else engagements
+    rng = np.random.default_rng(seed)
+    os.makedirs(dest_dir, exist_ok=True)
+
+    counts = {'customers': customers, 'transactions': transactions, 'engagements': engagements}
+    for name, rows in counts.items():
+        start = time.perf_counter()
+        path = os.path.join(dest_dir, f'{name}.csv')
+        if name == 'customers':
+            generate_customers(rng, path, rows, dirty, duplicates, chunk_rows)
+        elif name == 'transactions':
+            generate_transactions(rng, path, rows, customers, dirty, duplicates, skew, chunk_rows)
+        else:
+            generate_engagements(rng, path, rows, customers, dirty, duplicates, skew, chunk_rows)
+        print(f"Generated {rows} {name} in {time.perf_counter() - start:.1f}s")
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic raw CSVs at scale')
+    parser.add_argument('--dest', required=True, help='Directory to write the CSVs to')
+    parser.add_argument('--transactions', type=int, default=1000000)
+    parser.add_argument('--customers', type=int, default=None, help='Default: a tenth of --transactions')
+    parser.add_argument('--engagements', type=int, default=None, help='Default: same as --transactions')
+    parser.add_argument('--dirty', type=float, default=0.01, help='Share of dirty values per column')
+    parser.add_argument('--duplicates', type=float, default=0.005, help='Share of rows repeated')
+    parser.add_argument('--skew', type=float, default=3.0, help='Purchase skew towards heavy customers')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    generate(args.dest, args.transactions, args.customers, args.engagements, args.dirty, args.duplicates,
+             args.skew, args.seed)
+
+if __name__ == '__main__':
+    main()
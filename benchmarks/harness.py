@@ -0,0 +1,243 @@
+"""
+Time every pipeline stage end to end on synthetic data and record peak
+memory, writing the results as JSON so runs can be compared across
+versions.
+
+Each stage runs in a fresh interpreter, so its peak RSS is its own.
+Stages: clean (one per table), map_keys, load, summarize, segment_rfm,
+segment_clusters and train. The database defaults to a SQLite file in the
+work directory; with PostgreSQL the summary is materialized by
+db/summary.sql, elsewhere it is computed with snapshots.summary_as_of.
+
+    python -m benchmarks.harness --transactions 1000000 --output results.json
+    python -m benchmarks.harness --transactions 1000000 --compare results.json
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from .common import PROJECT_ROOT, peak_rss_mb
+from .generate import generate
+
+TABLES = ('customers', 'transactions', 'engagements')
+
+# Snapshot date of the customer_summary view
+SUMMARY_AS_OF = '2021-12-31'
+
+# Slowdowns below this many seconds are noise, whatever the ratio
+MIN_REGRESSION_SECONDS = 0.5
+
+def staged_path(workdir, table):
+    return os.path.join(workdir, 'processed', f'cleaned_{table}.csv')
+
+def stage_clean(workdir, db_url, options, table):
+    from src.preprocess.clean import clean_customers, clean_engagement, clean_transactions
+
+    cleaners = {'customers': clean_customers, 'transactions': clean_transactions, 'engagements': clean_engagement}
+    os.makedirs(os.path.join(workdir, 'processed'), exist_ok=True)
+    cleaners[table](os.path.join(workdir, 'raw', f'{table}.csv'), staged_path(workdir, table), options['chunksize'])
+
+def stage_map_keys(workdir, db_url, options):
+    from src.preprocess.key_mapping import MAPPED_TABLES, CustomerKeyMap, map_customer_keys
+
+    key_map = CustomerKeyMap.from_staged(staged_path(workdir, 'customers'))
+    for table in MAPPED_TABLES:
+        map_customer_keys(table, staged_path(workdir, table), key_map)
+
+def stage_load(workdir, db_url, options):
+    from src.db_connection import get_engine
+    from src.etl.bulk_load import bulk_load_csv
+    from src.models import Base
+
+    engine = get_engine(db_url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    return sum(bulk_load_csv(engine, staged_path(workdir, table), table, options['batch_size'])
+               for table in TABLES)
+
+def stage_summarize(workdir, db_url, options):
+    import pandas as pd
+
+    from src.analysis.snapshots import load_customer_ids, load_transactions, summary_as_of
+    from src.db_connection import get_engine
+    from src.etl.summary import SUMMARY_TABLE, install_summary, refresh_customer_summary
+
+    engine = get_engine(db_url)
+    if engine.dialect.name == 'postgresql':
+        with engine.begin() as connection:
+            install_summary(connection)
+            return refresh_customer_summary(connection)
+
+    customer_ids = load_customer_ids(engine)
+    summary = summary_as_of(load_transactions(engine), [SUMMARY_AS_OF], customer_ids).drop(columns='as_of')
+    names = pd.read_sql("SELECT customer_id, first_name, last_name FROM customers", engine)
+    summary = names.merge(summary, on='customer_id')
+    summary.to_sql(SUMMARY_TABLE, engine, if_exists='replace', index=False, chunksize=options['batch_size'])
+    return len(summary)
+
+def stage_segment_rfm(workdir, db_url, options):
+    from src.analysis.analyzer import load_summary, score_rfm
+    from src.db_connection import get_engine
+
+    return len(score_rfm(load_summary(get_engine(db_url))))
+
+def stage_segment_clusters(workdir, db_url, options):
+    from src.analysis.clusters import FEATURE_QUERY, ClusterSegmenter
+    from src.analysis.streaming import stream_query
+    from src.db_connection import get_engine
+
+    engine = get_engine(db_url)
+
+    def batches():
+        return stream_query(engine, FEATURE_QUERY, batch_size=options['batch_size'])
+
+    segmenter = ClusterSegmenter(batch_size=options['batch_size']).fit(batches)
+    return sum(len(batch) for batch in segmenter.assign(batches))
+
+def stage_train(workdir, db_url, options):
+    from src.analysis.analyzer import load_summary
+    from src.analysis.churn import train_churn
+    from src.db_connection import get_engine
+
+    df = load_summary(get_engine(db_url))
+    train_churn(df, use_cache=False)
+    return len(df)
+
+STAGES = [
+    ('clean_customers', stage_clean, ('customers',)),
+    ('clean_transactions', stage_clean, ('transactions',)),
+    ('clean_engagements', stage_clean, ('engagements',)),
+    ('map_keys', stage_map_keys, ()),
+    ('load', stage_load, ()),
+    ('summarize', stage_summarize, ()),
+    ('segment_rfm', stage_segment_rfm, ()),
+    ('segment_clusters', stage_segment_clusters, ()),
+    ('train', stage_train, ()),
+]
+
+def child(results, func, args):
+    """
+    Run a stage and report its time, peak RSS and row count
+    """
+    start = time.perf_counter()
+    rows = func(*args)
+    results.put({
+        'seconds': round(time.perf_counter() - start, 3),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'rows': int(rows) if rows is not None else None,
+    })
+
+def measure(func, args):
+    """
+    Run a stage in a spawned interpreter so peak RSS is not shared
+    """
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=child, args=(results, func, args))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"{func.__name__} failed with exit code {process.exitcode}")
+    return results.get()
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=PROJECT_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, tolerance):
+    """
+    Print each stage against a previous run and return the stages that
+    got slower or bigger by more than tolerance
+    """
+    previous = {stage['name']: stage for stage in baseline['stages']}
+    regressions = []
+    print(f"Compared with {baseline.get('commit') or 'baseline'} ({baseline.get('timestamp')}):")
+    for stage in results['stages']:
+        before = previous.get(stage['name'])
+        if before is None:
+            continue
+        time_ratio = stage['seconds'] / before['seconds'] if before['seconds'] else float('inf')
+        memory_ratio = stage['peak_rss_mb'] / before['peak_rss_mb'] if before['peak_rss_mb'] else float('inf')
+        slower = time_ratio > 1 + tolerance and stage['seconds'] - before['seconds'] > MIN_REGRESSION_SECONDS
+        bigger = memory_ratio > 1 + tolerance
+        flag = '  REGRESSION' if slower or bigger else ''
+        print(f"  {stage['name']:<20} time {time_ratio - 1:+7.1%}  memory {memory_ratio - 1:+7.1%}{flag}")
+        if flag:
+            regressions.append(stage['name'])
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every pipeline stage on synthetic data')
+    parser.add_argument('--transactions', type=int, default=100000, help='Scale of the synthetic data')
+    parser.add_argument('--workdir', default=None, help='Keep generated and cleaned files here (default: temporary)')
+    parser.add_argument('--skip-generate', action='store_true', help='Reuse the raw files already in --workdir')
+    parser.add_argument('--db-url', default=None, help='SQLAlchemy URL of a scratch database, '
+                                                        'default a SQLite file in the work directory')
+    parser.add_argument('--chunksize', type=int, default=None, help='Clean the raw files in chunks of this many rows')
+    parser.add_argument('--batch-size', type=int, default=10000, help='Rows per load and streaming batch')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=None, help='JSON file to write the results to')
+    parser.add_argument('--compare', default=None, help='JSON results of a previous run to check against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Relative slowdown or memory growth that counts as a regression')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.workdir or tmp
+        db_url = args.db_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        options = {'chunksize': args.chunksize, 'batch_size': args.batch_size}
+
+        results = {
+            'commit': git_commit(),
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'params': {'transactions': args.transactions, 'db': db_url.split(':', 1)[0],
+                       'chunksize': args.chunksize, 'batch_size': args.batch_size, 'seed': args.seed},
+            'stages': [],
+        }
+
+        if not args.skip_generate:
+            start = time.perf_counter()
+            counts = generate(os.path.join(workdir, 'raw'), args.transactions, seed=args.seed)
+            results['params'].update(counts)
+            print(f"Generated raw files in {time.perf_counter() - start:.1f}s")
+
+        for name, func, extra in STAGES:
+            print(f"[{name}] running")
+            stage = measure(func, (workdir, db_url, options) + extra)
+            results['stages'].append(dict(name=name, **stage))
+            print(f"[{name}] {stage['seconds']:.2f}s, {stage['peak_rss_mb']:.0f} MB peak RSS")
+
+    print("Stage results:")
+    for stage in results['stages']:
+        rate = f"{stage['rows'] / stage['seconds']:>12,.0f} rows/s" if stage['rows'] and stage['seconds'] else ''
+        print(f"  {stage['name']:<20} {stage['seconds']:8.2f}s {stage['peak_rss_mb']:8.0f} MB  {rate}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['params'].get('transactions') != args.transactions:
+            print(f"Warning: baseline was run at {baseline['params'].get('transactions')} transactions")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"Regressions in: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Check that the embedded DuckDB and SQLite backends give the same analysis
+results as the PostgreSQL warehouse, and time building them.
+
+The warehouse must hold the cleaned files in --processed-dir, loaded by
+the pipeline with --refresh-summary. For each backend the customer
+summary, RFM scores, CLV estimates and churn predictions are compared
+with the warehouse's, column by column: integers, flags, dates and text
+exactly, floats to a relative tolerance. Exits with status 1 on any
+mismatch.
+
+    python -m benchmarks.parity --db-url postgresql+psycopg2://... --processed-dir data/processed
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.analysis.analyzer import estimate_clv, load_summary, predict_churn, score_rfm
+from src.analysis.backends import LOCAL_BACKENDS, PROCESSED_DIR, LocalBackend
+from src.analysis.churn import train_churn
+from src.db_connection import get_engine
+
+# Floats may differ in the last bits: PostgreSQL divides NUMERIC values
+# to 16 significant digits where the embedded engines divide doubles
+RTOL = 1e-12
+
+def analyze(engine):
+    """
+    Summary, RFM scores, CLV estimates and churn predictions of a backend
+    """
+    df = score_rfm(load_summary(engine))
+    model, accuracy = train_churn(df, use_cache=False)
+    return estimate_clv(predict_churn(df, model)), accuracy
+
+def mismatches(expected, actual, rtol=RTOL):
+    """
+    Columns whose values differ, with the number of rows that differ
+    """
+    if list(expected.columns) != list(actual.columns):
+        return {'columns': f'{list(actual.columns)} != {list(expected.columns)}'}
+    if len(expected) != len(actual):
+        return {'rows': f'{len(actual)} != {len(expected)}'}
+
+    differences = {}
+    for column in expected.columns:
+        left, right = expected[column], actual[column]
+        if pd.api.types.is_float_dtype(left) and pd.api.types.is_float_dtype(right):
+            equal = np.isclose(left, right, rtol=rtol, atol=0, equal_nan=True)
+        else:
+            equal = (left == right) | (left.isna() & right.isna())
+        if not equal.all():
+            differences[column] = int((~equal).sum())
+    return differences
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the embedded analysis backends with PostgreSQL')
+    parser.add_argument('--db-url', required=True, help='SQLAlchemy URL of the loaded warehouse')
+    parser.add_argument('--processed-dir', default=PROCESSED_DIR, help='Cleaned files the warehouse was loaded from')
+    parser.add_argument('--staging', choices=['csv', 'parquet'], default='csv')
+    parser.add_argument('--backend', choices=LOCAL_BACKENDS, nargs='+', default=list(LOCAL_BACKENDS))
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    expected, expected_accuracy = analyze(get_engine(args.db_url))
+    print(f"postgres: {len(expected)} customers analyzed in {time.perf_counter() - start:.2f}s")
+
+    failed = []
+    for kind in args.backend:
+        start = time.perf_counter()
+        with LocalBackend(kind, args.processed_dir, args.staging) as backend:
+            built = time.perf_counter() - start
+            actual, accuracy = analyze(backend.engine)
+        differences = mismatches(expected, actual)
+        if accuracy != expected_accuracy:
+            differences['churn accuracy'] = f'{accuracy:.4f} != {expected_accuracy:.4f}'
+
+        status = 'MISMATCH' if differences else 'ok'
+        print(f"{kind}: built in {built:.2f}s, analyzed in {time.perf_counter() - start - built:.2f}s, {status}")
+        for column, detail in differences.items():
+            print(f"  {column}: {detail}")
+        if differences:
+            failed.append(kind)
+
+    if failed:
+        print(f"Results differ from PostgreSQL on: {', '.join(failed)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
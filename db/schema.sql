@@ -3,20 +3,20 @@
 -- Customer Tiers Table
 CREATE TABLE customer_tiers (
     tier_id SERIAL PRIMARY KEY,
-    tier_name VARCHAR(20),
+    tier_name VARCHAR(20) UNIQUE,
     discount_rate DECIMAL(5, 2)
 );
 
 -- Product Categories Table
 CREATE TABLE product_categories (
     category_id SERIAL PRIMARY KEY,
-    category_name VARCHAR(50)
+    category_name VARCHAR(50) UNIQUE
 );
 
 -- Payment Methods Table
 CREATE TABLE payment_methods (
     payment_method_id SERIAL PRIMARY KEY,
-    payment_method_name VARCHAR(50)
+    payment_method_name VARCHAR(50) UNIQUE
 );
 
 -- Customers Table
@@ -37,9 +37,11 @@ CREATE TABLE customers (
     customer_tier INTEGER REFERENCES customer_tiers(tier_id)
 );
 
--- Transactions Table
+-- Transactions Table, one partition per month of transaction_date. The
+-- ETL creates partitions as new months arrive (src/etl/partitions.py);
+-- the partition column has to be part of the primary key.
 CREATE TABLE transactions (
-    transaction_id SERIAL PRIMARY KEY,
+    transaction_id SERIAL,
     customer_id INTEGER REFERENCES customers(customer_id),
     transaction_date TIMESTAMP,
     amount DECIMAL(10, 2),
@@ -48,12 +50,17 @@ CREATE TABLE transactions (
     product_category INTEGER REFERENCES product_categories(category_id),
     quantity INTEGER,
     discount_applied BOOLEAN,
-    transaction_status VARCHAR(20)
-);
+    transaction_status VARCHAR(20),
+    PRIMARY KEY (transaction_id, transaction_date)
+) PARTITION BY RANGE (transaction_date);
+
+-- Covering index for per-customer summaries up to a date
+CREATE INDEX idx_transactions_customer_date
+    ON transactions (customer_id, transaction_date) INCLUDE (amount, transaction_id);
 
--- Engagements Table
+-- Engagements Table, one partition per month of engagement_date
 CREATE TABLE engagements (
-    engagement_id SERIAL PRIMARY KEY,
+    engagement_id SERIAL,
     customer_id INTEGER REFERENCES customers(customer_id),
     engagement_date DATE,
     login_frequency INTEGER,
@@ -62,5 +69,21 @@ CREATE TABLE engagements (
     purchase_clicks INTEGER,
     feedback_score INTEGER,
     email_open_rate DECIMAL(5, 2),
-    promo_redemptions INTEGER
+    promo_redemptions INTEGER,
+    PRIMARY KEY (engagement_id, engagement_date)
+) PARTITION BY RANGE (engagement_date);
+
+-- Covering index for per-customer engagement averages
+CREATE INDEX idx_engagements_customer_date
+    ON engagements (customer_id, engagement_date)
+    INCLUDE (login_frequency, time_spent, pages_visited, email_open_rate, promo_redemptions);
+
+-- ETL State Table (high-water marks for incremental loads)
+CREATE TABLE etl_state (
+    source VARCHAR(100) PRIMARY KEY,
+    file_checksum VARCHAR(64),
+    byte_offset BIGINT,
+    row_offset BIGINT,
+    max_key INTEGER,
+    updated_at TIMESTAMP
 );
@@ -1,13 +1,10 @@
-import psycopg2
+import os
+import sys
 
-# Connection details
-CONN_DETAILS = {
-    'dbname': 'CustomerDW',
-    'user': 'postgres',
-    'password': '1234',
-    'host': 'localhost',
-    'port': 5432
-}
+# Make the src package importable when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.db_connection import get_engine
 
 # Static data to seed
 CUSTOMER_TIERS = [
@@ -29,9 +26,10 @@ PAYMENT_METHODS = [
 ]
 
 def seed_data():
+    conn = cursor = None
     try:
-        # Connect to PostgreSQL
-        conn = psycopg2.connect(**CONN_DETAILS)
+        # Borrow a connection from the shared pool
+        conn = get_engine().raw_connection()
         cursor = conn.cursor()
 
         # Seed Customer Tiers
@@ -58,8 +56,10 @@ def seed_data():
     except Exception as e:
         print(f"Error seeding data: {e}")
     finally:
-        cursor.close()
-        conn.close()
+        if cursor is not None:
+            cursor.close()
+        if conn is not None:
+            conn.close()
 
 if __name__ == "__main__":
     seed_data()
@@ -1,78 +1,269 @@
-import pandas as pd
-from sklearn.model_selection import train_test_split
-from sklearn.linear_model import LogisticRegression
-from sklearn.metrics import accuracy_score
-from sklearn.impute import SimpleImputer
-
-from sqlalchemy import create_engine
-
-from ..db_connection import DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME
-
-# Database connection
-engine = create_engine(f'postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}')
-
-# Load customer summary data
-df = pd.read_sql("SELECT * FROM customer_summary", engine)
-
-# RFM Scoring
-df['R'] = pd.qcut(df['recency'], 4, labels=[3, 2, 1, 0], duplicates="drop")  # Higher recency = lower score
-df['F'] = pd.qcut(df['total_transactions'], 4, labels=[0, 1, 2], duplicates="drop")  # Higher frequency = higher score
-df['M'] = pd.qcut(df['total_spent'], 4, labels=[0, 1, 2, 3], duplicates="drop")  # Higher monetary = higher score
-
-# Combine RFM Scores
-df['RFM_Score'] = df['R'].astype(str) + df['F'].astype(str) + df['M'].astype(str)
-
-def rfm_level(df):
-    if df['RFM_Score'][1:] in ['33', '23', '13', '03']:
-        return 'Champions'
-    elif df['RFM_Score'][1:] in ['32', '22', '12', '02']:
-        return 'Potential Loyalists'
-    elif df['RFM_Score'][1:] in ['31', '21', '11', '01']:
-        return 'At Risk Customers'
-    elif df['RFM_Score'][1:] in ['30', '20', '10', '00']:
-        return 'Hibernating'
-    else:
-        return 'Other'
+import argparse
+import os
+
+from ..instrumentation import add_arguments, configure_from_args, instrumented, record_rows, stage
+
+# pandas, scikit-learn, SQLAlchemy and the modules built on them are
+# imported inside the functions that use them, so importing this module
+# stays cheap
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+EXPORTS_DIR = os.path.join(PROJECT_ROOT, 'src', 'visualizer', 'exports')
+CLV_EXPORT_PATH = os.path.join(EXPORTS_DIR, 'clv_estimations.csv')
+
+# Customer summary materialized by the ETL, see db/summary.sql. Ordered,
+# so the train/test split and the streaming sample do not depend on the
+# order a backend happens to return rows in.
+SUMMARY_QUERY = "SELECT * FROM customer_summary_mat ORDER BY customer_id"
+
+# Customers sampled for fitting RFM edges and the churn model when streaming
+DEFAULT_SAMPLE_SIZE = 200000
+
+def feature_query():
+    """
+    Features read on the first pass of a streaming run
+    """
+    from .churn import CHURN_FEATURES, CHURN_TARGET
+
+    return f"SELECT {', '.join(CHURN_FEATURES + [CHURN_TARGET])} FROM customer_summary_mat ORDER BY customer_id"
+
+@instrumented()
+def load_summary(engine):
+    """
+    Load the customer summary data
+    """
+    import pandas as pd
+
+    df = coerce_summary(pd.read_sql(SUMMARY_QUERY, engine))
+    record_rows(len(df))
+    return df
+
+def coerce_summary(df):
+    """
+    Give summary columns the types PostgreSQL returns them with; SQLite
+    has no date or boolean types and hands back text and integers
+    """
+    import pandas as pd
+
+    from .churn import CHURN_TARGET
+
+    df = df.copy()
+    if 'last_transaction_date' in df.columns:
+        df['last_transaction_date'] = pd.to_datetime(df['last_transaction_date'])
+    for column in ('total_spent', 'avg_transaction_amount', 'recency'):
+        if column in df.columns:
+            df[column] = df[column].astype(float)
+    if CHURN_TARGET in df.columns:
+        df[CHURN_TARGET] = df[CHURN_TARGET].astype(bool)
+    return df
+
+@instrumented()
+def score_rfm(df, segmenter=None):
+    """
+    Add RFM scores and segments
+    """
+    from .rfm import RFMSegmenter
+
+    record_rows(len(df))
+    segmenter = segmenter or RFMSegmenter()
+    return segmenter.fit_transform(df)
 
-df['Customer_Segment'] = df.apply(rfm_level, axis=1)
+def predict_churn(df, model):
+    """
+    Add the churn_prediction column
+    """
+    from .churn import CHURN_FEATURES
 
-# Save to CSV
-# rfm_csv_path = r'E:\Programs\CustomerSegmentation_DW\src\visualizer\exports\rfm_segments.csv'
-# df.to_csv(rfm_csv_path, index=False)
-# print(f"RFM data saved to {rfm_csv_path}")
+    df = df.copy()
+    df['churn_prediction'] = model.predict(df[CHURN_FEATURES])
+    return df
+
+def estimate_clv(df):
+    """
+    Estimate CLV using a basic model; customers without transactions are
+    worth 0
+    """
+    df = df.copy()
+    df['predicted_clv'] = df['total_spent'] * (df['total_transactions'] / (df['recency'] + 1))
+    df.loc[df['total_transactions'] == 0, 'predicted_clv'] = 0.0
+    return df
+
+def estimate_clv_model(df, engine, as_of=None, by_cohort=False, workers=1):
+    """
+    Estimate CLV with the BG/NBD and Gamma-Gamma models of clv.py, fitted
+    on the warehouse's transactions. Falls back to the formula of
+    estimate_clv when the models cannot be fitted, such as when too few
+    customers have bought more than once.
+    """
+    from .backends import SUMMARY_AS_OF
+    from .clv import FitError, estimate
+
+    try:
+        estimates = estimate(engine, as_of or SUMMARY_AS_OF, by_cohort=by_cohort, workers=workers)
+    except FitError as error:
+        print(f"Cannot estimate CLV with the models: {error}. Falling back to the formula estimate.")
+        return estimate_clv(df)
+    df = df.drop(columns='predicted_clv', errors='ignore')
+    return df.merge(estimates[['customer_id', 'predicted_clv']], on='customer_id', how='left')
+
+def save_segments(engine, df):
+    """
+    Store the RFM segments for the segment cube of the dashboards, when
+    the warehouse has the cubes installed
+    """
+    from ..etl.cubes import cubes_installed, store_segments
+
+    with engine.begin() as connection:
+        if cubes_installed(connection):
+            store_segments(connection, df)
+
+@instrumented()
+def export(df, path=CLV_EXPORT_PATH):
+    """
+    Save the scored customers for the dashboards. Customers without
+    transactions are kept, with empty dates and totals.
+    """
+    record_rows(len(df))
+    df.to_csv(path, index=False)
+    print(f"CLV estimations saved to {path}")
+
+@instrumented('analyze')
+def run(engine, output=CLV_EXPORT_PATH, search=False, n_jobs=-1, model_dir=None, use_cache=True,
+        clv_model='formula', by_cohort=False, workers=1):
+    """
+    Load, segment, predict churn, estimate CLV and export. clv_model
+    'bgnbd' estimates CLV with the BG/NBD and Gamma-Gamma models instead
+    of the formula.
+    """
+    from .churn import MODEL_DIR, train_churn
+
+    df = load_summary(engine)
+    df = score_rfm(df)
+    save_segments(engine, df)
+
+    model, accuracy = train_churn(df, search=search, n_jobs=n_jobs, model_dir=model_dir or MODEL_DIR,
+                                  use_cache=use_cache)
+    print(f"Churn Prediction Model Accuracy: {accuracy * 100:.2f}%")
+    with stage('score_customers'):
+        record_rows(len(df))
+        df = predict_churn(df, model)
+        df = estimate_clv(df)
+    if clv_model == 'bgnbd':
+        df = estimate_clv_model(df, engine, by_cohort=by_cohort, workers=workers)
+    export(df, output)
+    return df
+
+@instrumented('analyze_streaming')
+def run_streaming(engine, output=CLV_EXPORT_PATH, batch_size=None,
+                  sample_size=DEFAULT_SAMPLE_SIZE, sgd=False, search=False, n_jobs=-1,
+                  model_dir=None, use_cache=True):
+    """
+    Same as run, but reads the summary in batches through a server-side
+    cursor so memory stays flat however many customers there are. The RFM
+    edges and churn model are fitted on a uniform sample of sample_size
+    customers (all of them when there are fewer), then each batch is
+    scored and appended to the export. With sgd, the churn model is
+    instead fitted out of core over every customer.
+    """
+    from ..db_connection import STREAM_BATCH_ROWS
+    from .churn import MODEL_DIR, fit_incremental, train_churn
+    from .rfm import RFMSegmenter
+    from .streaming import StreamSample, stream_query
+
+    batch_size = batch_size or STREAM_BATCH_ROWS
+    model_dir = model_dir or MODEL_DIR
+    sample = StreamSample(sample_size)
+    for batch in stream_query(engine, feature_query(), batch_size=batch_size):
+        sample.add(coerce_summary(batch))
+
+    if sample.sample() is None:
+        print("Customer summary is empty, nothing to export")
+        return 0
+
+    segmenter = RFMSegmenter().fit(sample.sample())
+    if sgd:
+        model, accuracy = fit_incremental(
+            lambda: (coerce_summary(batch) for batch in stream_query(engine, feature_query(), batch_size=batch_size)),
+            model_dir=model_dir, use_cache=use_cache
+        )
+        print(f"Churn Prediction Model Accuracy: {accuracy * 100:.2f}% (SGD over {sample.rows_seen} customers)")
+    else:
+        model, accuracy = train_churn(sample.sample(), search=search, n_jobs=n_jobs, model_dir=model_dir,
+                                      use_cache=use_cache)
+        print(f"Churn Prediction Model Accuracy: {accuracy * 100:.2f}% "
+              f"(sample of {len(sample.sample())} / {sample.rows_seen} customers)")
 
+    from ..etl.cubes import append_segments, clear_segments, cubes_installed, rebuild_cubes
 
-# Prepare features and target for churn prediction
-X = df[['recency', 'total_transactions', 'total_spent']]
-y = df['churn_flag']
+    rows = 0
+    # Segments are stored batch by batch for the segment cube, if installed
+    with engine.begin() as connection:
+        keep_segments = cubes_installed(connection)
+        if keep_segments:
+            clear_segments(connection)
 
-imputer = SimpleImputer(strategy='mean')  # You can also use 'median' or 'most_frequent'
-X = imputer.fit_transform(X)
+        for batch in stream_query(engine, SUMMARY_QUERY, batch_size=batch_size):
+            batch = segmenter.transform(coerce_summary(batch))
+            if keep_segments:
+                append_segments(connection, batch)
+            batch = predict_churn(batch, model)
+            batch = estimate_clv(batch)
+            batch.to_csv(output, mode='w' if rows == 0 else 'a', header=rows == 0, index=False)
+            rows += len(batch)
+            record_rows(len(batch))
 
-# Train-test split
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+        if keep_segments:
+            rebuild_cubes(connection, ['segment_month'])
 
-# Train logistic regression model
-model = LogisticRegression()
-model.fit(X_train, y_train)
+    print(f"CLV estimations saved to {output} ({rows} rows)")
+    return rows
 
-# Predict churn
-y_pred = model.predict(X_test)
-accuracy = accuracy_score(y_test, y_pred)
-print(f"Churn Prediction Model Accuracy: {accuracy * 100:.2f}%")
+def main():
+    from ..db_connection import STREAM_BATCH_ROWS
+    from .backends import add_arguments as add_backend_arguments, open_backend
+    from .churn import MODEL_DIR
 
-# Save churn predictions to CSV
-df['churn_prediction'] = model.predict(X)
-# churn_csv_path = r'E:\Programs\CustomerSegmentation_DW\src\visualizer\exports\churn_predictions.csv'
-# df.to_csv(churn_csv_path, index=False)
-# print(f"Churn predictions saved to {churn_csv_path}")
+    parser = argparse.ArgumentParser(description='Segment customers, predict churn and estimate CLV')
+    parser.add_argument('--db-url', default=None, help='SQLAlchemy URL of the warehouse')
+    parser.add_argument('--output', default=CLV_EXPORT_PATH, help='CSV file for the scored customers')
+    parser.add_argument('--stream', action='store_true',
+                        help='Read and score the summary in batches instead of all at once')
+    parser.add_argument('--batch-size', type=int, default=STREAM_BATCH_ROWS, help='Rows per streamed batch')
+    parser.add_argument('--sample-size', type=int, default=DEFAULT_SAMPLE_SIZE,
+                        help='Customers sampled to fit the segmenter and churn model when streaming')
+    parser.add_argument('--sgd', action='store_true',
+                        help='With --stream, fit the churn model out of core over every customer')
+    parser.add_argument('--search', action='store_true', help='Grid search the churn model hyperparameters')
+    parser.add_argument('--n-jobs', type=int, default=-1, help='Cores used by the grid search (-1 for all)')
+    parser.add_argument('--model-dir', default=MODEL_DIR, help='Directory of cached churn models')
+    parser.add_argument('--no-model-cache', action='store_true',
+                        help='Always retrain the churn model instead of reusing a cached one')
+    parser.add_argument('--clv-model', choices=['formula', 'bgnbd'], default='formula',
+                        help='Estimate CLV with the summary formula or the BG/NBD and Gamma-Gamma models')
+    parser.add_argument('--by-cohort', action='store_true', help='With --clv-model bgnbd, fit per signup month')
+    parser.add_argument('--workers', type=int, default=1, help='Processes fitting the CLV cohorts')
+    add_backend_arguments(parser)
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+    if args.stream and args.clv_model != 'formula':
+        parser.error('--stream only supports --clv-model formula')
 
+    engine, backend = open_backend(args)
+    if not engine:
+        return
 
-# Estimate CLV using a basic model
-df['predicted_clv'] = df['total_spent'] * (df['total_transactions'] / (df['recency'] + 1))
+    training = {'search': args.search, 'n_jobs': args.n_jobs, 'model_dir': args.model_dir,
+                'use_cache': not args.no_model_cache}
+    try:
+        if args.stream:
+            run_streaming(engine, args.output, args.batch_size, args.sample_size, sgd=args.sgd, **training)
+        else:
+            run(engine, args.output, clv_model=args.clv_model, by_cohort=args.by_cohort, workers=args.workers,
+                **training)
+    finally:
+        if backend is not None:
+            backend.close()
 
-df = df.dropna()
-# Save CLV data to CSV
-clv_csv_path = r'E:\Programs\CustomerSegmentation_DW\src\visualizer\exports\clv_estimations.csv'
-df.to_csv(clv_csv_path, index=False)
-print(f"CLV estimations saved to {clv_csv_path}")
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from sqlalchemy import Boolean, Date, DateTime, Integer, Numeric
+
+from ..instrumentation import instrumented
+from ..models import Base
+from ..staging import STAGING_FORMATS, is_columnar
+from .snapshots import CHURN_DAYS
+
+# Backends the analysis can run on: the PostgreSQL warehouse, or an
+# embedded engine over the cleaned files. duckdb needs the duckdb and
+# duckdb-engine packages; sqlite only needs the standard library.
+BACKENDS = ('postgres', 'duckdb', 'sqlite')
+LOCAL_BACKENDS = ('duckdb', 'sqlite')
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PROCESSED_DIR = os.path.join(PROJECT_ROOT, 'data', 'processed')
+
+TABLES = ('customers', 'transactions', 'engagements')
+
+# Snapshot date of the customer_summary view in db/summary.sql
+SUMMARY_AS_OF = '2021-12-31'
+
+# customer_summary_as_of from db/summary.sql, with the expressions whose
+# spelling differs between engines filled in per dialect
+SUMMARY_SQL = """
+CREATE TABLE customer_summary_mat AS
+SELECT
+    c.customer_id,
+    c.first_name,
+    c.last_name,
+    MAX(t.transaction_date) AS last_transaction_date,
+    COUNT(t.transaction_id) AS total_transactions,
+    {total_spent} AS total_spent,
+    {avg_transaction_amount} AS avg_transaction_amount,
+    {recency} AS recency,
+    CASE
+        WHEN {recency} > {churn_days} THEN TRUE
+        ELSE FALSE
+    END AS churn_flag
+FROM
+    customers c
+LEFT JOIN
+    transactions t ON c.customer_id = t.customer_id
+                  AND t.transaction_date < {next_day}
+GROUP BY
+    c.customer_id, c.first_name, c.last_name
+"""
+
+SUMMARY_EXPRESSIONS = {
+    # Amounts are DECIMAL, so sums are exact as in PostgreSQL. EXTRACT(DAY
+    # FROM interval) keeps whole days, truncating toward zero.
+    'duckdb': {
+        'total_spent': "SUM(t.amount)",
+        'avg_transaction_amount': "CAST(SUM(t.amount) AS DOUBLE) / COUNT(t.amount)",
+        'recency': "trunc((epoch(TIMESTAMP '{as_of}') - epoch(MAX(t.transaction_date))) / 86400)",
+        'next_day': "DATE '{as_of}' + INTERVAL 1 DAY",
+    },
+    # Amounts are REAL, so they are summed as whole cents to stay exact;
+    # integer division truncates toward zero like EXTRACT(DAY ...)
+    'sqlite': {
+        'total_spent': "SUM(ROUND(t.amount * 100)) / 100.0",
+        'avg_transaction_amount': "SUM(ROUND(t.amount * 100)) / (100.0 * COUNT(t.amount))",
+        'recency': "(CAST(strftime('%s', '{as_of}') AS INTEGER) "
+                   "- CAST(strftime('%s', MAX(t.transaction_date)) AS INTEGER)) / 86400",
+        'next_day': "date('{as_of}', '+1 day')",
+    },
+}
+
+def summary_sql(dialect, as_of=SUMMARY_AS_OF, churn_days=CHURN_DAYS):
+    expressions = {name: expression.format(as_of=as_of)
+                   for name, expression in SUMMARY_EXPRESSIONS[dialect].items()}
+    return SUMMARY_SQL.format(churn_days=churn_days, **expressions)
+
+def duckdb_type(column):
+    """
+    DuckDB type of a warehouse column. Dimension keys stay as the names
+    the cleaned files hold.
+    """
+    if column.foreign_keys and column.name != 'customer_id':
+        return 'VARCHAR'
+    if isinstance(column.type, Integer):
+        return 'INTEGER'
+    if isinstance(column.type, Numeric):
+        return f'DECIMAL({column.type.precision}, {column.type.scale})'
+    if isinstance(column.type, DateTime):
+        return 'TIMESTAMP'
+    if isinstance(column.type, Date):
+        return 'DATE'
+    if isinstance(column.type, Boolean):
+        return 'BOOLEAN'
+    return 'VARCHAR'
+
+def duckdb_scan(path):
+    """
+    Table function reading a cleaned file, every column as text for CSV
+    """
+    if is_columnar(path):
+        return f"read_parquet('{path}/**/*.parquet', hive_partitioning = true, union_by_name = true)"
+    return f"read_csv('{path}', header = true, all_varchar = true)"
+
+def duckdb_select(table_name, path, columns):
+    """
+    SELECT casting a cleaned file's columns to the types of the warehouse
+    table, leaving out the ones the table does not have
+    """
+    table = Base.metadata.tables[table_name]
+    casts = []
+    for column in table.columns:
+        if column.name not in columns:
+            continue
+        target = duckdb_type(column)
+        source = column.name
+        # Integer columns holding missing values were written as floats
+        if target == 'INTEGER':
+            source = f'CAST({source} AS DOUBLE)'
+        casts.append(f'CAST({source} AS {target}) AS {column.name}')
+    return f"SELECT {', '.join(casts)} FROM {duckdb_scan(path)}"
+
+class LocalBackend:
+    """
+    Embedded database built from the cleaned files, with the same tables
+    and customer_summary_mat as the warehouse, for analysis without a
+    PostgreSQL server.
+
+    duckdb reads the files with its own parallel CSV and Parquet readers;
+    sqlite loads them through the bulk loader. Either way .engine is a
+    SQLAlchemy engine the analyzer and clusters run on unchanged. The
+    database lives in a temporary directory unless a path is given, and
+    is removed by close().
+    """
+
+    def __init__(self, kind='duckdb', processed_dir=PROCESSED_DIR, staging='csv', database=None,
+                 as_of=SUMMARY_AS_OF):
+        if kind not in LOCAL_BACKENDS:
+            raise ValueError(f"Unknown local backend {kind!r}, expected one of {LOCAL_BACKENDS}")
+        self.kind = kind
+        self.processed_dir = processed_dir
+        self.staging = staging
+        self.as_of = as_of
+        self.tmp_dir = None if database else tempfile.mkdtemp(prefix='customerdw-')
+        self.database = database or os.path.join(self.tmp_dir, f'warehouse.{kind}')
+        self.engine = None
+
+    def __enter__(self):
+        return self.build()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def staged_path(self, table_name):
+        return os.path.join(self.processed_dir, f'cleaned_{table_name}{STAGING_FORMATS[self.staging]}')
+
+    @instrumented('local_{self.kind}')
+    def build(self):
+        """
+        Load the cleaned files and materialize the customer summary
+        """
+        from ..db_connection import get_engine
+
+        start = time.perf_counter()
+        if self.kind == 'duckdb':
+            try:
+                import duckdb_engine  # noqa: F401
+            except ImportError as error:
+                raise ImportError("The duckdb backend needs: pip install duckdb duckdb-engine") from error
+
+        if os.path.exists(self.database):
+            os.remove(self.database)
+        self.engine = get_engine(f'{self.kind}:///{self.database}')
+
+        if self.kind == 'duckdb':
+            self.load_duckdb()
+        else:
+            self.load_sqlite()
+
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql(summary_sql(self.kind, self.as_of))
+            connection.exec_driver_sql(
+                "CREATE UNIQUE INDEX idx_customer_summary_mat ON customer_summary_mat (customer_id)"
+            )
+
+        print(f"Built the {self.kind} backend from {self.processed_dir} in {time.perf_counter() - start:.2f}s")
+        return self
+
+    def load_duckdb(self):
+        with self.engine.begin() as connection:
+            for table_name in TABLES:
+                path = self.staged_path(table_name)
+                columns = set(connection.exec_driver_sql(
+                    f"SELECT * FROM {duckdb_scan(path)} LIMIT 0"
+                ).keys())
+                connection.exec_driver_sql(
+                    f"CREATE TABLE {table_name} AS {duckdb_select(table_name, path, columns)}"
+                )
+
+    def load_sqlite(self):
+        from ..etl.bulk_load import bulk_load_csv
+        from ..etl.dimension_cache import DimensionCache
+
+        Base.metadata.create_all(self.engine)
+        cache = DimensionCache()
+        for table_name in TABLES:
+            bulk_load_csv(self.engine, self.staged_path(table_name), table_name, cache=cache)
+
+    def close(self):
+        from ..db_connection import dispose_engine
+
+        if self.engine is not None:
+            dispose_engine(self.engine)
+            self.engine = None
+        if self.tmp_dir is not None:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+def add_arguments(parser):
+    """
+    Add the backend selection flags to a command line parser
+    """
+    parser.add_argument('--backend', choices=BACKENDS, default='postgres',
+                        help='Run on the warehouse, or on an embedded engine over the cleaned files')
+    parser.add_argument('--processed-dir', default=PROCESSED_DIR,
+                        help='Directory with the cleaned files, for the duckdb and sqlite backends')
+    parser.add_argument('--staging', choices=sorted(STAGING_FORMATS), default='csv',
+                        help='Format of the cleaned files, for the duckdb and sqlite backends')
+
+def open_backend(args):
+    """
+    Engine for the backend chosen on the command line, and the local
+    backend to close afterwards (None for the warehouse)
+    """
+    if args.backend == 'postgres':
+        from ..etl.script import create_db_engine
+
+        return create_db_engine(args.db_url), None
+
+    backend = LocalBackend(args.backend, args.processed_dir, args.staging).build()
+    return backend.engine, backend
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a local analysis database from the cleaned files')
+    parser.add_argument('--backend', choices=LOCAL_BACKENDS, default='duckdb')
+    parser.add_argument('--processed-dir', default=PROCESSED_DIR, help='Directory with the cleaned files')
+    parser.add_argument('--staging', choices=sorted(STAGING_FORMATS), default='csv')
+    parser.add_argument('--database', required=True, help='Database file to write')
+    args = parser.parse_args()
+
+    backend = LocalBackend(args.backend, args.processed_dir, args.staging, args.database).build()
+    backend.close()
+    print(f"Local {args.backend} database saved to {args.database}")
+
+if __name__ == '__main__':
+    main()
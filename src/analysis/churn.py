@@ -0,0 +1,232 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from ..instrumentation import instrumented, record_rows
+
+# scikit-learn and joblib are imported inside the functions that use them,
+# so importing this module stays cheap
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+MODEL_DIR = os.path.join(PROJECT_ROOT, 'data', 'models')
+
+CHURN_FEATURES = ['recency', 'total_transactions', 'total_spent']
+CHURN_TARGET = 'churn_flag'
+
+# Hyperparameters tried by the grid search
+PARAM_GRID = {
+    'logisticregression__C': [0.01, 0.1, 1.0, 10.0],
+    'logisticregression__class_weight': [None, 'balanced'],
+}
+
+def row_hashes(df):
+    """
+    64-bit hash of each training row
+    """
+    return pd.util.hash_pandas_object(df[CHURN_FEATURES + [CHURN_TARGET]], index=False).to_numpy()
+
+class TrainingFingerprint:
+    """
+    Hash of the training rows, fed one batch at a time. Row hashes are
+    summed, so the same rows give the same fingerprint in any order or
+    batching. The salt covers the training settings.
+    """
+
+    def __init__(self, *salt):
+        import sklearn
+
+        self.salt = repr((sklearn.__version__,) + salt)
+        self.total = 0
+        self.rows = 0
+
+    def update(self, df):
+        """
+        Add a batch and return the hash of each of its rows
+        """
+        hashes = row_hashes(df)
+        self.total = (self.total + int(hashes.sum(dtype=np.uint64))) % (1 << 64)
+        self.rows += len(hashes)
+        return hashes
+
+    def hexdigest(self):
+        return hashlib.sha256(f'{self.salt}|{self.rows}|{self.total}'.encode()).hexdigest()
+
+def model_path(fingerprint, model_dir=MODEL_DIR):
+    return os.path.join(model_dir, f'churn-{fingerprint[:16]}.joblib')
+
+def load_cached_model(fingerprint, model_dir=MODEL_DIR):
+    """
+    Return the (model, accuracy) cached for a fingerprint, or None
+    """
+    import joblib
+
+    path = model_path(fingerprint, model_dir)
+    if not os.path.exists(path):
+        return None
+
+    entry = joblib.load(path)
+    if entry.get('fingerprint') != fingerprint:
+        return None
+    print(f"Reusing cached churn model {path}")
+    return entry['model'], entry['accuracy']
+
+def save_model(model, accuracy, fingerprint, model_dir=MODEL_DIR):
+    """
+    Persist a fitted pipeline under its training data fingerprint
+    """
+    import joblib
+
+    os.makedirs(model_dir, exist_ok=True)
+    path = model_path(fingerprint, model_dir)
+    # Write then rename, so a concurrent reader never sees a partial file
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    joblib.dump({'fingerprint': fingerprint, 'model': model, 'accuracy': accuracy}, tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+def churn_pipeline():
+    from sklearn.impute import SimpleImputer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import make_pipeline
+
+    return make_pipeline(SimpleImputer(strategy='mean'), LogisticRegression())
+
+def fit_pipeline(df, test_size=0.2, random_state=42):
+    """
+    Fit the imputer + logistic regression pipeline and score it on a hold-out split
+    """
+    from sklearn.metrics import accuracy_score
+    from sklearn.model_selection import train_test_split
+
+    X = df[CHURN_FEATURES]
+    y = df[CHURN_TARGET].astype(bool)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=random_state)
+
+    model = churn_pipeline()
+    model.fit(X_train, y_train)
+    return model, accuracy_score(y_test, model.predict(X_test))
+
+def search_pipeline(df, param_grid=PARAM_GRID, cv=3, n_jobs=-1, test_size=0.2, random_state=42):
+    """
+    Grid search the pipeline's hyperparameters with cross-validation, one
+    candidate fit per core through joblib, and score the best on a hold-out split
+    """
+    from sklearn.metrics import accuracy_score
+    from sklearn.model_selection import GridSearchCV, train_test_split
+
+    X = df[CHURN_FEATURES]
+    y = df[CHURN_TARGET].astype(bool)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=random_state)
+
+    search = GridSearchCV(churn_pipeline(), param_grid, cv=cv, n_jobs=n_jobs, scoring='accuracy')
+    search.fit(X_train, y_train)
+    print(f"Best churn parameters: {search.best_params_} (cv accuracy {search.best_score_ * 100:.2f}%)")
+
+    model = search.best_estimator_
+    return model, accuracy_score(y_test, model.predict(X_test))
+
+@instrumented()
+def train_churn(df, test_size=0.2, random_state=42, search=False, n_jobs=-1, model_dir=MODEL_DIR,
+                use_cache=True):
+    """
+    Train the churn model on the summary features, returning the fitted
+    pipeline and its hold-out accuracy. A model trained on the same rows
+    with the same settings is loaded from model_dir instead of refitted.
+    Rows are put in the order of their hashes before the split, so the
+    split, like the fingerprint, does not depend on the input order.
+    """
+    fingerprint = TrainingFingerprint('logistic', test_size, random_state, PARAM_GRID if search else None)
+    hashes = fingerprint.update(df)
+    digest = fingerprint.hexdigest()
+    df = df.iloc[np.argsort(hashes, kind='stable')]
+    record_rows(len(df))
+
+    if use_cache:
+        cached = load_cached_model(digest, model_dir)
+        if cached:
+            return cached
+
+    if search:
+        model, accuracy = search_pipeline(df, n_jobs=n_jobs, test_size=test_size, random_state=random_state)
+    else:
+        model, accuracy = fit_pipeline(df, test_size, random_state)
+
+    if use_cache:
+        save_model(model, accuracy, digest, model_dir)
+    return model, accuracy
+
+@instrumented()
+def fit_incremental(batches, epochs=5, holdout=5, alpha=1e-4, random_state=42, model_dir=MODEL_DIR,
+                    use_cache=True):
+    """
+    Fit the churn model out of core with SGD logistic regression.
+
+    batches is a callable returning a fresh iterator of DataFrames and is
+    called once per pass: one to fingerprint the data and fit the scaler,
+    one per epoch, and one to measure accuracy. Rows whose hash is a
+    multiple of holdout are kept out of training for the accuracy. Missing
+    features are imputed with the mean, which is 0 after scaling.
+    """
+    from sklearn.impute import SimpleImputer
+    from sklearn.linear_model import SGDClassifier
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+
+    scaler = StandardScaler()
+    fingerprint = TrainingFingerprint('sgd', epochs, holdout, alpha, random_state)
+    for batch in batches():
+        train = fingerprint.update(batch) % holdout != 0
+        record_rows(len(batch))
+        if train.any():
+            scaler.partial_fit(batch.loc[train, CHURN_FEATURES])
+    digest = fingerprint.hexdigest()
+
+    if use_cache:
+        cached = load_cached_model(digest, model_dir)
+        if cached:
+            return cached
+
+    imputer = SimpleImputer(strategy='constant', fill_value=0.0).fit(np.zeros((1, len(CHURN_FEATURES))))
+    classifier = SGDClassifier(loss='log_loss', alpha=alpha, random_state=random_state)
+    classes = np.array([False, True])
+
+    for _ in range(epochs):
+        for batch in batches():
+            train = row_hashes(batch) % holdout != 0
+            if train.any():
+                X = imputer.transform(scaler.transform(batch.loc[train, CHURN_FEATURES]))
+                classifier.partial_fit(X, batch.loc[train, CHURN_TARGET].astype(bool), classes=classes)
+
+    model = make_pipeline(scaler, imputer, classifier)
+    correct = tested = 0
+    for batch in batches():
+        test = row_hashes(batch) % holdout == 0
+        if test.any():
+            predicted = model.predict(batch.loc[test, CHURN_FEATURES])
+            correct += int((predicted == batch.loc[test, CHURN_TARGET].astype(bool)).sum())
+            tested += int(test.sum())
+    accuracy = correct / tested if tested else float('nan')
+
+    if use_cache:
+        save_model(model, accuracy, digest, model_dir)
+    return model, accuracy
+
+def load_model(path=None, model_dir=MODEL_DIR):
+    """
+    Load a persisted churn pipeline, by default the most recently trained
+    one in model_dir
+    """
+    import joblib
+
+    if path is None:
+        candidates = [
+            os.path.join(model_dir, name) for name in os.listdir(model_dir)
+            if name.startswith('churn-') and name.endswith('.joblib')
+        ] if os.path.isdir(model_dir) else []
+        if not candidates:
+            raise FileNotFoundError(f"No churn model in {model_dir}, train one with src.analysis.analyzer")
+        path = max(candidates, key=os.path.getmtime)
+
+    return joblib.load(path)['model']
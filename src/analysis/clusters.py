@@ -0,0 +1,173 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from ..db_connection import STREAM_BATCH_ROWS
+from ..instrumentation import add_arguments, configure_from_args, instrumented, record_rows
+from .streaming import stream_query
+
+# scikit-learn is imported inside the functions that use it, so importing
+# this module stays cheap
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CLUSTER_EXPORT_PATH = os.path.join(PROJECT_ROOT, 'src', 'visualizer', 'exports', 'customer_clusters.csv')
+
+CLUSTER_FEATURES = [
+    'total_transactions', 'total_spent', 'avg_transaction_amount',
+    'login_frequency', 'time_spent', 'pages_visited', 'email_open_rate', 'promo_redemptions',
+]
+
+# Heavy-tailed monetary features are clustered on a log scale
+LOG_FEATURES = ['total_spent', 'avg_transaction_amount']
+
+# One row per customer, aggregated in the database. Plain SQL, so it runs
+# on SQLite as well as PostgreSQL.
+FEATURE_QUERY = """
+SELECT c.customer_id,
+       COALESCE(t.total_transactions, 0) AS total_transactions,
+       COALESCE(t.total_spent, 0) AS total_spent,
+       t.avg_transaction_amount,
+       e.login_frequency, e.time_spent, e.pages_visited, e.email_open_rate, e.promo_redemptions
+FROM customers c
+LEFT JOIN (
+    SELECT customer_id, COUNT(*) AS total_transactions, SUM(amount) AS total_spent,
+           AVG(amount) AS avg_transaction_amount
+    FROM transactions
+    GROUP BY customer_id
+) t ON t.customer_id = c.customer_id
+LEFT JOIN (
+    SELECT customer_id, AVG(login_frequency) AS login_frequency, AVG(time_spent) AS time_spent,
+           AVG(pages_visited) AS pages_visited, AVG(email_open_rate) AS email_open_rate,
+           AVG(promo_redemptions) AS promo_redemptions
+    FROM engagements
+    GROUP BY customer_id
+) e ON e.customer_id = c.customer_id
+ORDER BY c.customer_id
+"""
+
+def feature_matrix(df):
+    """
+    Clustering features of a batch as a float array, monetary columns on a log scale
+    """
+    features = df[CLUSTER_FEATURES].astype(float)
+    features[LOG_FEATURES] = np.log1p(features[LOG_FEATURES].clip(lower=0))
+    return features
+
+class ClusterSegmenter:
+    """
+    Behavioral segments from MiniBatchKMeans over transaction and
+    engagement features.
+
+    Like churn.fit_incremental, fit() takes a callable returning a fresh
+    iterator of DataFrames and makes one pass to fit the scaler, then one
+    per epoch feeding the clusterer mini-batches of batch_size rows. Missing
+    features (customers without engagements, say) are imputed with the
+    mean, which is 0 after scaling.
+    """
+
+    def __init__(self, n_clusters=6, batch_size=10000, epochs=3, random_state=42):
+        self.n_clusters = n_clusters
+        self.batch_size = batch_size
+        self.epochs = epochs
+        self.random_state = random_state
+        self.scaler = None
+        self.kmeans = None
+
+    def chunks(self, batches):
+        for batch in batches():
+            for start in range(0, len(batch), self.batch_size):
+                yield batch.iloc[start:start + self.batch_size]
+
+    def scaled(self, df):
+        return np.nan_to_num(self.scaler.transform(feature_matrix(df)), nan=0.0)
+
+    @instrumented('fit_clusters')
+    def fit(self, batches):
+        from sklearn.cluster import MiniBatchKMeans
+        from sklearn.preprocessing import StandardScaler
+
+        self.scaler = StandardScaler()
+        for chunk in self.chunks(batches):
+            self.scaler.partial_fit(feature_matrix(chunk))
+            record_rows(len(chunk))
+
+        self.kmeans = MiniBatchKMeans(n_clusters=self.n_clusters, batch_size=self.batch_size,
+                                      random_state=self.random_state, n_init=3)
+        for _ in range(self.epochs):
+            for chunk in self.chunks(batches):
+                # The first mini-batch has to hold at least one row per cluster
+                if len(chunk) >= self.n_clusters or hasattr(self.kmeans, 'cluster_centers_'):
+                    self.kmeans.partial_fit(self.scaled(chunk))
+        return self
+
+    def transform(self, df):
+        """
+        Add the cluster of each customer
+        """
+        df = df.copy()
+        df['cluster'] = self.kmeans.predict(self.scaled(df)) if len(df) else np.array([], dtype=np.int32)
+        return df
+
+    def assign(self, batches):
+        """
+        Yield each batch with its clusters assigned
+        """
+        for batch in batches():
+            yield self.transform(batch)
+
+    def profile(self):
+        """
+        Cluster centres in the original feature units
+        """
+        centres = pd.DataFrame(self.scaler.inverse_transform(self.kmeans.cluster_centers_),
+                               columns=CLUSTER_FEATURES)
+        centres[LOG_FEATURES] = np.expm1(centres[LOG_FEATURES])
+        centres.index.name = 'cluster'
+        return centres
+
+@instrumented('segment_clusters')
+def run(engine, output=CLUSTER_EXPORT_PATH, n_clusters=6, batch_size=STREAM_BATCH_ROWS):
+    """
+    Fit clusters over every customer and export each customer's cluster
+    """
+    def batches():
+        return stream_query(engine, FEATURE_QUERY, batch_size=batch_size)
+
+    segmenter = ClusterSegmenter(n_clusters, batch_size).fit(batches)
+
+    rows = 0
+    for batch in segmenter.assign(batches):
+        batch.to_csv(output, mode='w' if rows == 0 else 'a', header=rows == 0, index=False)
+        rows += len(batch)
+        record_rows(len(batch))
+
+    print(segmenter.profile().round(2).to_string())
+    print(f"Clusters of {rows} customers saved to {output}")
+    return segmenter
+
+def main():
+    from .backends import add_arguments as add_backend_arguments, open_backend
+
+    parser = argparse.ArgumentParser(description='Segment customers with MiniBatchKMeans')
+    parser.add_argument('--db-url', default=None, help='SQLAlchemy URL of the warehouse')
+    parser.add_argument('--output', default=CLUSTER_EXPORT_PATH, help='CSV file for the customer clusters')
+    parser.add_argument('--clusters', type=int, default=6)
+    parser.add_argument('--batch-size', type=int, default=STREAM_BATCH_ROWS, help='Rows per mini-batch')
+    add_backend_arguments(parser)
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+
+    engine, backend = open_backend(args)
+    if not engine:
+        return
+    try:
+        run(engine, args.output, args.clusters, args.batch_size)
+    finally:
+        if backend is not None:
+            backend.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,409 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from ..instrumentation import add_arguments, configure_from_args, instrumented, record_fields, record_rows
+from .snapshots import load_staged_transactions, load_transactions
+
+# scipy is imported inside the functions that use it, so importing this
+# module stays cheap
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+EXPORTS_DIR = os.path.join(PROJECT_ROOT, 'src', 'visualizer', 'exports')
+CLV_MODEL_EXPORT_PATH = os.path.join(EXPORTS_DIR, 'clv_model.csv')
+
+# CLV is the margin on the purchases expected over the horizon, discounted
+# per period. Time is counted in days throughout.
+HORIZON_DAYS = 365
+PERIOD_DAYS = 30
+DISCOUNT_RATE = 0.01
+MARGIN = 1.0
+
+# Cohorts with fewer repeat customers than this use the model fitted on
+# everyone instead of their own
+MIN_COHORT_SIZE = 500
+
+# Customers with priced repeat purchases needed to fit the models at all.
+# Without repeat purchases there is nothing to estimate the dropout (a, b)
+# or spend (p, q, v) parameters from.
+MIN_REPEAT_CUSTOMERS = 30
+
+# The expected purchases' closed form is 0/0 at a = 1, though continuous
+# there; a is kept at least this far from 1
+A_GAP = 1e-6
+
+# Customers predicted and written per chunk
+DEFAULT_CHUNK_SIZE = 100000
+
+UNKNOWN_COHORT = 'unknown'
+
+# Range the logs of the model parameters are searched in. Parameters run
+# off toward the ends when the data has next to no dropout or spend
+# variation; these keep them finite.
+LOG_BOUNDS = (-20.0, 30.0)
+
+PARAMETERS = ['r', 'alpha', 'a', 'b', 'p', 'q', 'v']
+
+OUTPUT_COLUMNS = [
+    'customer_id', 'cohort', 'frequency', 'recency', 'T', 'monetary',
+    'prob_alive', 'expected_purchases', 'expected_spend', 'predicted_clv',
+]
+
+class FitError(ValueError):
+    """
+    The models cannot be fitted on the customers given, or gave no usable fit
+    """
+
+def customer_arrays(transactions, customers, as_of):
+    """
+    Per-customer inputs of the BG/NBD and Gamma-Gamma models at as_of,
+    for every customer in customers.
+
+    Purchases are counted per day, as in the models a customer buys at
+    most once per time unit. frequency is the number of purchase days
+    after the first, recency the days from the first purchase day to the
+    last, T the days from the first purchase day to as_of, and monetary
+    the mean spend of the repeat purchase days. Customers with no purchase
+    yet count from their signup date: no repeat purchases in T days.
+    cohort is the signup month.
+    """
+    customers = customers.sort_values('customer_id', ignore_index=True)
+    customer_ids = customers['customer_id'].to_numpy()
+    as_of_day = np.datetime64(pd.Timestamp(as_of).normalize(), 'D').astype(np.int64)
+
+    tx = transactions[['customer_id', 'transaction_date', 'amount']]
+    tx = tx.dropna(subset=['customer_id', 'transaction_date'])
+    codes = pd.Index(customer_ids).get_indexer(tx['customer_id'])
+    days = pd.to_datetime(tx['transaction_date']).to_numpy().astype('datetime64[D]').astype(np.int64)
+    keep = (codes >= 0) & (days <= as_of_day)
+    codes, days = codes[keep].astype(np.int64), days[keep]
+    amounts = pd.to_numeric(tx['amount']).to_numpy(dtype=np.float64)[keep]
+
+    # One key per (customer, day), sorted by np.unique, so purchase days
+    # and their spend come out grouped by customer in date order
+    origin = days.min() if len(days) else 0
+    span = (days.max() - origin + 1) if len(days) else 1
+    keys, inverse = np.unique(codes * span + (days - origin), return_inverse=True)
+    has_amount = ~np.isnan(amounts)
+    day_spend = np.bincount(inverse, weights=np.where(has_amount, amounts, 0.0), minlength=len(keys))
+    day_priced = np.bincount(inverse, weights=has_amount, minlength=len(keys)) > 0
+    day_codes, purchase_days = keys // span, keys % span + origin
+
+    n = len(customer_ids)
+    purchases = np.bincount(day_codes, minlength=n)
+    starts = np.searchsorted(day_codes, np.arange(n), side='left')
+    bought = purchases > 0
+    first = np.where(bought, purchase_days[np.minimum(starts, len(keys) - 1)] if len(keys) else 0, 0)
+    last = np.where(bought, purchase_days[np.maximum(starts + purchases - 1, 0)] if len(keys) else 0, 0)
+
+    # Spend of the repeat days: everything but each customer's first day
+    repeat = np.ones(len(keys), dtype=bool)
+    repeat[starts[bought]] = False
+    repeat_spend = np.bincount(day_codes[repeat & day_priced], weights=day_spend[repeat & day_priced], minlength=n)
+    repeat_priced = np.bincount(day_codes[repeat & day_priced], minlength=n)
+
+    signup = pd.to_datetime(customers['signup_date'])
+    signup_day = signup.to_numpy().astype('datetime64[D]').astype(np.int64)
+    age = np.where(signup.notna(), np.maximum(as_of_day - signup_day, 0), 0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        monetary = np.where(repeat_priced > 0, repeat_spend / repeat_priced, np.nan)
+
+    return pd.DataFrame({
+        'customer_id': customer_ids,
+        'cohort': signup.dt.strftime('%Y-%m').fillna(UNKNOWN_COHORT).to_numpy(),
+        'frequency': np.maximum(purchases - 1, 0).astype(np.float64),
+        'recency': (last - first).astype(np.float64),
+        'T': np.where(bought, as_of_day - first, age).astype(np.float64),
+        'monetary': monetary,
+        'bought': bought,
+    })
+
+def bgnbd_log_likelihood(params, x, t_x, T):
+    """
+    Log-likelihood of each (frequency, recency, T) under the BG/NBD model
+    with parameters r, alpha, a, b (Fader, Hardie and Lee, 2005)
+    """
+    from scipy.special import betaln, gammaln
+
+    r, alpha, a, b = params
+    base = gammaln(r + x) - gammaln(r) + r * np.log(alpha) - betaln(a, b)
+    alive = betaln(a, b + x) - (r + x) * np.log(alpha + T)
+    # Only customers with repeat purchases can have dropped out since
+    dropped = np.where(x > 0, betaln(a + 1, b + np.maximum(x, 1) - 1) - (r + x) * np.log(alpha + t_x), -np.inf)
+    return base + np.logaddexp(alive, dropped)
+
+def gamma_gamma_log_likelihood(params, x, m):
+    """
+    Log-likelihood of each repeat customer's mean spend m over x purchases
+    under the Gamma-Gamma model with parameters p, q, v
+    """
+    from scipy.special import gammaln
+
+    p, q, v = params
+    px = p * x
+    return (gammaln(px + q) - gammaln(px) - gammaln(q) + q * np.log(v)
+            + (px - 1) * np.log(m) + px * np.log(x) - (px + q) * np.log(x * m + v))
+
+def maximize(log_likelihood, columns, start):
+    """
+    Fit parameters by maximum likelihood over their logs, so they stay
+    positive. Customers with the same inputs share one likelihood term,
+    weighted by how many there are.
+    """
+    from scipy.optimize import minimize
+
+    unique, counts = np.unique(np.column_stack(columns), axis=0, return_counts=True)
+    unique = list(unique.T)
+    total = counts.sum()
+
+    def objective(log_params):
+        with np.errstate(over='ignore', invalid='ignore'):
+            values = log_likelihood(np.exp(log_params), *unique)
+        return -np.dot(counts, values) / total if np.isfinite(values).all() else np.inf
+
+    result = minimize(objective, np.log(start), method='L-BFGS-B', bounds=[LOG_BOUNDS] * len(start))
+    if not result.success or not np.isfinite(result.fun):
+        raise FitError(f"CLV model fit did not converge: {result.message}")
+    return np.exp(result.x)
+
+def fit_models(frequency, recency, T, monetary, bought):
+    """
+    BG/NBD parameters r, alpha, a, b from the customers who have bought,
+    and Gamma-Gamma parameters p, q, v from those with priced repeat
+    purchases, as one array. Raises FitError with fewer than
+    MIN_REPEAT_CUSTOMERS repeat customers, or when a fit does not converge.
+    """
+    repeat = (frequency > 0) & (monetary > 0)
+    if repeat.sum() < MIN_REPEAT_CUSTOMERS:
+        raise FitError(f"{repeat.sum()} customers have priced repeat purchases, "
+                       f"at least {MIN_REPEAT_CUSTOMERS} are needed to fit the BG/NBD and Gamma-Gamma models")
+
+    # a starts away from 1, where the expected purchases are singular
+    bgnbd = maximize(bgnbd_log_likelihood, [frequency[bought], recency[bought], T[bought]],
+                     [1.0, max(float(np.mean(T[bought])), 1.0), 0.5, 1.0])
+
+    spend = monetary[repeat]
+    gamma_gamma = maximize(gamma_gamma_log_likelihood, [frequency[repeat], spend], [1.0, 2.0, float(np.mean(spend))])
+    return np.concatenate([bgnbd, gamma_gamma])
+
+def fit_cohort(arrays):
+    """
+    fit_models over a cohort's columns, for the process pool. Returns the
+    parameters, or the error when the cohort cannot be fitted.
+    """
+    try:
+        return fit_models(*arrays)
+    except FitError as error:
+        return error
+
+@instrumented('fit_clv')
+def fit(customers, by_cohort=False, min_cohort_size=MIN_COHORT_SIZE, workers=1):
+    """
+    Fit the models on every customer and, with by_cohort, separately per
+    signup month. Cohorts are fitted in a pool of worker processes when
+    workers is more than 1. Returns a frame of parameters indexed by
+    cohort, with the overall fit under None. Raises FitError when there is
+    no overall fit; cohorts without one use the overall fit.
+    """
+    record_rows(len(customers))
+    columns = ['frequency', 'recency', 'T', 'monetary', 'bought']
+
+    def arrays(frame):
+        return tuple(frame[column].to_numpy() for column in columns)
+
+    fits = {None: fit_models(*arrays(customers))}
+    if by_cohort:
+        repeat = customers['frequency'] > 0
+        sizes = customers.loc[repeat, 'cohort'].value_counts()
+        cohorts = sorted(cohort for cohort, size in sizes.items()
+                         if size >= min_cohort_size and cohort != UNKNOWN_COHORT)
+        groups = customers.groupby('cohort')
+        jobs = [arrays(groups.get_group(cohort)) for cohort in cohorts]
+        if workers > 1 and len(jobs) > 1:
+            with ProcessPoolExecutor(workers) as pool:
+                results = list(pool.map(fit_cohort, jobs))
+        else:
+            results = [fit_cohort(job) for job in jobs]
+        for cohort, result in zip(cohorts, results):
+            if isinstance(result, FitError):
+                print(f"Cohort {cohort}: {result}, using the overall fit")
+            else:
+                fits[cohort] = result
+        record_fields(cohorts_fitted=len(fits) - 1)
+
+    return pd.DataFrame.from_dict(fits, orient='index', columns=PARAMETERS)
+
+def probability_alive(params, x, t_x, T):
+    from scipy.special import expit
+
+    r, alpha, a, b = params
+    with np.errstate(invalid='ignore', divide='ignore'):
+        odds = np.log(a) - np.log(b + x - 1) + (r + x) * (np.log(alpha + T) - np.log(alpha + t_x))
+    return np.where(x > 0, expit(-odds), 1.0)
+
+def expected_purchases(params, t, x, t_x, T):
+    """
+    Purchases expected in the t days after T, given frequency x and
+    recency t_x. Broadcasts, so t can be a row of horizons against columns
+    of customers.
+    """
+    from scipy.special import hyp2f1
+
+    r, alpha, a, b = params
+    a = np.where(np.abs(a - 1) < A_GAP, 1 + A_GAP, a)
+    # 2F1(r + x, b + x; a + b + x - 1; z) after Euler's transformation, which
+    # cancels the ((alpha + T) / (alpha + T + t)) ** (r + x) factor in front
+    # of it. Untransformed the two lose every digit when a is small and b
+    # large, as they are for customers who rarely drop out.
+    z = t / (alpha + T + t)
+    unconditional = 1 - ((alpha + T + t) / (alpha + T)) ** (1 - a) * hyp2f1(a + b - 1 - r, a - 1, a + b + x - 1, z)
+    return (a + b + x - 1) / (a - 1) * unconditional * probability_alive(params, x, t_x, T)
+
+def expected_spend(params, x, m):
+    """
+    Mean spend per purchase expected of a customer, shrunk from their own
+    mean toward the population's; customers without priced repeat
+    purchases get the population mean
+    """
+    p, q, v = params
+    x = np.where(np.isnan(m), 0.0, x)
+    m = np.nan_to_num(m)
+    return p * (v + x * m) / (p * x + q - 1)
+
+def predict(customers, params, horizon_days=HORIZON_DAYS, period_days=PERIOD_DAYS,
+            discount_rate=DISCOUNT_RATE, margin=MARGIN):
+    """
+    Add prob_alive, expected_purchases over the horizon, expected_spend and
+    the discounted predicted_clv. Each customer uses their cohort's
+    parameters, or the overall ones when the cohort was not fitted.
+    Raises FitError rather than return estimates that are not finite.
+    """
+    cohort_params = params.drop(index=[None], errors='ignore')
+    rows = pd.Index(cohort_params.index).get_indexer(customers['cohort'])
+    table = np.vstack([cohort_params.to_numpy(dtype=np.float64), params.loc[[None]].to_numpy(dtype=np.float64)])
+    # One parameter column per customer, the overall fit where rows is -1
+    values = table[np.where(rows >= 0, rows, len(cohort_params))].T[:, :, None]
+    r, alpha, a, b, p, q, v = values
+
+    x, t_x, T = (customers[column].to_numpy()[:, None] for column in ('frequency', 'recency', 'T'))
+    # Cumulative purchases expected at the end of each period of the horizon
+    ends = np.append(np.arange(period_days, horizon_days, period_days), horizon_days)[None, :].astype(np.float64)
+    cumulative = expected_purchases((r, alpha, a, b), ends, x, t_x, T)
+    per_period = np.diff(cumulative, axis=1, prepend=0.0)
+    discount = (1 + discount_rate) ** -np.arange(1, ends.shape[1] + 1)
+
+    spend = expected_spend((p[:, 0], q[:, 0], v[:, 0]), x[:, 0], customers['monetary'].to_numpy())
+    result = customers.copy()
+    result['prob_alive'] = probability_alive((r, alpha, a, b), x, t_x, T)[:, 0]
+    result['expected_purchases'] = cumulative[:, -1]
+    result['expected_spend'] = spend
+    result['predicted_clv'] = margin * spend * (per_period @ discount)
+
+    invalid = int((~np.isfinite(result['predicted_clv'])).sum())
+    if invalid:
+        raise FitError(f"CLV model gave no finite estimate for {invalid} customers")
+    return result
+
+@instrumented('export_clv')
+def export(customers, params, output=CLV_MODEL_EXPORT_PATH, chunk_size=DEFAULT_CHUNK_SIZE, **options):
+    """
+    Predict and write the customers chunk by chunk, so only one chunk's
+    horizon matrix is held at a time. A path ending in .parquet is written
+    as a Parquet dataset, anything else as CSV. The chunks go to a
+    temporary file that replaces output once all of them are written, so a
+    failed prediction leaves the previous estimates in place.
+    """
+    from ..staging import remove_staged, replace_staged, write_staged
+
+    root, extension = os.path.splitext(output)
+    tmp_path = f'{root}.tmp{extension}'
+    try:
+        for part, start in enumerate(range(0, max(len(customers), 1), chunk_size)):
+            chunk = predict(customers.iloc[start:start + chunk_size], params, **options)
+            write_staged(chunk[OUTPUT_COLUMNS], tmp_path, part=part)
+            record_rows(len(chunk))
+    except Exception:
+        remove_staged(tmp_path)
+        raise
+    replace_staged(tmp_path, output)
+    print(f"CLV estimates for {len(customers)} customers saved to {output}")
+
+def load_customers(engine):
+    return pd.read_sql("SELECT customer_id, signup_date FROM customers ORDER BY customer_id",
+                       engine, parse_dates=['signup_date'])
+
+def load_staged_customers(path):
+    from ..staging import read_staged
+
+    return read_staged(path, columns=['customer_id', 'signup_date'], table='customers')
+
+@instrumented('clv_inputs')
+def load_inputs(engine, as_of):
+    """
+    Per-customer model inputs from the warehouse
+    """
+    arrays = customer_arrays(load_transactions(engine), load_customers(engine), as_of)
+    record_rows(len(arrays))
+    return arrays
+
+def estimate(engine, as_of, by_cohort=False, workers=1, **options):
+    """
+    Fit on the warehouse and predict every customer in memory, for the analyzer
+    """
+    customers = load_inputs(engine, as_of)
+    return predict(customers, fit(customers, by_cohort, workers=workers), **options)
+
+def main():
+    from .backends import SUMMARY_AS_OF
+
+    parser = argparse.ArgumentParser(description='Estimate CLV with the BG/NBD and Gamma-Gamma models')
+    parser.add_argument('--db-url', default=None, help='SQLAlchemy URL of the warehouse')
+    parser.add_argument('--transactions', default=None,
+                        help='Read transactions from this cleaned CSV or Parquet file instead of the warehouse')
+    parser.add_argument('--customers', default=None,
+                        help='Read customers from this cleaned CSV or Parquet file instead of the warehouse')
+    parser.add_argument('--as-of', default=SUMMARY_AS_OF, help='Date the customers are observed up to')
+    parser.add_argument('--output', default=CLV_MODEL_EXPORT_PATH,
+                        help='File for the estimates, CSV or a .parquet dataset')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Customers written per chunk')
+    parser.add_argument('--by-cohort', action='store_true', help='Fit a model per signup month')
+    parser.add_argument('--min-cohort-size', type=int, default=MIN_COHORT_SIZE,
+                        help='Repeat customers a cohort needs for its own model')
+    parser.add_argument('--workers', type=int, default=1, help='Processes fitting the cohorts')
+    parser.add_argument('--horizon-days', type=int, default=HORIZON_DAYS)
+    parser.add_argument('--discount-rate', type=float, default=DISCOUNT_RATE, help=f'Per {PERIOD_DAYS} days')
+    parser.add_argument('--margin', type=float, default=MARGIN, help='Share of spend counted as value')
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+
+    engine = None
+    if not (args.transactions and args.customers):
+        from ..etl.script import create_db_engine
+
+        engine = create_db_engine(args.db_url)
+        if not engine:
+            return
+
+    if engine is not None and not (args.transactions or args.customers):
+        customers = load_inputs(engine, args.as_of)
+    else:
+        transactions = load_staged_transactions(args.transactions) if args.transactions else load_transactions(engine)
+        signups = load_staged_customers(args.customers) if args.customers else load_customers(engine)
+        customers = customer_arrays(transactions, signups, args.as_of)
+
+    try:
+        params = fit(customers, args.by_cohort, args.min_cohort_size, args.workers)
+        print(f"BG/NBD and Gamma-Gamma parameters:\n{params.rename(index={None: 'all'}).round(4)}")
+        export(customers, params, args.output, args.chunk_size, horizon_days=args.horizon_days,
+               discount_rate=args.discount_rate, margin=args.margin)
+    except FitError as error:
+        parser.exit(1, f"Cannot estimate CLV with the models: {error}. "
+                       f"Use the formula estimate of src.analysis.analyzer instead.\n")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+# Segment rules, checked in order: the first rule whose allowed R/F/M
+# scores all match names the segment. A metric left out of a rule matches
+# any score; customers matching no rule, or missing a score, get
+# DEFAULT_SEGMENT.
+DEFAULT_SEGMENTS = [
+    ('Champions', {'M': [3]}),
+    ('Potential Loyalists', {'M': [2]}),
+    ('At Risk Customers', {'M': [1]}),
+    ('Hibernating', {'M': [0]}),
+]
+DEFAULT_SEGMENT = 'Other'
+
+# Summary column behind each score, and whether a higher value scores lower
+METRICS = {
+    'R': ('recency', True),
+    'F': ('total_transactions', False),
+    'M': ('total_spent', False),
+}
+
+class RFMSegmenter:
+    """
+    Quantile-based RFM scoring with a precomputed segment lookup table.
+
+    fit() computes the quantile bin edges of each metric. transform() scores
+    with a binary search per value and finds each segment by indexing a
+    lookup array with the three scores, so nothing runs per customer in
+    Python. When quantile edges coincide (many customers with the same
+    transaction count, say), the duplicate edges are dropped and the
+    remaining bins are spread over the full score range, so the top bin
+    still gets the top score.
+    """
+
+    def __init__(self, quantiles=4, segments=DEFAULT_SEGMENTS, default_segment=DEFAULT_SEGMENT):
+        self.quantiles = quantiles
+        self.segments = list(segments)
+        self.default_segment = default_segment
+        self.segment_names = [name for name, _ in self.segments] + [default_segment]
+        self.lookup = self.build_lookup()
+        self.edges = {}
+
+    def build_lookup(self):
+        """
+        Segment index and RFM_Score label of every (R, F, M) score
+        combination. Each axis has one extra slot, 0, for a missing score,
+        so scores are offset by one.
+        """
+        slots = self.quantiles + 1
+        lookup = np.full(slots ** 3, len(self.segments), dtype=np.int16)
+        labels = np.full(slots ** 3, None, dtype=object)
+
+        for r, f, m in itertools.product(range(slots), repeat=3):
+            position = (r * slots + f) * slots + m
+            scores = {'R': r - 1, 'F': f - 1, 'M': m - 1}
+            # Customers missing any score always get the default segment
+            if min(scores.values()) < 0:
+                continue
+
+            labels[position] = f'{r - 1}{f - 1}{m - 1}'
+            for index, (_, rule) in enumerate(self.segments):
+                if all(scores[metric] in allowed for metric, allowed in rule.items()):
+                    lookup[position] = index
+                    break
+
+        self.labels = labels
+        return lookup
+
+    def fit(self, df):
+        """
+        Compute the quantile bin edges of each metric
+        """
+        probabilities = np.linspace(0, 1, self.quantiles + 1)
+        for score, (column, _) in METRICS.items():
+            values = pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=np.float64)
+            values = values[~np.isnan(values)]
+            self.edges[score] = np.unique(np.quantile(values, probabilities)) if len(values) else np.array([])
+        return self
+
+    def score(self, values, score):
+        """
+        Integer score of each value, -1 where the value is missing
+        """
+        edges = self.edges[score]
+        _, reverse = METRICS[score]
+        values = pd.to_numeric(values, errors='coerce').to_numpy(dtype=np.float64)
+        missing = np.isnan(values)
+
+        bins = max(len(edges) - 1, 1)
+        # Bins are closed on the right, with the lowest edge included
+        codes = np.clip(np.searchsorted(edges, values, side='left') - 1, 0, bins - 1)
+        scores = np.rint(codes * (self.quantiles - 1) / max(bins - 1, 1)).astype(np.int64)
+        if reverse:
+            scores = self.quantiles - 1 - scores
+
+        return np.where(missing, -1, scores)
+
+    def transform(self, df):
+        """
+        Add R, F, M, RFM_Score and Customer_Segment columns
+        """
+        if not self.edges:
+            raise ValueError("RFMSegmenter must be fitted before transform")
+
+        df = df.copy()
+        scores = {score: self.score(df[column], score) for score, (column, _) in METRICS.items()}
+        for score, values in scores.items():
+            df[score] = pd.arrays.IntegerArray(np.maximum(values, 0), values < 0)
+
+        slots = self.quantiles + 1
+        index = ((scores['R'] + 1) * slots + (scores['F'] + 1)) * slots + (scores['M'] + 1)
+
+        df['RFM_Score'] = self.labels[index]
+        df['Customer_Segment'] = pd.Categorical.from_codes(
+            self.lookup[index], categories=self.segment_names
+        )
+        return df
+
+    def fit_transform(self, df):
+        return self.fit(df).transform(df)
@@ -0,0 +1,393 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from ..etl.summary import SUMMARY_CHANNEL
+from .analyzer import estimate_clv
+from .churn import CHURN_FEATURES, MODEL_DIR, load_model
+
+# Per-customer features kept in memory, least recently used evicted first
+DEFAULT_CACHE_SIZE = 100000
+
+# Seconds a customer's features are served from memory before being
+# fetched again, for databases that do not announce summary refreshes
+DEFAULT_CACHE_TTL = 300.0
+
+# Requests arriving within MAX_WAIT seconds of each other are scored
+# together, up to MAX_BATCH_ROWS rows
+MAX_WAIT = 0.005
+MAX_BATCH_ROWS = 10000
+
+FEATURE_QUERY = (
+    "SELECT customer_id, " + ', '.join(CHURN_FEATURES) +
+    " FROM customer_summary_mat WHERE customer_id IN :ids"
+)
+
+class LRUCache:
+    """
+    Thread-safe mapping that evicts its least recently used entries
+    beyond maxsize, and entries older than ttl seconds when ttl is set
+    """
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (time stored, value)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys):
+        """
+        Return the cached values of keys and the keys that were not cached
+        """
+        found, missing = {}, []
+        oldest = None if self.ttl is None else time.monotonic() - self.ttl
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is not None and oldest is not None and entry[0] < oldest:
+                    del self.entries[key]
+                    entry = None
+                if entry is not None:
+                    self.entries.move_to_end(key)
+                    found[key] = entry[1]
+                else:
+                    missing.append(key)
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def put_many(self, items):
+        now = time.monotonic()
+        with self.lock:
+            for key, value in items:
+                self.entries[key] = (now, value)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+class SummaryListener:
+    """
+    LISTENs on a dedicated PostgreSQL connection for the notification
+    refresh_customer_summary sends, so cached features can be dropped as
+    soon as a load changes them. Other databases have no summary refresh
+    to listen for.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.connection = None
+        if engine.dialect.name == 'postgresql' and engine.dialect.driver == 'psycopg2':
+            self.connection = self.listen()
+
+    def listen(self):
+        """
+        Open a connection LISTENing on the summary channel
+        """
+        # Detached, so the autocommit setting never goes back to the pool
+        connection = self.engine.raw_connection()
+        connection.detach()
+        connection.dbapi_connection.autocommit = True
+        cursor = connection.cursor()
+        cursor.execute(f"LISTEN {SUMMARY_CHANNEL}")
+        cursor.close()
+        return connection
+
+    def refreshed(self):
+        """
+        Whether the summary was refreshed since the last call, read from
+        the socket without a round trip. A dropped connection is reopened
+        and counts as a refresh, since notifications may have been missed
+        while it was down; if it cannot be reopened, cached features only
+        expire by age from then on.
+        """
+        if self.connection is None:
+            return False
+        dbapi_connection = self.connection.dbapi_connection
+        try:
+            dbapi_connection.poll()
+        except self.engine.dialect.dbapi.Error as error:
+            print(f"Summary listener connection lost ({str(error).strip().splitlines()[0]}), reconnecting")
+            # Invalidated rather than closed, so nothing is sent on the dead socket
+            self.connection.invalidate()
+            self.connection = None
+            try:
+                self.connection = self.listen()
+            except Exception as error:
+                print(f"Could not reconnect the summary listener ({error}), "
+                      "cached features now expire by age only")
+            return True
+        if not dbapi_connection.notifies:
+            return False
+        dbapi_connection.notifies.clear()
+        return True
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+class ScoringService:
+    """
+    Churn and CLV scoring of customers by ID or of raw feature rows.
+
+    The model is loaded once. Concurrent requests are queued and a worker
+    thread scores everything that arrived within max_wait seconds as one
+    vectorized batch, fetching uncached customer features in one query.
+    Cached features expire after cache_ttl seconds, and are all dropped
+    when the warehouse announces a summary refresh.
+    """
+
+    def __init__(self, engine, model, cache_size=DEFAULT_CACHE_SIZE, max_wait=MAX_WAIT,
+                 max_batch_rows=MAX_BATCH_ROWS, cache_ttl=DEFAULT_CACHE_TTL):
+        self.engine = engine
+        self.model = model
+        self.cache = LRUCache(cache_size, cache_ttl)
+        self.listener = None
+        self.max_wait = max_wait
+        self.max_batch_rows = max_batch_rows
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.worker = None
+
+    def start(self):
+        if self.worker is None:
+            self.listener = SummaryListener(self.engine)
+            self.worker = threading.Thread(target=self.run_worker, daemon=True)
+            self.worker.start()
+        return self
+
+    def stop(self):
+        if self.worker is not None:
+            self.requests.put(None)
+            self.worker.join()
+            self.worker = None
+            self.listener.close()
+            self.listener = None
+
+    def fetch_features(self, customer_ids):
+        """
+        Features of customers by ID, from the cache or else the warehouse.
+        Unknown customers are left out.
+        """
+        from sqlalchemy import bindparam, text
+
+        if self.listener is not None and self.listener.refreshed():
+            self.cache.clear()
+
+        found, missing = self.cache.get_many(customer_ids)
+        if missing:
+            statement = text(FEATURE_QUERY).bindparams(bindparam('ids', expanding=True))
+            with self.engine.connect() as connection:
+                rows = connection.execute(statement, {'ids': missing}).all()
+            fetched = [(int(row[0]), tuple(float('nan') if v is None else float(v) for v in row[1:]))
+                       for row in rows]
+            self.cache.put_many(fetched)
+            found.update(fetched)
+
+        return pd.DataFrame.from_dict(found, orient='index', columns=CHURN_FEATURES)
+
+    def score_features(self, features):
+        """
+        Vectorized churn probability, churn prediction and CLV of feature rows
+        """
+        features = features[CHURN_FEATURES].astype(float)
+        scores = pd.DataFrame(index=features.index)
+        if len(features):
+            scores['churn_probability'] = self.model.predict_proba(features)[:, 1]
+            scores['churn_prediction'] = self.model.predict(features).astype(bool)
+        else:
+            scores['churn_probability'] = pd.Series(dtype=float)
+            scores['churn_prediction'] = pd.Series(dtype=bool)
+        scores['predicted_clv'] = estimate_clv(features)['predicted_clv']
+        return scores
+
+    def submit(self, customer_ids=None, rows=None):
+        """
+        Queue a request for customer IDs or feature rows, returning a
+        Future of its records. Malformed input raises here, in the caller's
+        thread, rather than failing the whole micro-batch.
+        """
+        if customer_ids is not None:
+            customer_ids = [int(i) for i in customer_ids]
+        elif rows is not None:
+            rows = pd.DataFrame(rows, columns=CHURN_FEATURES).astype(float)
+
+        future = Future()
+        self.requests.put((customer_ids, rows, future))
+        return future
+
+    def score(self, customer_ids=None, rows=None, timeout=None):
+        """
+        Score customer IDs or feature rows and wait for the result
+        """
+        self.start()
+        return self.submit(customer_ids, rows).result(timeout)
+
+    def run_worker(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+
+            pending, size = [request], self.request_size(request)
+            deadline = time.perf_counter() + self.max_wait
+            while size < self.max_batch_rows:
+                try:
+                    request = self.requests.get(timeout=max(0.0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+                if request is None:
+                    self.requests.put(None)
+                    break
+                pending.append(request)
+                size += self.request_size(request)
+
+            try:
+                self.score_batch(pending)
+            except Exception as error:
+                for *_, future in pending:
+                    if not future.done():
+                        future.set_exception(error)
+
+    @staticmethod
+    def request_size(request):
+        customer_ids, rows, _ = request
+        if customer_ids is not None:
+            return len(customer_ids)
+        return 0 if rows is None else len(rows)
+
+    def score_batch(self, pending):
+        """
+        Score a micro-batch of requests in one pass and resolve their futures
+        """
+        self.batches += 1
+        ids = [i for customer_ids, _, _ in pending for i in (customer_ids or ())]
+        features = self.fetch_features(list(dict.fromkeys(ids)))
+
+        frames, known = [], []
+        for customer_ids, rows, _ in pending:
+            if customer_ids is not None:
+                frame = features.reindex(customer_ids).reset_index(drop=True)
+                frame.insert(0, 'customer_id', customer_ids)
+                known.append(np.isin(customer_ids, features.index))
+            else:
+                frame = rows if rows is not None else pd.DataFrame(columns=CHURN_FEATURES, dtype=float)
+                known.append(np.ones(len(frame), dtype=bool))
+            frames.append(frame)
+
+        # Unknown customers get null scores
+        batch = pd.concat(frames, ignore_index=True)
+        known = np.concatenate(known)
+        result = batch.join(self.score_features(batch[known])).astype(object)
+        result = result.where(result.notna(), None)
+
+        offsets = np.cumsum([0] + [len(frame) for frame in frames])
+        for (_, _, future), start, end in zip(pending, offsets[:-1], offsets[1:]):
+            future.set_result(result.iloc[start:end].to_dict('records'))
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    """
+    POST /score with {"customer_ids": [...]} or {"rows": [{feature: value}, ...]},
+    GET /health for the cache and batching counters
+    """
+
+    service = None
+
+    def send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path != '/health':
+            self.send_json(404, {'error': 'not found'})
+            return
+        self.send_json(200, {'status': 'ok', 'batches': self.service.batches, 'cache': self.service.cache.stats()})
+
+    def do_POST(self):
+        if self.path != '/score':
+            self.send_json(404, {'error': 'not found'})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            records = self.service.score(body.get('customer_ids'), body.get('rows'))
+        except (ValueError, KeyError, TypeError) as error:
+            self.send_json(400, {'error': str(error)})
+            return
+        except Exception as error:
+            self.send_json(500, {'error': str(error)})
+            return
+        self.send_json(200, {'scores': records})
+
+    def log_message(self, format, *args):
+        pass
+
+class ScoringServer(ThreadingHTTPServer):
+    # The default backlog of 5 drops connections under concurrent load
+    request_queue_size = 128
+    daemon_threads = True
+
+def serve(service, host='127.0.0.1', port=8080):
+    """
+    Build an HTTP server for a scoring service; call serve_forever() on it
+    """
+    handler = type('BoundScoringHandler', (ScoringHandler,), {'service': service.start()})
+    return ScoringServer((host, port), handler)
+
+def main():
+    from ..etl.script import create_db_engine
+
+    parser = argparse.ArgumentParser(description='Serve churn and CLV scores over HTTP')
+    parser.add_argument('--db-url', default=None, help='SQLAlchemy URL of the warehouse')
+    parser.add_argument('--model', default=None, help='Churn model file, by default the latest in --model-dir')
+    parser.add_argument('--model-dir', default=MODEL_DIR, help='Directory of cached churn models')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE,
+                        help='Customers whose features are kept in memory')
+    parser.add_argument('--cache-ttl', type=float, default=DEFAULT_CACHE_TTL,
+                        help='Seconds cached features are served before being fetched again')
+    parser.add_argument('--max-wait-ms', type=float, default=MAX_WAIT * 1000,
+                        help='How long a request waits for others to share its batch')
+    args = parser.parse_args()
+
+    engine = create_db_engine(args.db_url)
+    if not engine:
+        return
+
+    service = ScoringService(engine, load_model(args.model, args.model_dir), args.cache_size,
+                             args.max_wait_ms / 1000, cache_ttl=args.cache_ttl)
+    server = serve(service, args.host, args.port)
+    print(f"Scoring service listening on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+from ..db_connection import STREAM_BATCH_ROWS
+
+def stream_query(engine, sql, params=None, batch_size=STREAM_BATCH_ROWS):
+    """
+    Yield the rows of a query as DataFrames of at most batch_size rows.
+
+    Rows come through a server-side (named) cursor, so neither the driver
+    nor pandas ever holds more than one batch. NUMERIC columns arrive as
+    float64 instead of Decimal objects.
+    """
+    from sqlalchemy import text
+
+    with engine.connect() as connection:
+        result = connection.execution_options(
+            stream_results=True, max_row_buffer=batch_size
+        ).execute(text(sql), params or {})
+        columns = list(result.keys())
+
+        for rows in result.partitions(batch_size):
+            yield pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+
+class StreamSample:
+    """
+    Uniform random sample of fixed size drawn from a stream of batches.
+
+    Each row gets a random key and the rows with the smallest keys are
+    kept (bottom-k sampling), so memory is bounded by the sample size. When
+    the stream is shorter than the sample size, every row is kept.
+    """
+
+    def __init__(self, size, random_state=42):
+        self.size = size
+        self.rng = np.random.default_rng(random_state)
+        self.frame = None
+        self.keys = np.array([])
+        self.rows_seen = 0
+
+    def add(self, batch):
+        self.rows_seen += len(batch)
+        keys = np.concatenate([self.keys, self.rng.random(len(batch))])
+        frame = batch if self.frame is None else pd.concat([self.frame, batch], ignore_index=True)
+
+        if len(frame) > self.size:
+            keep = np.sort(np.argpartition(keys, self.size - 1)[:self.size])
+            frame = frame.iloc[keep].reset_index(drop=True)
+            keys = keys[keep]
+
+        self.frame, self.keys = frame, keys
+        return self
+
+    def sample(self):
+        return self.frame
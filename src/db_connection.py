@@ -1,22 +1,195 @@
-import psycopg2
+import os
+import threading
+import time
+import weakref
 
-# Database connection settings
-DB_HOST = "localhost"  # Change to your database host
-DB_NAME = "CustomerDW"  # Your database name
-DB_USER = "postgres"  # Your database user
-DB_PASSWORD = "1234"  # Your database password
-DB_PORT = "5432"  # Default PostgreSQL port
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+
+from .instrumentation import watch_engine
+
+# Database connection settings, each overridable with an environment variable
+DB_HOST = os.environ.get('CUSTOMERDW_DB_HOST', 'localhost')  # Change to your database host
+DB_NAME = os.environ.get('CUSTOMERDW_DB_NAME', 'CustomerDW')  # Your database name
+DB_USER = os.environ.get('CUSTOMERDW_DB_USER', 'postgres')  # Your database user
+DB_PASSWORD = os.environ.get('CUSTOMERDW_DB_PASSWORD', '1234')  # Your database password
+DB_PORT = os.environ.get('CUSTOMERDW_DB_PORT', '5432')  # Default PostgreSQL port
+
+# Full SQLAlchemy URL, takes precedence over the settings above
+DB_URL = os.environ.get('CUSTOMERDW_DB_URL')
+
+# Connection pool settings
+POOL_SIZE = int(os.environ.get('CUSTOMERDW_DB_POOL_SIZE', '5'))
+MAX_OVERFLOW = int(os.environ.get('CUSTOMERDW_DB_MAX_OVERFLOW', '10'))
+POOL_TIMEOUT = float(os.environ.get('CUSTOMERDW_DB_POOL_TIMEOUT', '30'))
+POOL_RECYCLE = int(os.environ.get('CUSTOMERDW_DB_POOL_RECYCLE', '1800'))
+POOL_PRE_PING = os.environ.get('CUSTOMERDW_DB_PRE_PING', '1') == '1'
+
+# Per-statement timeout in milliseconds on PostgreSQL, 0 disables it
+STATEMENT_TIMEOUT_MS = int(os.environ.get('CUSTOMERDW_DB_STATEMENT_TIMEOUT_MS', '0'))
+
+# Fetch results through server-side cursors, in batches of this many rows
+STREAM_RESULTS = os.environ.get('CUSTOMERDW_DB_STREAM_RESULTS', '0') == '1'
+STREAM_BATCH_ROWS = int(os.environ.get('CUSTOMERDW_DB_STREAM_BATCH_ROWS', '10000'))
+
+def database_url():
+    """
+    SQLAlchemy URL of the warehouse
+    """
+    return DB_URL or f'postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
+
+class PoolMetrics:
+    """
+    Checkout counters, and the checkouts that waited for a connection to be
+    returned to an exhausted pool
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record_wait(self, seconds):
+        with self.lock:
+            self.waits += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def record_checkout(self):
+        with self.lock:
+            self.checkouts += 1
+
+    def record_connect(self):
+        with self.lock:
+            self.connects += 1
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool that measures how long checkouts wait for a connection when
+    the pool is exhausted
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = None
+
+    def _do_get(self):
+        # Only a checkout that finds no idle connection and no overflow left
+        # blocks; the others get a connection at once or open a new one
+        blocked = (self.checkedin() == 0 and self._max_overflow > -1
+                   and self._overflow >= self._max_overflow)
+        if not blocked or self.metrics is None:
+            return super()._do_get()
+
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.metrics.record_wait(time.perf_counter() - start)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+_engines = {}
+_engines_lock = threading.Lock()
+_metrics = weakref.WeakKeyDictionary()
+
+def get_engine(url=None, **overrides):
+    """
+    Return the shared, pooled engine for a database URL, creating it on
+    first use. Every entry point goes through here, so a process holds one
+    connection pool per database.
+    """
+    url = url or database_url()
+    key = (url, repr(sorted(overrides.items())))
+
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = _create_engine(url, **overrides)
+            _engines[key] = engine
+        return engine
+
+def dispose_engine(engine):
+    """
+    Close an engine's pooled connections and drop it from the shared
+    engines, so a later get_engine for its URL creates a fresh one
+    """
+    with _engines_lock:
+        for key in [key for key, cached in _engines.items() if cached is engine]:
+            del _engines[key]
+    engine.dispose()
+
+def _create_engine(url, **overrides):
+    options = {'pool_pre_ping': POOL_PRE_PING}
+    execution_options = {}
+
+    if not url.startswith('sqlite'):
+        options.update(
+            poolclass=TimedQueuePool,
+            pool_size=POOL_SIZE,
+            max_overflow=MAX_OVERFLOW,
+            pool_timeout=POOL_TIMEOUT,
+            pool_recycle=POOL_RECYCLE,
+        )
+
+    if url.startswith('postgresql') and STATEMENT_TIMEOUT_MS:
+        options['connect_args'] = {'options': f'-c statement_timeout={STATEMENT_TIMEOUT_MS}'}
+
+    if STREAM_RESULTS:
+        execution_options.update(stream_results=True, max_row_buffer=STREAM_BATCH_ROWS)
+    if execution_options:
+        options['execution_options'] = execution_options
+
+    connect_args = dict(options.pop('connect_args', {}), **overrides.pop('connect_args', {}))
+    if connect_args:
+        options['connect_args'] = connect_args
+    options.update(overrides)
+    engine = create_engine(url, **options)
+
+    metrics = _metrics[engine] = PoolMetrics()
+    if isinstance(engine.pool, TimedQueuePool):
+        engine.pool.metrics = metrics
+    event.listen(engine, 'connect', lambda *args: metrics.record_connect())
+    event.listen(engine, 'checkout', lambda *args: metrics.record_checkout())
+    watch_engine(engine)
+
+    return engine
+
+def pool_metrics(engine):
+    """
+    Snapshot of an engine's pool usage
+    """
+    pool = engine.pool
+    metrics = _metrics.get(engine) or PoolMetrics()
+    snapshot = {
+        'connects': metrics.connects,
+        'checkouts': metrics.checkouts,
+        'waits': metrics.waits,
+        'wait_seconds': round(metrics.wait_seconds, 6),
+        'max_wait_seconds': round(metrics.max_wait_seconds, 6),
+    }
+    if isinstance(pool, QueuePool):
+        snapshot.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow())
+    return snapshot
+
+def report_pool_metrics(engine):
+    """
+    Print an engine's pool usage
+    """
+    metrics = pool_metrics(engine)
+    print("Connection pool: " + ', '.join(f"{name}={value}" for name, value in metrics.items()))
 
 # Create a database connection
 def create_db_connection():
     try:
-        connection = psycopg2.connect(
-            host=DB_HOST,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            port=DB_PORT
-        )
+        # Raw DBAPI connection borrowed from the shared pool; close() returns it
+        connection = get_engine().raw_connection()
         return connection
     except Exception as error:
         print(f"Error connecting to database: {error}")
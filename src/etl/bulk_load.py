@@ -0,0 +1,247 @@
+import io
+import time
+
+import pandas as pd
+from sqlalchemy import Boolean, Date, DateTime, Integer, Numeric, String
+from sqlalchemy.dialects import postgresql, sqlite
+
+# Import ORM models
+from ..instrumentation import file_size, instrumented, record_bytes, record_round_trip, record_rows
+from ..models import Base
+from ..staging import iter_staged
+
+from .cubes import CubeDelta
+from .dimension_cache import DimensionCache
+from .partitions import PartitionRouter
+from .summary import SUMMARY_SOURCES, refresh_touched_customers
+
+# Number of CSV rows read, resolved and written per round trip
+DEFAULT_BATCH_SIZE = 10000
+
+# Dimension columns resolved to surrogate keys before a table is loaded
+REFERENCE_COLUMNS = {
+    'customers': ['customer_tier'],
+    'transactions': ['payment_method', 'product_category'],
+    'engagements': [],
+}
+
+def supports_copy(connectable):
+    """
+    Check whether COPY FROM STDIN is available for the target database
+    """
+    dialect = connectable.dialect
+    return dialect.name == 'postgresql' and dialect.driver == 'psycopg2'
+
+def coerce_frame(table, df):
+    """
+    Select the columns of the target table and coerce them to its types
+    """
+    columns = [column for column in table.columns if column.name in df.columns]
+    frame = df[[column.name for column in columns]].copy()
+
+    for column in columns:
+        name = column.name
+        if isinstance(column.type, DateTime):
+            frame[name] = pd.to_datetime(frame[name], errors='coerce')
+        elif isinstance(column.type, Date):
+            frame[name] = pd.to_datetime(frame[name], errors='coerce').dt.date
+        elif isinstance(column.type, Boolean):
+            frame[name] = frame[name].astype('boolean')
+        elif isinstance(column.type, Integer):
+            frame[name] = pd.to_numeric(frame[name]).astype('Int64')
+        elif isinstance(column.type, Numeric) and frame[name].dtype == 'float32':
+            # Narrowed by src/schema.py, rounded back to the decimals they hold
+            frame[name] = frame[name].astype('float64').round(column.type.scale)
+        elif isinstance(column.type, String):
+            # Categoricals and pyarrow strings as plain values for the drivers
+            frame[name] = frame[name].astype(object)
+
+    return frame
+
+def prepare_frame(connection, table, df, cache):
+    """
+    Resolve dimension foreign keys and coerce a chunk for loading
+    """
+    df = df.copy()
+    for column in REFERENCE_COLUMNS.get(table.name, []):
+        if column in df.columns:
+            df[column] = cache.resolve(connection, column, df[column])
+    return coerce_frame(table, df)
+
+def copy_frame(connection, table, frame, target=None):
+    """
+    Stream a prepared chunk into PostgreSQL with COPY FROM STDIN
+    """
+    buffer = io.StringIO()
+    frame.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+
+    columns = ', '.join(frame.columns)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {target or table.name} ({columns}) FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+    finally:
+        cursor.close()
+    record_round_trip()
+
+def insert_frame(connection, table, frame):
+    """
+    Insert a prepared chunk with a single executemany round trip
+    """
+    records = frame.astype(object).where(frame.notna(), None).to_dict('records')
+    if records:
+        connection.execute(table.insert(), records)
+
+def upsert_statement(connection, table):
+    """
+    Build an INSERT that updates existing rows on a primary key conflict
+    """
+    dialects = {'postgresql': postgresql, 'sqlite': sqlite}
+    if connection.dialect.name not in dialects:
+        raise ValueError(f"Upserts are not supported on {connection.dialect.name}")
+
+    statement = dialects[connection.dialect.name].insert(table)
+    keys = [column.name for column in table.primary_key.columns]
+    return statement.on_conflict_do_update(
+        index_elements=keys,
+        set_={
+            column.name: statement.excluded[column.name]
+            for column in table.columns if column.name not in keys
+        }
+    )
+
+def upsert_frame(connection, table, frame):
+    """
+    Insert or update a prepared chunk keyed on the table's natural IDs
+    """
+    keys = [column.name for column in table.primary_key.columns]
+    frame = frame.drop_duplicates(subset=keys, keep='last')
+    records = frame.astype(object).where(frame.notna(), None).to_dict('records')
+    if records:
+        connection.execute(upsert_statement(connection, table), records)
+
+def copy_upsert_frame(connection, table, frame):
+    """
+    COPY a prepared chunk into a temporary staging table, then merge it
+    into the target with a single INSERT ... ON CONFLICT DO UPDATE
+    """
+    keys = [column.name for column in table.primary_key.columns]
+    frame = frame.drop_duplicates(subset=keys, keep='last')
+    staging = f'staging_{table.name}'
+    columns = ', '.join(frame.columns)
+    updates = ', '.join(
+        f'{column} = EXCLUDED.{column}' for column in frame.columns if column not in keys
+    )
+
+    connection.exec_driver_sql(
+        f"CREATE TEMP TABLE IF NOT EXISTS {staging} "
+        f"(LIKE {table.name} INCLUDING DEFAULTS) ON COMMIT DROP"
+    )
+    copy_frame(connection, table, frame, target=staging)
+    connection.exec_driver_sql(
+        f"INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {staging} "
+        f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates}"
+    )
+    connection.exec_driver_sql(f"TRUNCATE {staging}")
+
+def replace_frame(connection, table, frame):
+    """
+    Delete the rows with the same IDs as a prepared chunk, then insert it.
+    Used instead of an upsert on the fact tables: their primary key
+    includes the date, so a row whose date changed would not conflict
+    with its old version.
+    """
+    key = table.primary_key.columns.values()[0]
+    frame = frame.drop_duplicates(subset=[key.name], keep='last')
+    ids = [int(value) for value in frame[key.name]]
+    if ids:
+        connection.execute(table.delete().where(key.in_(ids)))
+    insert_frame(connection, table, frame)
+
+def copy_replace_frame(connection, table, frame):
+    """
+    COPY a prepared chunk into a temporary staging table, delete the rows
+    with the same IDs from the target, then insert them. The COPY
+    counterpart of replace_frame.
+    """
+    key = table.primary_key.columns.values()[0].name
+    frame = frame.drop_duplicates(subset=[key], keep='last')
+    staging = f'staging_{table.name}'
+    columns = ', '.join(frame.columns)
+
+    connection.exec_driver_sql(
+        f"CREATE TEMP TABLE IF NOT EXISTS {staging} "
+        f"(LIKE {table.name} INCLUDING DEFAULTS) ON COMMIT DROP"
+    )
+    copy_frame(connection, table, frame, target=staging)
+    connection.exec_driver_sql(
+        f"DELETE FROM {table.name} t USING {staging} s WHERE t.{key} = s.{key}"
+    )
+    connection.exec_driver_sql(
+        f"INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {staging}"
+    )
+    connection.exec_driver_sql(f"TRUNCATE {staging}")
+
+def sync_sequence(connection, table):
+    """
+    Move a SERIAL sequence past the keys that were loaded explicitly
+    """
+    key = table.primary_key.columns.values()[0].name
+    connection.exec_driver_sql(
+        f"SELECT setval(pg_get_serial_sequence('{table.name}', '{key}'), "
+        f"COALESCE(MAX({key}), 1)) FROM {table.name}"
+    )
+
+@instrumented('load_{table_name}')
+def bulk_load_csv(engine, csv_file, table_name, batch_size=DEFAULT_BATCH_SIZE, use_copy=None, cache=None,
+                  refresh_summary=False, refresh_cubes=False):
+    """
+    Load a cleaned CSV or Parquet file into a table in batches, using COPY
+    on PostgreSQL and batched inserts everywhere else. With refresh_cubes,
+    the loaded rows are added to the aggregate cubes in the same transaction.
+    """
+    table = Base.metadata.tables[table_name]
+    if cache is None:
+        cache = DimensionCache()
+    if use_copy is None:
+        use_copy = supports_copy(engine)
+    write_frame = copy_frame if use_copy else insert_frame
+
+    rows = 0
+    touched = set()
+    track_customers = refresh_summary and table_name in SUMMARY_SOURCES
+    start = time.perf_counter()
+    record_bytes(file_size(csv_file))
+
+    # Load the whole file in one transaction so a failure leaves no partial
+    # load, and no cached keys of dimension rows it rolled back
+    with cache.transaction(), engine.begin() as connection:
+        # Monthly partitions are created as new months show up
+        router = PartitionRouter(connection, table_name)
+        cubes = CubeDelta(connection, table_name) if refresh_cubes else None
+        for chunk in iter_staged(csv_file, batch_size, table=table_name):
+            frame = router.route(prepare_frame(connection, table, chunk, cache))
+            write_frame(connection, table, frame)
+            rows += len(frame)
+            record_rows(len(frame))
+            if track_customers:
+                touched.update(frame['customer_id'].dropna().astype(int))
+            if cubes is not None:
+                cubes.add(frame)
+
+        if engine.dialect.name == 'postgresql':
+            sync_sequence(connection, table)
+        router.report()
+
+        refresh_touched_customers(connection, touched)
+        if cubes is not None:
+            cubes.apply()
+
+    elapsed = time.perf_counter() - start
+    rate = rows / elapsed if elapsed > 0 else float('inf')
+    mode = 'COPY' if use_copy else f'batched insert ({batch_size} rows/batch)'
+    print(f"Loaded {rows} rows into {table_name} via {mode} in {elapsed:.2f}s ({rate:,.0f} rows/sec)")
+    return rows
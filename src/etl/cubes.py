@@ -0,0 +1,433 @@
+import argparse
+import os
+import time
+
+import pandas as pd
+from sqlalchemy import BigInteger, Column, Date, Integer, MetaData, Numeric, String, Table, bindparam, inspect, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from ..instrumentation import add_arguments, configure_from_args, instrumented, record_rows
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+EXPORTS_DIR = os.path.join(PROJECT_ROOT, 'src', 'visualizer', 'exports')
+EXPORT_FORMATS = {'csv': '.csv', 'parquet': '.parquet'}
+
+# Rollups are derived tables like customer_summary_mat, so they are kept
+# out of the ORM metadata and only created by install_cubes
+metadata = MetaData()
+
+# RFM segment of each customer as last scored by the analyzer
+customer_segments = Table(
+    'customer_segments', metadata,
+    Column('customer_id', Integer, primary_key=True),
+    Column('segment', String(50), nullable=False),
+)
+
+def dimension(name, length=50):
+    return Column(name, String(length), primary_key=True)
+
+def count(name):
+    return Column(name, BigInteger, nullable=False, server_default='0')
+
+def total(name):
+    return Column(name, Numeric(16, 2), nullable=False, server_default='0')
+
+CUBE_TABLES = {
+    'segment_month': Table(
+        'cube_segment_month', metadata,
+        dimension('segment'), Column('month', Date, primary_key=True),
+        count('transactions'), total('revenue'),
+        count('engagements'), count('login_frequency_sum'), total('time_spent_sum'),
+        count('pages_visited_sum'), total('email_open_rate_sum'),
+    ),
+    'category_payment_status': Table(
+        'cube_category_payment_status', metadata,
+        dimension('product_category'), dimension('payment_method'), dimension('transaction_status', 20),
+        count('transactions'), total('revenue'), count('quantity'), count('discounted_transactions'),
+    ),
+    'tier_country': Table(
+        'cube_tier_country', metadata,
+        dimension('customer_tier', 20), dimension('country'),
+        count('customers'), count('active_customers'), count('transactions'), total('revenue'),
+        count('engagements'), count('login_frequency_sum'), total('time_spent_sum'),
+        count('pages_visited_sum'), total('email_open_rate_sum'),
+    ),
+}
+
+# A cell is dropped once every one of these it has is back to zero
+COUNT_MEASURES = ('customers', 'transactions', 'engagements')
+
+# First day of the month of a date, per dialect
+MONTH_EXPRESSIONS = {
+    'postgresql': "CAST(date_trunc('month', {column}) AS DATE)",
+    'sqlite': "date({column}, 'start of month')",
+}
+
+TRANSACTION_MEASURES = {
+    'transactions': "COUNT(*)",
+    'revenue': "COALESCE(SUM(t.amount), 0)",
+}
+
+ENGAGEMENT_MEASURES = {
+    'engagements': "COUNT(*)",
+    'login_frequency_sum': "COALESCE(SUM(e.login_frequency), 0)",
+    'time_spent_sum': "COALESCE(SUM(e.time_spent), 0)",
+    'pages_visited_sum': "COALESCE(SUM(e.pages_visited), 0)",
+    'email_open_rate_sum': "COALESCE(SUM(e.email_open_rate), 0)",
+}
+
+CUSTOMER_ATTRIBUTES = (
+    "LEFT JOIN customers c ON c.customer_id = {alias}.customer_id "
+    "LEFT JOIN customer_tiers ct ON ct.tier_id = c.customer_tier"
+)
+
+TIER_COUNTRY_KEYS = {
+    'customer_tier': "COALESCE(ct.tier_name, 'Unknown')",
+    'country': "COALESCE(c.country, 'Unknown')",
+}
+
+# Each cube is the sum of one or more aggregate queries over the warehouse.
+# A query lists, per loaded table, the ID column that picks out the rows
+# of that table a delta covers: a loaded customer moves their facts with
+# them when their tier or country changes.
+CUBE_PARTS = {
+    'segment_month': [
+        {
+            'from': "transactions t LEFT JOIN customer_segments s ON s.customer_id = t.customer_id",
+            'where': "t.transaction_date IS NOT NULL",
+            'date_column': 't.transaction_date',
+            'keys': {'segment': "COALESCE(s.segment, 'Unscored')", 'month': "{month}"},
+            'measures': TRANSACTION_MEASURES,
+            'filters': {'transactions': 't.transaction_id'},
+        },
+        {
+            'from': "engagements e LEFT JOIN customer_segments s ON s.customer_id = e.customer_id",
+            'where': "e.engagement_date IS NOT NULL",
+            'date_column': 'e.engagement_date',
+            'keys': {'segment': "COALESCE(s.segment, 'Unscored')", 'month': "{month}"},
+            'measures': ENGAGEMENT_MEASURES,
+            'filters': {'engagements': 'e.engagement_id'},
+        },
+    ],
+    'category_payment_status': [
+        {
+            'from': "transactions t "
+                    "LEFT JOIN product_categories pc ON pc.category_id = t.product_category "
+                    "LEFT JOIN payment_methods pm ON pm.payment_method_id = t.payment_method",
+            'keys': {
+                'product_category': "COALESCE(pc.category_name, 'Unknown')",
+                'payment_method': "COALESCE(pm.payment_method_name, 'Unknown')",
+                'transaction_status': "COALESCE(t.transaction_status, 'Unknown')",
+            },
+            'measures': dict(
+                TRANSACTION_MEASURES,
+                quantity="COALESCE(SUM(t.quantity), 0)",
+                discounted_transactions="SUM(CASE WHEN t.discount_applied THEN 1 ELSE 0 END)",
+            ),
+            'filters': {'transactions': 't.transaction_id'},
+        },
+    ],
+    'tier_country': [
+        {
+            'from': "customers c LEFT JOIN customer_tiers ct ON ct.tier_id = c.customer_tier",
+            'keys': TIER_COUNTRY_KEYS,
+            'measures': {
+                'customers': "COUNT(*)",
+                'active_customers': "SUM(CASE WHEN c.is_active THEN 1 ELSE 0 END)",
+            },
+            'filters': {'customers': 'c.customer_id'},
+        },
+        {
+            'from': "transactions t " + CUSTOMER_ATTRIBUTES.format(alias='t'),
+            'keys': TIER_COUNTRY_KEYS,
+            'measures': TRANSACTION_MEASURES,
+            'filters': {'transactions': 't.transaction_id', 'customers': 't.customer_id'},
+        },
+        {
+            'from': "engagements e " + CUSTOMER_ATTRIBUTES.format(alias='e'),
+            'keys': TIER_COUNTRY_KEYS,
+            'measures': ENGAGEMENT_MEASURES,
+            'filters': {'engagements': 'e.engagement_id', 'customers': 'e.customer_id'},
+        },
+    ],
+}
+
+# Natural ID of the rows of each loaded table
+SOURCE_KEYS = {
+    'customers': 'customer_id',
+    'transactions': 'transaction_id',
+    'engagements': 'engagement_id',
+}
+
+def cube_keys(name):
+    return [column.name for column in CUBE_TABLES[name].primary_key.columns]
+
+def part_sql(dialect, name, part, source=None):
+    """
+    SELECT of one cube query, restricted to the rows of a loaded table
+    given by an :ids parameter when source is set
+    """
+    month = MONTH_EXPRESSIONS[dialect].format(column=part.get('date_column'))
+    keys = [f"{part['keys'][key].format(month=month)} AS {key}" for key in cube_keys(name)]
+    measures = [f"{expression} AS {measure}" for measure, expression in part['measures'].items()]
+
+    conditions = [part['where']] if part.get('where') else []
+    if source is not None:
+        column = part['filters'][source]
+        if dialect == 'postgresql':
+            conditions.append(f"{column} = ANY(CAST(:ids AS INTEGER[]))")
+        else:
+            conditions.append(f"{column} IN :ids")
+    # SQLite needs a WHERE before ON CONFLICT to parse an INSERT ... SELECT
+    where = ' AND '.join(conditions) or '1 = 1'
+    positions = ', '.join(str(position) for position in range(1, len(keys) + 1))
+    return f"SELECT {', '.join(keys + measures)} FROM {part['from']} WHERE {where} GROUP BY {positions}"
+
+def check_dialect(connection):
+    if connection.dialect.name not in MONTH_EXPRESSIONS:
+        raise ValueError(f"Cubes are not supported on {connection.dialect.name}")
+
+def install_cubes(connection):
+    """
+    Create the segment and cube tables
+    """
+    check_dialect(connection)
+    metadata.create_all(connection)
+
+def cubes_installed(connection):
+    """
+    Check whether the cube tables exist in the target database
+    """
+    if connection.dialect.name not in MONTH_EXPRESSIONS:
+        return False
+    return inspect(connection).has_table(CUBE_TABLES['segment_month'].name)
+
+def cubes_fed_by(source):
+    return [name for name, parts in CUBE_PARTS.items()
+            if any(source in part['filters'] for part in parts)]
+
+@instrumented('refresh_cubes')
+def rebuild_cubes(connection, names=None):
+    """
+    Recompute cubes from scratch with one aggregate query per part, all of
+    them by default
+    """
+    check_dialect(connection)
+    start = time.perf_counter()
+    cells = 0
+    for name in names or CUBE_TABLES:
+        table = CUBE_TABLES[name]
+        keys = cube_keys(name)
+        connection.execute(table.delete())
+        for part in CUBE_PARTS[name]:
+            measures = list(part['measures'])
+            updates = ', '.join(f"{measure} = {table.name}.{measure} + EXCLUDED.{measure}" for measure in measures)
+            connection.exec_driver_sql(
+                f"INSERT INTO {table.name} ({', '.join(keys + measures)}) "
+                f"{part_sql(connection.dialect.name, name, part)} "
+                f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates}"
+            )
+        cells += connection.execute(text(f"SELECT COUNT(*) FROM {table.name}")).scalar()
+
+    record_rows(cells)
+    print(f"Rebuilt {len(names or CUBE_TABLES)} cubes ({cells} cells) in {time.perf_counter() - start:.2f}s")
+    return cells
+
+def rebuild_cubes_fed_by(connection, source):
+    """
+    Rebuild the cubes a table feeds, if the cubes have been installed. For
+    changes made outside the loaders, such as dropping a partition.
+    """
+    if cubes_installed(connection):
+        rebuild_cubes(connection, cubes_fed_by(source))
+
+class CubeDelta:
+    """
+    Keeps the cubes current through a load from the loaded rows alone.
+
+    For each batch, retract() aggregates the rows about to be overwritten,
+    with a negative sign, and add() the rows just written, each with one
+    aggregate query per cube part restricted to the batch's IDs. Only the
+    aggregates, a few cells per batch, are kept; apply() merges them into
+    the cubes at the end of the load, in key order so concurrent loads
+    lock cells in the same order, then drops cells left empty.
+    """
+
+    def __init__(self, connection, table_name):
+        self.connection = connection
+        self.table_name = table_name
+        self.key = SOURCE_KEYS[table_name]
+        self.enabled = cubes_installed(connection)
+        self.parts = [(name, part) for name in cubes_fed_by(table_name) for part in CUBE_PARTS[name]
+                      if table_name in part['filters']] if self.enabled else []
+        self.deltas = {}
+
+    def collect(self, frame, sign):
+        ids = [int(value) for value in frame[self.key].dropna().unique()]
+        if not ids:
+            return
+        dialect = self.connection.dialect.name
+        for name, part in self.parts:
+            query = text(part_sql(dialect, name, part, self.table_name))
+            if dialect != 'postgresql':
+                query = query.bindparams(bindparam('ids', expanding=True))
+            delta = pd.read_sql(query, self.connection, params={'ids': ids})
+            if delta.empty:
+                continue
+            for measure in part['measures']:
+                delta[measure] = delta[measure] * sign
+            self.deltas.setdefault(name, []).append(delta)
+
+    def retract(self, frame):
+        self.collect(frame, -1)
+
+    def add(self, frame):
+        self.collect(frame, 1)
+
+    @instrumented('cubes_{self.table_name}')
+    def apply(self):
+        if not self.enabled:
+            print("Cubes are not installed, skipping the cube refresh")
+            return 0
+
+        dialects = {'postgresql': postgresql, 'sqlite': sqlite}
+        cells = 0
+        for name in CUBE_TABLES:
+            if name not in self.deltas:
+                continue
+            table = CUBE_TABLES[name]
+            keys = cube_keys(name)
+            # Parts fill different measures; the ones a part lacks add nothing
+            delta = pd.concat(self.deltas.pop(name), ignore_index=True)
+            measures = [column for column in delta.columns if column not in keys]
+            delta[measures] = delta[measures].fillna(0)
+            # SQLite hands dates back as text
+            for column in table.primary_key.columns:
+                if isinstance(column.type, Date):
+                    delta[column.name] = pd.to_datetime(delta[column.name]).dt.date
+            delta = delta.groupby(keys, as_index=False)[measures].sum().sort_values(keys)
+            delta = delta[(delta[measures] != 0).any(axis=1)]
+            if delta.empty:
+                continue
+
+            statement = dialects[self.connection.dialect.name].insert(table)
+            statement = statement.on_conflict_do_update(
+                index_elements=keys,
+                set_={measure: table.c[measure] + statement.excluded[measure] for measure in measures},
+            )
+            self.connection.execute(statement, delta.astype(object).to_dict('records'))
+
+            empty = [table.c[measure] == 0 for measure in COUNT_MEASURES if measure in table.c]
+            self.connection.execute(table.delete().where(*empty))
+            cells += len(delta)
+
+        record_rows(cells)
+        if cells:
+            print(f"Applied {cells} cube cell deltas from {self.table_name}")
+        return cells
+
+def clear_segments(connection):
+    connection.execute(customer_segments.delete())
+
+def append_segments(connection, segments):
+    """
+    Store the RFM segments of a frame of customer_id and Customer_Segment
+    """
+    records = (segments[['customer_id', 'Customer_Segment']]
+               .rename(columns={'Customer_Segment': 'segment'})
+               .dropna().astype(object).to_dict('records'))
+    if records:
+        connection.execute(customer_segments.insert(), records)
+
+def store_segments(connection, segments):
+    """
+    Replace the stored RFM segments and rebuild the segment cube over them
+    """
+    clear_segments(connection)
+    append_segments(connection, segments)
+    return rebuild_cubes(connection, ['segment_month'])
+
+def cube_extract(frame, name):
+    """
+    Typed extract of a cube: dimensions as categoricals, counts as
+    integers, totals as floats, and the averages the dashboards show
+    """
+    table = CUBE_TABLES[name]
+    frame = frame.copy()
+    for column in table.columns:
+        if isinstance(column.type, String):
+            frame[column.name] = frame[column.name].astype('category')
+        elif isinstance(column.type, Date):
+            frame[column.name] = pd.to_datetime(frame[column.name])
+        elif isinstance(column.type, BigInteger):
+            frame[column.name] = frame[column.name].astype('int64')
+        else:
+            frame[column.name] = frame[column.name].astype('float64').round(2)
+
+    def average(numerator, denominator):
+        return (frame[numerator] / frame[denominator].where(frame[denominator] > 0)).round(4)
+
+    if 'revenue' in frame.columns:
+        frame['avg_transaction_amount'] = average('revenue', 'transactions')
+    if 'engagements' in frame.columns:
+        for measure in ('login_frequency', 'time_spent', 'pages_visited', 'email_open_rate'):
+            frame[f'avg_{measure}'] = average(f'{measure}_sum', 'engagements')
+    return frame
+
+@instrumented()
+def export_cubes(engine, export_dir=EXPORTS_DIR, fmt='csv'):
+    """
+    Write each cube to a small extract for the dashboards, whose size
+    depends on the number of cells rather than of facts
+    """
+    if fmt == 'parquet':
+        from ..staging import import_pyarrow
+
+        import_pyarrow()
+    os.makedirs(export_dir, exist_ok=True)
+
+    paths = []
+    for name, table in CUBE_TABLES.items():
+        frame = cube_extract(
+            pd.read_sql(f"SELECT * FROM {table.name} ORDER BY {', '.join(cube_keys(name))}", engine), name
+        )
+        path = os.path.join(export_dir, f'{table.name}{EXPORT_FORMATS[fmt]}')
+        if fmt == 'parquet':
+            frame.to_parquet(path, index=False)
+        else:
+            frame.to_csv(path, index=False, date_format='%Y-%m-%d')
+        record_rows(len(frame))
+        paths.append(path)
+        print(f"Exported {len(frame)} cells of {table.name} to {path}")
+    return paths
+
+def main():
+    # Imported here to keep the loaders free of a dependency on script.py
+    from .script import create_db_engine
+
+    parser = argparse.ArgumentParser(description='Build and export the aggregate cubes for the dashboards')
+    parser.add_argument('action', choices=['install', 'rebuild', 'export'],
+                        help='install: create and fill the cubes; rebuild: recompute them from scratch; '
+                             'export: write the dashboard extracts')
+    parser.add_argument('--db-url', default=None, help='SQLAlchemy URL of the warehouse')
+    parser.add_argument('--cube', choices=sorted(CUBE_TABLES), nargs='+', default=None,
+                        help='Cubes to rebuild (default: all)')
+    parser.add_argument('--export-dir', default=EXPORTS_DIR, help='Directory for the extracts')
+    parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='csv', help='Format of the extracts')
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+
+    engine = create_db_engine(args.db_url)
+    if not engine:
+        return
+
+    if args.action in ('install', 'rebuild'):
+        with engine.begin() as connection:
+            if args.action == 'install':
+                install_cubes(connection)
+            rebuild_cubes(connection, args.cube)
+    export_cubes(engine, args.export_dir, args.format)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+from contextlib import contextmanager
+
+from sqlalchemy import insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+# Import ORM models
+from ..models import CustomerTier, PaymentMethod, ProductCategory
+
+# Dimensions resolved during ETL: csv column -> (model, name column, key column)
+DIMENSIONS = {
+    'customer_tier': (CustomerTier, 'tier_name', 'tier_id'),
+    'payment_method': (PaymentMethod, 'payment_method_name', 'payment_method_id'),
+    'product_category': (ProductCategory, 'category_name', 'category_id'),
+}
+
+def dialect_insert(connection, table):
+    """
+    Build an INSERT that supports ON CONFLICT DO NOTHING where the dialect has it
+    """
+    if connection.dialect.name == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if connection.dialect.name == 'sqlite':
+        return sqlite.insert(table).on_conflict_do_nothing()
+    return insert(table)
+
+class DimensionCache:
+    """
+    In-memory name -> surrogate key cache for the reference dimensions,
+    loaded once per ETL run and shared by every table load
+    """
+
+    def __init__(self, dimensions=DIMENSIONS):
+        self.dimensions = dimensions
+        self.keys = {column: {} for column in dimensions}
+        self.loaded = False
+
+        # Counters, per dimension. Hits and misses count rows: a miss is a
+        # row whose name was not cached yet, inserted counts distinct names
+        self.hits = {column: 0 for column in dimensions}
+        self.misses = {column: 0 for column in dimensions}
+        self.inserted = {column: 0 for column in dimensions}
+        self.round_trips = 0
+
+    def preload(self, connection):
+        """
+        Read every existing dimension row into memory
+        """
+        for column, (model, name_column, key_column) in self.dimensions.items():
+            table = model.__table__
+            rows = connection.execute(
+                select(table.c[name_column], table.c[key_column])
+            ).all()
+            self.keys[column] = dict(rows)
+            self.round_trips += 1
+        self.loaded = True
+
+    def invalidate(self):
+        """
+        Forget every cached key, so the next lookup reloads them all
+        """
+        self.keys = {column: {} for column in self.dimensions}
+        self.loaded = False
+
+    @contextmanager
+    def transaction(self):
+        """
+        Scope of a load's transaction. Keys inserted inside a transaction
+        that fails were rolled back with it, so the cache is invalidated
+        rather than left pointing at rows that do not exist.
+        """
+        try:
+            yield self
+        except BaseException:
+            self.invalidate()
+            raise
+
+    def insert_missing(self, connection, column, names):
+        """
+        Insert unseen names in one batched upsert and cache their keys
+        """
+        model, name_column, key_column = self.dimensions[column]
+        table = model.__table__
+        name_col = table.c[name_column]
+        key_col = table.c[key_column]
+        keys = self.keys[column]
+
+        statement = dialect_insert(connection, table)
+        if connection.dialect.insert_returning:
+            rows = connection.execute(
+                statement.returning(name_col, key_col),
+                [{name_column: name} for name in names]
+            ).all()
+            keys.update(rows)
+        else:
+            connection.execute(statement, [{name_column: name} for name in names])
+        self.round_trips += 1
+
+        # Names inserted concurrently by another loader are skipped by
+        # DO NOTHING and not returned, so read those back
+        unresolved = [name for name in names if name not in keys]
+        if unresolved:
+            keys.update(connection.execute(
+                select(name_col, key_col).where(name_col.in_(unresolved))
+            ).all())
+            self.round_trips += 1
+
+    def resolve(self, connection, column, values):
+        """
+        Map a whole column of dimension names to surrogate keys
+        """
+        if not self.loaded:
+            self.preload(connection)
+
+        keys = self.keys[column]
+        names = values.dropna()
+        unseen = [name for name in names.unique() if name not in keys]
+
+        # A miss is a row whose name has to be inserted; every other row is
+        # served from memory
+        missed = int(names.isin(unseen).sum()) if unseen else 0
+        self.misses[column] += missed
+        self.hits[column] += len(names) - missed
+        self.inserted[column] += len(unseen)
+        if unseen:
+            self.insert_missing(connection, column, unseen)
+
+        return values.map(keys).astype('Int64')
+
+    def stats(self):
+        """
+        Lookup counters, in rows, with the round trips a per-row lookup
+        would have cost
+        """
+        lookups = sum(self.hits.values()) + sum(self.misses.values())
+        return {
+            'hits': dict(self.hits),
+            'misses': dict(self.misses),
+            'inserted': dict(self.inserted),
+            'lookups': lookups,
+            'round_trips': self.round_trips,
+            # The old per-row path issued a SELECT per row plus an INSERT
+            # and COMMIT per new name
+            'round_trips_saved': lookups + 2 * sum(self.inserted.values()) - self.round_trips,
+        }
+
+    def report(self):
+        """
+        Print the lookup counters
+        """
+        stats = self.stats()
+        for column in self.dimensions:
+            print(f"{column}: {stats['hits'][column]} hits, {stats['misses'][column]} misses "
+                  f"({stats['inserted'][column]} names inserted)")
+        print(f"Dimension cache: {stats['round_trips']} round trips for {stats['lookups']} lookups "
+              f"({stats['round_trips_saved']} round trips saved)")
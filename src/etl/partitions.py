@@ -0,0 +1,302 @@
+import argparse
+import time
+
+import pandas as pd
+from sqlalchemy import text
+
+# Import ORM models
+from ..models import Base
+
+# Fact tables range partitioned by month of their date column on PostgreSQL
+PARTITIONED_TABLES = {
+    'transactions': 'transaction_date',
+    'engagements': 'engagement_date',
+}
+
+# Covering indexes for the customer/date access paths: the summary reads
+# amounts per customer up to a date, the clusters average engagement
+# measures per customer, both without touching the heap
+COVERING_INDEXES = {
+    'transactions': ('idx_transactions_customer_date', ['customer_id', 'transaction_date'],
+                     ['amount', 'transaction_id']),
+    'engagements': ('idx_engagements_customer_date', ['customer_id', 'engagement_date'],
+                    ['login_frequency', 'time_spent', 'pages_visited', 'email_open_rate', 'promo_redemptions']),
+}
+
+def partition_name(table_name, month):
+    return f"{table_name}_{pd.Period(month, freq='M').strftime('%Y_%m')}"
+
+def month_bounds(month):
+    """
+    First day of a month and of the month after, as partition bounds
+    """
+    month = pd.Period(month, freq='M')
+    return month.start_time.date(), (month + 1).start_time.date()
+
+def partition_column(connection, table_name):
+    """
+    Column a table is range partitioned on, or None when it is a plain table
+    """
+    if connection.dialect.name != 'postgresql':
+        return None
+    return connection.execute(text(
+        "SELECT a.attname FROM pg_partitioned_table p "
+        "JOIN pg_attribute a ON a.attrelid = p.partrelid AND a.attnum = p.partattrs[0] "
+        "WHERE p.partrelid = to_regclass(:name)"
+    ), {'name': table_name}).scalar()
+
+def list_partitions(connection, table_name):
+    """
+    Names of the partitions attached to a table
+    """
+    return set(connection.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:name)"
+    ), {'name': table_name}).scalars())
+
+def create_partition(connection, table_name, month):
+    """
+    Create the partition of a month if it does not exist yet
+    """
+    start, end = month_bounds(month)
+    name = partition_name(table_name, month)
+    connection.exec_driver_sql(
+        f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table_name} "
+        f"FOR VALUES FROM ('{start}') TO ('{end}')"
+    )
+    return name
+
+def frame_months(frame, column):
+    return pd.to_datetime(frame[column]).dropna().dt.to_period('M').unique()
+
+class PartitionRouter:
+    """
+    Creates the monthly partitions a load is about to write into.
+
+    PostgreSQL routes rows inserted or copied into the parent table to
+    their partition, but the partition has to exist, so each batch is
+    checked for months not seen before. Rows without a date cannot be
+    stored, as the partition column is part of the primary key, and are
+    skipped. On plain tables route() returns the frame as is.
+    """
+
+    def __init__(self, connection, table_name):
+        self.connection = connection
+        self.table_name = table_name
+        self.column = partition_column(connection, table_name)
+        self.partitions = list_partitions(connection, table_name) if self.column else set()
+        self.skipped = 0
+
+    def route(self, frame):
+        if self.column is None:
+            return frame
+
+        undated = frame[self.column].isna()
+        if undated.any():
+            self.skipped += int(undated.sum())
+            frame = frame[~undated]
+
+        for month in frame_months(frame, self.column):
+            if partition_name(self.table_name, month) not in self.partitions:
+                self.partitions.add(create_partition(self.connection, self.table_name, month))
+        return frame
+
+    def report(self):
+        if self.skipped:
+            print(f"Skipped {self.skipped} {self.table_name} rows with no {self.column}")
+
+def create_covering_indexes(connection, table_name):
+    name, keys, included = COVERING_INDEXES[table_name]
+    connection.exec_driver_sql(
+        f"CREATE INDEX IF NOT EXISTS {name} ON {table_name} ({', '.join(keys)}) INCLUDE ({', '.join(included)})"
+    )
+
+def partition_table(connection, table_name):
+    """
+    Turn a plain fact table into a monthly range-partitioned one in place.
+
+    The table is renamed aside, a partitioned table with the same columns,
+    defaults and foreign keys takes its name, and the rows are copied over
+    into one partition per month. The primary key becomes (id, date), as
+    PostgreSQL requires the partition column in every unique key.
+    """
+    column = PARTITIONED_TABLES[table_name]
+    table = Base.metadata.tables[table_name]
+    key = table.primary_key.columns.values()[0].name
+    old = f'{table_name}_unpartitioned'
+
+    connection.exec_driver_sql(f"ALTER TABLE {table_name} RENAME TO {old}")
+    sequence = connection.execute(text("SELECT pg_get_serial_sequence(:table, :key)"),
+                                  {'table': old, 'key': key}).scalar()
+    connection.exec_driver_sql(
+        f"CREATE TABLE {table_name} (LIKE {old} INCLUDING DEFAULTS, PRIMARY KEY ({key}, {column})) "
+        f"PARTITION BY RANGE ({column})"
+    )
+    for foreign_key in table.foreign_keys:
+        connection.exec_driver_sql(
+            f"ALTER TABLE {table_name} ADD FOREIGN KEY ({foreign_key.parent.name}) "
+            f"REFERENCES {foreign_key.column.table.name} ({foreign_key.column.name})"
+        )
+    if sequence:
+        # The sequence would otherwise be dropped with the old table
+        connection.exec_driver_sql(f"ALTER SEQUENCE {sequence} OWNED BY {table_name}.{key}")
+
+    months = connection.execute(text(
+        f"SELECT DISTINCT date_trunc('month', {column}) FROM {old} WHERE {column} IS NOT NULL"
+    )).scalars()
+    for month in months:
+        create_partition(connection, table_name, month)
+
+    moved = connection.execute(text(
+        f"INSERT INTO {table_name} SELECT * FROM {old} WHERE {column} IS NOT NULL"
+    )).rowcount
+    skipped = connection.execute(text(f"SELECT COUNT(*) FROM {old}")).scalar() - moved
+    connection.exec_driver_sql(f"DROP TABLE {old}")
+
+    message = f"Partitioned {table_name} by month of {column}, {moved} rows moved"
+    if skipped:
+        message += f", {skipped} rows with no {column} dropped"
+    print(message)
+
+def install_partitioning(connection, tables=tuple(PARTITIONED_TABLES)):
+    """
+    Partition the fact tables that are not partitioned yet and create their
+    covering indexes. Safe to run again.
+    """
+    if connection.dialect.name != 'postgresql':
+        raise ValueError(f"Partitioning is only supported on PostgreSQL, not {connection.dialect.name}")
+
+    for table_name in tables:
+        if partition_column(connection, table_name) is None:
+            partition_table(connection, table_name)
+        create_covering_indexes(connection, table_name)
+
+def drop_partition(connection, table_name, month):
+    """
+    Detach and drop the partition of a month, returning the customers it
+    held so their summaries can be refreshed
+    """
+    name = partition_name(table_name, month)
+    if name not in list_partitions(connection, table_name):
+        return set()
+
+    customer_ids = set(connection.execute(text(f"SELECT DISTINCT customer_id FROM {name}")).scalars())
+    connection.exec_driver_sql(f"ALTER TABLE {table_name} DETACH PARTITION {name}")
+    connection.exec_driver_sql(f"DROP TABLE {name}")
+    return {customer_id for customer_id in customer_ids if customer_id is not None}
+
+def reload_partition(engine, csv_file, table_name, month, batch_size=None, cache=None):
+    """
+    Replace one month of a partitioned fact table with the rows of that
+    month in a cleaned file.
+
+    The rows are copied into a standalone table with a CHECK constraint
+    matching the month, so attaching it needs no validation scan, and its
+    indexes are built once after the copy rather than maintained per row.
+    The old partition is then detached and dropped and the new one
+    attached in the same transaction, so readers see either month whole.
+    """
+    # Imported here, as the loaders import this module
+    from ..staging import iter_staged
+    from .bulk_load import DEFAULT_BATCH_SIZE, copy_frame, prepare_frame
+    from .cubes import rebuild_cubes_fed_by
+    from .dimension_cache import DimensionCache
+    from .summary import SUMMARY_SOURCES, refresh_touched_customers
+
+    table = Base.metadata.tables[table_name]
+    column = PARTITIONED_TABLES[table_name]
+    month = pd.Period(month, freq='M')
+    start_date, end_date = month_bounds(month)
+    name = partition_name(table_name, month)
+    loading = f'{name}_reload'
+    cache = cache or DimensionCache()
+    start = time.perf_counter()
+
+    rows = 0
+    touched = set()
+    with cache.transaction(), engine.begin() as connection:
+        if partition_column(connection, table_name) != column:
+            raise ValueError(f"{table_name} is not partitioned, run install_partitioning first")
+
+        connection.exec_driver_sql(f"DROP TABLE IF EXISTS {loading}")
+        connection.exec_driver_sql(f"CREATE TABLE {loading} (LIKE {table_name} INCLUDING DEFAULTS)")
+        for chunk in iter_staged(csv_file, batch_size or DEFAULT_BATCH_SIZE, table=table_name):
+            dates = pd.to_datetime(chunk[column], errors='coerce')
+            chunk = chunk[(dates >= month.start_time) & (dates < (month + 1).start_time)]
+            if chunk.empty:
+                continue
+            frame = prepare_frame(connection, table, chunk, cache)
+            copy_frame(connection, table, frame, target=loading)
+            rows += len(frame)
+            touched.update(frame['customer_id'].dropna().astype(int))
+
+        connection.exec_driver_sql(
+            f"ALTER TABLE {loading} ADD CONSTRAINT {loading}_bounds CHECK "
+            f"({column} IS NOT NULL AND {column} >= '{start_date}' AND {column} < '{end_date}')"
+        )
+        touched |= drop_partition(connection, table_name, month)
+        connection.exec_driver_sql(f"ALTER TABLE {loading} RENAME TO {name}")
+        connection.exec_driver_sql(f"ALTER TABLE {name} RENAME CONSTRAINT {loading}_bounds TO {name}_bounds")
+        connection.exec_driver_sql(
+            f"ALTER TABLE {table_name} ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{start_date}') TO ('{end_date}')"
+        )
+
+        if table_name in SUMMARY_SOURCES:
+            refresh_touched_customers(connection, touched)
+        rebuild_cubes_fed_by(connection, table_name)
+
+    print(f"Reloaded {rows} rows into {name} in {time.perf_counter() - start:.2f}s")
+    return rows
+
+def main():
+    from .script import create_db_engine
+
+    parser = argparse.ArgumentParser(description='Manage the monthly partitions of the fact tables')
+    parser.add_argument('action', choices=['install', 'list', 'reload', 'drop'],
+                        help='install: partition the fact tables and add covering indexes; '
+                             'list: show the partitions; reload: replace months from a cleaned file; '
+                             'drop: detach and drop months')
+    parser.add_argument('--db-url', default=None, help='SQLAlchemy URL of the warehouse')
+    parser.add_argument('--table', choices=sorted(PARTITIONED_TABLES), default=None,
+                        help='Fact table to act on (install and list default to both)')
+    parser.add_argument('--month', nargs='+', default=[], help='Months to reload or drop, e.g. 2021-03')
+    parser.add_argument('--file', default=None, help='Cleaned CSV or Parquet file to reload months from')
+    args = parser.parse_args()
+
+    engine = create_db_engine(args.db_url)
+    if not engine:
+        return
+    tables = [args.table] if args.table else list(PARTITIONED_TABLES)
+
+    if args.action in ('reload', 'drop') and not (args.table and args.month):
+        parser.error(f"{args.action} needs --table and --month")
+    if args.action == 'reload' and not args.file:
+        parser.error("reload needs --file")
+
+    if args.action == 'install':
+        Base.metadata.create_all(engine)
+        with engine.begin() as connection:
+            install_partitioning(connection, tables)
+    elif args.action == 'list':
+        with engine.connect() as connection:
+            for table_name in tables:
+                partitions = sorted(list_partitions(connection, table_name))
+                print(f"{table_name}: {len(partitions)} partitions {', '.join(partitions)}")
+    elif args.action == 'reload':
+        for month in args.month:
+            reload_partition(engine, args.file, args.table, month)
+    else:
+        from .cubes import rebuild_cubes_fed_by
+        from .summary import SUMMARY_SOURCES, refresh_touched_customers
+
+        with engine.begin() as connection:
+            for month in args.month:
+                touched = drop_partition(connection, args.table, month)
+                print(f"Dropped {partition_name(args.table, month)}")
+                if args.table in SUMMARY_SOURCES:
+                    refresh_touched_customers(connection, touched)
+            rebuild_cubes_fed_by(connection, args.table)
+
+if __name__ == '__main__':
+    main()
@@ -1,66 +1,93 @@
+import argparse
+import os
+
 import pandas as pd
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.dialects.postgresql import insert
 
-# Import database connection details
-from ..db_connection import DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME
+# Import the shared engine factory
+from ..db_connection import get_engine
+
+# Stage timing, row counts and profiling
+from ..instrumentation import (
+    add_arguments,
+    configure_from_args,
+    file_size,
+    instrumented,
+    record_bytes,
+    record_rows,
+    stage
+)
 
 # Import ORM models
 from ..models import (
     Base, 
-    CustomerTier, 
-    PaymentMethod, 
-    ProductCategory, 
     Customer, 
     Transaction, 
     Engagement
 )
 
-def create_db_engine():
+# Column dtypes of the cleaned files
+from ..schema import read_csv
+
+# Bulk loader for the COPY / batched insert mode
+from .bulk_load import DEFAULT_BATCH_SIZE, bulk_load_csv, sync_sequence
+from .dimension_cache import DimensionCache
+from .incremental import incremental_load_csv
+from .partitions import PartitionRouter
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PROCESSED_DIR = os.path.join(PROJECT_ROOT, 'data', 'processed')
+
+def create_db_engine(connection_string=None):
     """
-    Create a database engine connection
+    Get the shared, pooled database engine
     """
     try:
-        # SQLAlchemy engine connection string
-        connection_string = f'postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
-        engine = create_engine(connection_string)
+        # Falls back to the connection settings in db_connection
+        engine = get_engine(connection_string)
         return engine
     except Exception as error:
         print(f"Error creating database engine: {error}")
         return None
 
-def get_or_create_reference_data(session, model, name_column, value):
+def route_partitions(session, df, model):
     """
-    Get or create a reference data record
+    Create the monthly partitions a frame is about to be inserted into,
+    returning it without the rows that have no date to be routed by
     """
-    # Check if the record exists
-    existing = session.query(model).filter(
-        getattr(model, name_column) == value
-    ).first()
-    
-    if existing:
-        return existing
-    
-    # Create new record if it doesn't exist
-    new_record = model(**{name_column: value})
-    session.add(new_record)
-    session.commit()
-    return new_record
+    router = PartitionRouter(session.connection(), model.__tablename__)
+    df = router.route(df)
+    router.report()
+    return df
+
+def sync_model_sequence(session, model):
+    """
+    Move the ID sequence of a fact table past the IDs inserted from the file
+    """
+    if session.get_bind().dialect.name == 'postgresql':
+        session.flush()
+        sync_sequence(session.connection(), model.__table__)
 
-def process_customers_data(session, df):
+def resolve_reference_keys(session, cache, df, column):
+    """
+    Replace a column of reference names with their surrogate keys
+    """
+    keys = cache.resolve(session.connection(), column, df[column]).astype(object)
+    df[column] = keys.where(keys.notna(), None)
+
+@instrumented()
+def process_customers_data(session, df, cache=None):
     """
     Process and insert customer data
     """
+    record_rows(len(df))
+    if cache is None:
+        cache = DimensionCache()
+
+    # Resolve customer tiers for the whole frame up front
+    resolve_reference_keys(session, cache, df, 'customer_tier')
+
     for _, row in df.iterrows():
-        # Get or create customer tier
-        tier = get_or_create_reference_data(
-            session, 
-            CustomerTier, 
-            'tier_name', 
-            row['customer_tier']
-        )
-        
         # Create customer record
         customer = Customer(
             first_name=row['first_name'],
@@ -75,42 +102,37 @@ def process_customers_data(session, df):
             country=row['country'],
             signup_date=row['signup_date'],
             is_active=row['is_active'],
-            customer_tier=tier.tier_id
+            customer_tier=row['customer_tier']
         )
         
         session.add(customer)
     
     session.commit()
 
-def process_transactions_data(session, df):
+@instrumented()
+def process_transactions_data(session, df, cache=None):
     """
     Process and insert transaction data
     """
+    record_rows(len(df))
+    if cache is None:
+        cache = DimensionCache()
+
+    # Resolve payment methods and product categories for the whole frame up front
+    resolve_reference_keys(session, cache, df, 'payment_method')
+    resolve_reference_keys(session, cache, df, 'product_category')
+    df = route_partitions(session, df, Transaction)
+
     for _, row in df.iterrows():
-        # Get or create payment method
-        payment_method = get_or_create_reference_data(
-            session, 
-            PaymentMethod, 
-            'payment_method_name', 
-            row['payment_method']
-        )
-        
-        # Get or create product category
-        product_category = get_or_create_reference_data(
-            session, 
-            ProductCategory, 
-            'category_name', 
-            row['product_category']
-        )
-        
         # Create transaction record
         transaction = Transaction(
+            transaction_id=row['transaction_id'],
             customer_id=row['customer_id'],
             transaction_date=row['transaction_date'],
             amount=row['amount'],
-            payment_method=payment_method.payment_method_id,
+            payment_method=row['payment_method'],
             product_id=row['product_id'],
-            product_category=product_category.category_id,
+            product_category=row['product_category'],
             quantity=row['quantity'],
             discount_applied=row['discount_applied'],
             transaction_status=row['transaction_status']
@@ -118,12 +140,17 @@ def process_transactions_data(session, df):
         
         session.add(transaction)
     
+    sync_model_sequence(session, Transaction)
     session.commit()
 
-def process_engagements_data(session, df):
+@instrumented()
+def process_engagements_data(session, df, cache=None):
     """
     Process and insert engagement data
     """
+    record_rows(len(df))
+    df = route_partitions(session, df, Engagement)
+
     for _, row in df.iterrows():
         # Find the corresponding customer
         customer = session.query(Customer).filter_by(
@@ -132,6 +159,7 @@ def process_engagements_data(session, df):
         
         # Create engagement record
         engagement = Engagement(
+            engagement_id=row['engagement_id'],
             customer_id=row['customer_id'],
             engagement_date=row['engagement_date'],
             login_frequency=row['login_frequency'],
@@ -145,15 +173,23 @@ def process_engagements_data(session, df):
         
         session.add(engagement)
     
+    sync_model_sequence(session, Engagement)
     session.commit()
 
-def etl_process(csv_file, process_function):
+# Table each row-by-row loader fills, for the dtypes its file is read with
+PROCESS_TABLES = {
+    process_customers_data: 'customers',
+    process_transactions_data: 'transactions',
+    process_engagements_data: 'engagements',
+}
+
+def etl_process(csv_file, process_function, connection_string=None, cache=None):
     """
     Main ETL process function
     """
     try:
         # Create database engine
-        engine = create_db_engine()
+        engine = create_db_engine(connection_string)
         if not engine:
             return
         
@@ -163,34 +199,95 @@ def etl_process(csv_file, process_function):
         # Create a session
         Session = sessionmaker(bind=engine)
         session = Session()
-        
-        # Read CSV file
-        df = pd.read_csv(csv_file)
-        
-        # Process data based on the provided function
-        process_function(session, df)
-        
-        # Close session
-        session.close()
+        if cache is None:
+            cache = DimensionCache()
+
+        try:
+            # Timed inside the try, so a failed load is recorded as an error.
+            # The cache drops the keys of dimension rows a failed load inserted.
+            with stage('etl_process', source=csv_file, loader=process_function.__name__), cache.transaction():
+                # Read CSV file
+                record_bytes(file_size(csv_file))
+                table_name = PROCESS_TABLES.get(process_function)
+                df = read_csv(csv_file, table_name) if table_name else pd.read_csv(csv_file)
+                # The ORM takes plain Python values, None where one is missing
+                df = df.astype(object).where(df.notna(), None)
+
+                # Process data based on the provided function
+                process_function(session, df, cache)
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            # Close session
+            session.close()
         
         print(f"Data loaded successfully from {csv_file}")
     
     except Exception as error:
         print(f"Error in ETL process: {error}")
+        raise
+
+def bulk_etl_process(csv_file, table_name, batch_size=DEFAULT_BATCH_SIZE, connection_string=None, cache=None,
+                     incremental=False):
+    """
+    ETL process that bulk loads a cleaned CSV instead of inserting row by row
+    """
+    try:
+        # Create database engine
+        engine = create_db_engine(connection_string)
+        if not engine:
+            return
+
+        # Create tables if they don't exist
+        Base.metadata.create_all(engine)
+
+        if incremental:
+            incremental_load_csv(engine, csv_file, table_name, batch_size=batch_size, cache=cache)
+        else:
+            bulk_load_csv(engine, csv_file, table_name, batch_size=batch_size, cache=cache)
+
+    except Exception as error:
+        print(f"Error in bulk ETL process: {error}")
+        raise
 
 def main():
     """
     Main function to run ETL processes
     """
+    parser = argparse.ArgumentParser(description='Load cleaned CSVs into the warehouse')
+    parser.add_argument('--bulk', action='store_true',
+                        help='Load with COPY (PostgreSQL) or batched inserts instead of the ORM')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='Rows per batch in bulk mode')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Bulk load only rows added since the last run, upserting on natural IDs')
+    parser.add_argument('--db-url', default=None,
+                        help='SQLAlchemy URL of the target database, e.g. sqlite:///dw.db')
+    parser.add_argument('--processed-dir', default=PROCESSED_DIR, help='Directory with the cleaned CSVs')
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+
     # Define file paths
-    customers_file = r'E:\Programs\CustomerSegmentation_DW\data\processed\cleaned_customers.csv'
-    transactions_file = r'E:\Programs\CustomerSegmentation_DW\data\processed\cleaned_transactions.csv'
-    engagements_file = r'E:\Programs\CustomerSegmentation_DW\data\processed\cleaned_engagements.csv'
+    customers_file = os.path.join(args.processed_dir, 'cleaned_customers.csv')
+    transactions_file = os.path.join(args.processed_dir, 'cleaned_transactions.csv')
+    engagements_file = os.path.join(args.processed_dir, 'cleaned_engagements.csv')
     
-    # Run ETL processes
-    etl_process(customers_file, process_customers_data)
-    etl_process(transactions_file, process_transactions_data)
-    etl_process(engagements_file, process_engagements_data)
+    # One dimension cache for the whole run
+    cache = DimensionCache()
+
+    if args.bulk or args.incremental:
+        bulk_etl_process(customers_file, 'customers', args.batch_size, args.db_url, cache, args.incremental)
+        bulk_etl_process(transactions_file, 'transactions', args.batch_size, args.db_url, cache, args.incremental)
+        bulk_etl_process(engagements_file, 'engagements', args.batch_size, args.db_url, cache, args.incremental)
+    else:
+        # Run ETL processes
+        etl_process(customers_file, process_customers_data, args.db_url, cache)
+        etl_process(transactions_file, process_transactions_data, args.db_url, cache)
+        etl_process(engagements_file, process_engagements_data, args.db_url, cache)
+
+    cache.report()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,12 +1,11 @@
-import pandas as pd
-from sqlalchemy import create_engine
-from ..db_connection import *
+from ..db_connection import get_engine
+from ..schema import read_csv
 
 # Function to load cleaned data into the database
 def load_data_to_db(csv_file, table_name, engine):
     try:
         # Read the cleaned CSV file into a pandas DataFrame
-        df = pd.read_csv(csv_file)
+        df = read_csv(csv_file, table_name)
 
         # Insert data into the PostgreSQL table
         df.to_sql(table_name, engine, if_exists='append', index=False)
@@ -17,8 +16,8 @@ def load_data_to_db(csv_file, table_name, engine):
 # Create a database connection engine
 def create_db_engine():
     try:
-        # SQLAlchemy engine connection string
-        engine = create_engine(f'postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}')
+        # Shared, pooled engine from db_connection
+        engine = get_engine()
         return engine
     except Exception as error:
         print(f"Error creating database engine: {error}")
@@ -0,0 +1,95 @@
+import argparse
+import os
+import time
+
+from sqlalchemy import text
+
+from ..instrumentation import add_arguments, configure_from_args, instrumented, record_rows
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+SUMMARY_SQL = os.path.join(PROJECT_ROOT, 'db', 'summary.sql')
+
+# Materialized copy of the customer_summary view
+SUMMARY_TABLE = 'customer_summary_mat'
+
+# Loads that can change a customer's summary row
+SUMMARY_SOURCES = ('customers', 'transactions')
+
+# Channel notified whenever summary rows are recomputed, for processes
+# caching them such as the scoring service
+SUMMARY_CHANNEL = 'customer_summary_refreshed'
+
+def install_summary(connection):
+    """
+    Create the summary view, materialized table, index and refresh function
+    """
+    with open(SUMMARY_SQL) as f:
+        connection.exec_driver_sql(f.read())
+
+def summary_installed(connection):
+    """
+    Check whether the materialized summary exists in the target database
+    """
+    if connection.dialect.name != 'postgresql':
+        return False
+    return connection.execute(
+        text("SELECT to_regclass(:name) IS NOT NULL"), {'name': SUMMARY_TABLE}
+    ).scalar()
+
+@instrumented('refresh_summary')
+def refresh_customer_summary(connection, customer_ids=None):
+    """
+    Recompute the materialized summary rows of the given customers,
+    or of every customer when customer_ids is None
+    """
+    start = time.perf_counter()
+    if customer_ids is None:
+        refreshed = connection.execute(text("SELECT refresh_customer_summary()")).scalar()
+    else:
+        ids = sorted({int(customer_id) for customer_id in customer_ids})
+        refreshed = connection.execute(
+            text("SELECT refresh_customer_summary(CAST(:ids AS INTEGER[]))"), {'ids': ids}
+        ).scalar()
+    # Delivered when the transaction commits, so a rolled back refresh is
+    # never announced
+    connection.exec_driver_sql(f"NOTIFY {SUMMARY_CHANNEL}")
+
+    elapsed = time.perf_counter() - start
+    record_rows(refreshed)
+    print(f"Refreshed {refreshed} rows of {SUMMARY_TABLE} in {elapsed:.2f}s")
+    return refreshed
+
+def refresh_touched_customers(connection, customer_ids):
+    """
+    Refresh the summary of the customers touched by a load, if the
+    materialized summary has been installed
+    """
+    if not customer_ids:
+        return 0
+    if not summary_installed(connection):
+        print(f"{SUMMARY_TABLE} is not installed, skipping the summary refresh")
+        return 0
+    return refresh_customer_summary(connection, customer_ids)
+
+def main():
+    """
+    Install the materialized summary and rebuild it from scratch
+    """
+    # Imported here to keep the loaders free of a dependency on script.py
+    from .script import create_db_engine
+
+    parser = argparse.ArgumentParser(description='Install and fully refresh customer_summary_mat')
+    parser.add_argument('--db-url', default=None, help='SQLAlchemy URL of the target database')
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+
+    engine = create_db_engine(args.db_url)
+    if not engine:
+        return
+    with engine.begin() as connection:
+        install_summary(connection)
+        refresh_customer_summary(connection)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+import contextvars
+import cProfile
+import fnmatch
+import functools
+import inspect
+import io
+import json
+import logging
+import os
+import pstats
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROFILE_DIR = os.path.join(PROJECT_ROOT, 'data', 'profiles')
+PROFILE_MODES = ('cprofile', 'tracemalloc')
+
+# Where stage records are written as JSON lines: a file path, '-' for
+# stderr, or unset to not write them
+METRICS_LOG = os.environ.get('CUSTOMERDW_METRICS_LOG')
+
+# Lines of profile output kept in the text report of a profiled stage
+PROFILE_TOP = 30
+
+logger = logging.getLogger('customerdw.metrics')
+logger.propagate = False
+
+# Stages entered in the current thread or task, innermost last
+_active = contextvars.ContextVar('active_stages', default=())
+
+_settings = {'profile': (), 'profile_mode': 'cprofile', 'profile_dir': PROFILE_DIR}
+
+def configure(log_path=None, profile=(), profile_mode='cprofile', profile_dir=PROFILE_DIR):
+    """
+    Send stage records to log_path ('-' for stderr) and profile the
+    stages whose names match any of the profile patterns
+    """
+    if profile_mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode {profile_mode!r}, expected one of {PROFILE_MODES}")
+
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    if log_path:
+        handler = logging.StreamHandler(sys.stderr) if log_path == '-' else logging.FileHandler(log_path)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+
+    _settings.update(profile=tuple(profile or ()), profile_mode=profile_mode, profile_dir=profile_dir)
+
+def add_arguments(parser):
+    """
+    Add the instrumentation flags to a command line parser
+    """
+    parser.add_argument('--metrics-log', default=METRICS_LOG,
+                        help="Write a JSON record per stage to this file, '-' for stderr")
+    parser.add_argument('--profile', action='append', default=[], metavar='STAGE',
+                        help="Profile stages matching this name or glob, e.g. clean_transactions or 'load_*'")
+    parser.add_argument('--profile-mode', choices=PROFILE_MODES, default='cprofile',
+                        help='Profile CPU time with cProfile or allocations with tracemalloc')
+    parser.add_argument('--profile-dir', default=PROFILE_DIR, help='Directory for the profile reports')
+
+def configure_from_args(args):
+    configure(args.metrics_log, args.profile, args.profile_mode, args.profile_dir)
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process in MB. VmHWM starts over when a
+    process execs, unlike ru_maxrss which a child inherits from its parent.
+    """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def file_size(path):
+    """
+    Bytes in a file, or in every file under a directory such as a
+    partitioned Parquet dataset
+    """
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(path) for name in names)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+class StageMetrics:
+    """
+    Counters of one run of a stage
+    """
+
+    def __init__(self, name, **fields):
+        self.name = name
+        self.fields = fields
+        self.rows = 0
+        self.bytes_read = 0
+        self.round_trips = 0
+        self.seconds = None
+        self.traced_peak_mb = None
+
+    def record(self, status, error=None):
+        rate = self.rows / self.seconds if self.seconds else None
+        record = {
+            'event': 'stage',
+            'stage': self.name,
+            'status': status,
+            'seconds': round(self.seconds, 4),
+            'rows': self.rows,
+            'rows_per_sec': round(rate, 1) if rate is not None else None,
+            'bytes_read': self.bytes_read,
+            'round_trips': self.round_trips,
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+            'pid': os.getpid(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        if self.traced_peak_mb is not None:
+            record['traced_peak_mb'] = round(self.traced_peak_mb, 1)
+        if error is not None:
+            # First line only; database errors go on to list every parameter
+            message = str(error).splitlines()[0] if str(error) else ''
+            record['error'] = f'{type(error).__name__}: {message}'
+        record.update(self.fields)
+        return record
+
+def record_rows(count):
+    """
+    Add rows processed to the innermost running stage
+    """
+    active = _active.get()
+    if active:
+        active[-1].rows += int(count)
+
+def record_fields(**fields):
+    """
+    Add fields to the record of the innermost running stage
+    """
+    active = _active.get()
+    if active:
+        active[-1].fields.update(fields)
+
+def record_bytes(count):
+    """
+    Add bytes read to every running stage
+    """
+    for metrics in _active.get():
+        metrics.bytes_read += int(count)
+
+def record_round_trip(count=1):
+    """
+    Add database round trips to every running stage. Statements run
+    through SQLAlchemy are counted by watch_engine; COPY goes around it.
+    """
+    for metrics in _active.get():
+        metrics.round_trips += count
+
+def watch_engine(engine):
+    """
+    Count every statement an engine sends as a round trip of the running stages
+    """
+    from sqlalchemy import event
+
+    event.listen(engine, 'before_cursor_execute', lambda *args: record_round_trip())
+
+def should_profile(name):
+    return any(fnmatch.fnmatchcase(name, pattern) or pattern == 'all' for pattern in _settings['profile'])
+
+def profile_path(name, suffix):
+    os.makedirs(_settings['profile_dir'], exist_ok=True)
+    return os.path.join(_settings['profile_dir'], f'{name}.{os.getpid()}{suffix}')
+
+class Profiler:
+    """
+    cProfile or tracemalloc around one stage, writing its report on stop
+    """
+
+    def __init__(self, name, mode):
+        self.name = name
+        self.mode = mode
+        self.profile = None
+        self.started_tracing = False
+
+    def start(self):
+        if self.mode == 'cprofile':
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            self.started_tracing = not tracemalloc.is_tracing()
+            if self.started_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+
+    def stop(self, metrics):
+        if self.mode == 'cprofile':
+            self.profile.disable()
+            self.profile.dump_stats(profile_path(self.name, '.prof'))
+            path = profile_path(self.name, '.prof.txt')
+            report = io.StringIO()
+            pstats.Stats(self.profile, stream=report).sort_stats('cumulative').print_stats(PROFILE_TOP)
+        else:
+            metrics.traced_peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            snapshot = tracemalloc.take_snapshot()
+            if self.started_tracing:
+                tracemalloc.stop()
+            path = profile_path(self.name, '.tracemalloc.txt')
+            report = io.StringIO()
+            for stat in snapshot.statistics('lineno')[:PROFILE_TOP]:
+                print(stat, file=report)
+
+        with open(path, 'w') as f:
+            f.write(report.getvalue())
+        print(f"[{self.name}] {self.mode} report saved to {path}")
+
+@contextmanager
+def stage(name, **fields):
+    """
+    Time a block as a named stage. Rows, bytes and round trips recorded
+    inside it are counted, and a JSON record is logged when it ends, with
+    status 'error' if it raised.
+    """
+    metrics = StageMetrics(name, **fields)
+    profiler = Profiler(name, _settings['profile_mode']) if should_profile(name) else None
+    if profiler is not None:
+        profiler.start()
+
+    token = _active.set(_active.get() + (metrics,))
+    status, error = 'ok', None
+    start = time.perf_counter()
+    try:
+        yield metrics
+    except BaseException as raised:
+        status, error = 'error', raised
+        raise
+    finally:
+        metrics.seconds = time.perf_counter() - start
+        _active.reset(token)
+        if profiler is not None:
+            profiler.stop(metrics)
+        if logger.handlers:
+            logger.info(json.dumps(metrics.record(status, error), default=str))
+
+def instrumented(name=None):
+    """
+    Decorator running a function as a stage. The name may refer to the
+    function's arguments, e.g. 'load_{table_name}', and defaults to the
+    function's own name.
+    """
+    def decorate(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            stage_name = func.__name__
+            if name is not None:
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                stage_name = name.format(**bound.arguments)
+            with stage(stage_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+    return decorate
+
+if METRICS_LOG:
+    configure(METRICS_LOG)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Numeric, Boolean, Date, DateTime, ForeignKey
+from sqlalchemy import BigInteger, Column, Integer, String, Numeric, Boolean, Date, DateTime, ForeignKey
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -78,14 +78,16 @@ class Transaction(Base):
     """
     __tablename__ = 'transactions'
     
-    transaction_id = Column(Integer, primary_key=True, autoincrement=True)
+    # The date is part of the key, as db/schema.sql partitions on it. IDs
+    # come from the source files, as SQLite cannot generate part of a composite key
+    transaction_id = Column(Integer, primary_key=True)
     
     # Foreign keys
     customer_id = Column(Integer, ForeignKey('customers.customer_id'))
     payment_method = Column(Integer, ForeignKey('payment_methods.payment_method_id'))
     product_category = Column(Integer, ForeignKey('product_categories.category_id'))
     
-    transaction_date = Column(DateTime)
+    transaction_date = Column(DateTime, primary_key=True)
     amount = Column(Numeric(10, 2))
     product_id = Column(String(50))
     quantity = Column(Integer)
@@ -103,9 +105,11 @@ class Engagement(Base):
     """
     __tablename__ = 'engagements'
     
-    engagement_id = Column(Integer, primary_key=True, autoincrement=True)
+    # The date is part of the key, as db/schema.sql partitions on it. IDs
+    # come from the source files, as SQLite cannot generate part of a composite key
+    engagement_id = Column(Integer, primary_key=True)
     customer_id = Column(Integer, ForeignKey('customers.customer_id'))
-    engagement_date = Column(Date)
+    engagement_date = Column(Date, primary_key=True)
     login_frequency = Column(Integer)
     time_spent = Column(Numeric(5, 2))
     pages_visited = Column(Integer)
@@ -115,4 +119,17 @@ class Engagement(Base):
     promo_redemptions = Column(Integer)
     
     # Relationship to customer
-    customer = relationship("Customer", back_populates="engagements")
\ No newline at end of file
+    customer = relationship("Customer", back_populates="engagements")
+
+class EtlState(Base):
+    """
+    Represents the high-water mark of an incrementally loaded source
+    """
+    __tablename__ = 'etl_state'
+
+    source = Column(String(100), primary_key=True)
+    file_checksum = Column(String(64))
+    byte_offset = Column(BigInteger)
+    row_offset = Column(BigInteger)
+    max_key = Column(Integer)
+    updated_at = Column(DateTime)
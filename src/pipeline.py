@@ -0,0 +1,235 @@
+import argparse
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from .db_connection import report_pool_metrics
+from .etl.bulk_load import DEFAULT_BATCH_SIZE, bulk_load_csv
+from .etl.cubes import EXPORT_FORMATS, cubes_installed, export_cubes
+from .etl.dimension_cache import DimensionCache
+from .etl.incremental import incremental_load_csv
+from .etl.partitions import install_partitioning
+from .etl.script import create_db_engine
+from .instrumentation import add_arguments, configure_from_args
+from .models import Base
+from .preprocess.clean import clean_customers, clean_engagement, clean_transactions
+from .preprocess.key_mapping import MAPPED_TABLES, CustomerKeyMap, map_customer_keys
+from .preprocess.validate import validate_staged
+from .staging import STAGING_FORMATS
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RAW_DIR = os.path.join(PROJECT_ROOT, 'data', 'raw')
+PROCESSED_DIR = os.path.join(PROJECT_ROOT, 'data', 'processed')
+
+class Stage:
+    """
+    A unit of pipeline work and the stages it has to wait for
+    """
+
+    def __init__(self, name, func, args=(), kwargs=None, depends_on=(), cpu_bound=False):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.depends_on = tuple(depends_on)
+        # CPU-bound stages run in the process pool, the rest in threads
+        self.cpu_bound = cpu_bound
+
+def timed_call(func, args, kwargs):
+    """
+    Run a stage and return its wall-clock time
+    """
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+def run_stages(stages, workers=None):
+    """
+    Run stages as soon as their dependencies have finished, returning
+    the wall-clock time of each stage
+    """
+    names = {stage.name for stage in stages}
+    for stage in stages:
+        unknown = set(stage.depends_on) - names
+        if unknown:
+            raise ValueError(f"Stage {stage.name} depends on unknown stages: {sorted(unknown)}")
+
+    pending = {stage.name: stage for stage in stages}
+    running = {}
+    timings = {}
+
+    with ProcessPoolExecutor(workers) as processes, ThreadPoolExecutor(workers) as threads:
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if all(dependency in timings for dependency in stage.depends_on):
+                    executor = processes if stage.cpu_bound else threads
+                    running[executor.submit(timed_call, stage.func, stage.args, stage.kwargs)] = stage
+                    del pending[name]
+
+            if not running:
+                raise ValueError(f"Stages have circular dependencies: {sorted(pending)}")
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                try:
+                    timings[stage.name] = future.result()
+                except Exception:
+                    for other in running:
+                        other.cancel()
+                    raise
+                print(f"[{stage.name}] finished in {timings[stage.name]:.2f}s")
+
+    return timings
+
+def map_keys(table, path, engine=None, customers_path=None):
+    """
+    Resolve a cleaned fact file's customer IDs against the loaded customer
+    dimension, or against the cleaned customers when nothing is loaded
+    """
+    if engine is not None:
+        key_map = CustomerKeyMap.from_database(engine)
+    else:
+        key_map = CustomerKeyMap.from_staged(customers_path)
+    map_customer_keys(table, path, key_map)
+
+def validate_keys(table, path, engine=None):
+    """
+    Check a cleaned file that did not come through the cleaners before it
+    is loaded, fact files also against the loaded customer dimension
+    """
+    references = None
+    if table in MAPPED_TABLES:
+        references = {'customer_id': CustomerKeyMap.from_database(engine)}
+    validate_staged(table, path, references)
+
+def build_stages(raw_dir, processed_dir, engine=None, cache=None, batch_size=DEFAULT_BATCH_SIZE,
+                 chunksize=None, clean=True, load=True, incremental=False, refresh_summary=False,
+                 staging='csv', refresh_cubes=False):
+    """
+    Cleaning stages have no dependencies and the customer load waits for
+    its cleaner. Each cleaned fact file has its customer keys mapped once
+    the customer dimension is loaded, then is loaded itself. Without
+    cleaning, the existing files are validated instead, so orphan fact
+    rows still never reach the warehouse.
+    """
+    stages = []
+    tables = {
+        'customers': clean_customers,
+        'transactions': clean_transactions,
+        'engagements': clean_engagement,
+    }
+
+    def staged(table):
+        return os.path.join(processed_dir, f'cleaned_{table}{STAGING_FORMATS[staging]}')
+
+    for table, cleaner in tables.items():
+        source = os.path.join(raw_dir, f'{table}.csv')
+        dest = staged(table)
+
+        if clean:
+            stages.append(Stage(f'clean_{table}', cleaner, (source, dest, chunksize), cpu_bound=True))
+            if table in MAPPED_TABLES:
+                stages.append(Stage(
+                    f'map_{table}', map_keys, (table, dest, engine if load else None, staged('customers')),
+                    depends_on=[f'clean_{table}', 'load_customers' if load else 'clean_customers']
+                ))
+
+        if load and not clean:
+            stages.append(Stage(
+                f'validate_{table}', validate_keys, (table, dest, engine),
+                depends_on=['load_customers'] if table in MAPPED_TABLES else []
+            ))
+
+        if load:
+            depends_on = []
+            if clean:
+                depends_on.append(f'map_{table}' if table in MAPPED_TABLES else f'clean_{table}')
+            else:
+                depends_on.append(f'validate_{table}')
+            if table != 'customers':
+                depends_on.append('load_customers')
+            # The shared cache is only written to by one stage at a time:
+            # customers resolve tiers, and engagements have no dimensions
+            loader = incremental_load_csv if incremental else bulk_load_csv
+            stages.append(Stage(
+                f'load_{table}', loader, (engine, dest, table),
+                {'batch_size': batch_size, 'cache': cache, 'refresh_summary': refresh_summary,
+                 'refresh_cubes': refresh_cubes},
+                depends_on=depends_on
+            ))
+
+    return stages
+
+def main():
+    parser = argparse.ArgumentParser(description='Clean and load the warehouse tables in parallel')
+    parser.add_argument('--raw-dir', default=RAW_DIR, help='Directory with the raw CSVs')
+    parser.add_argument('--processed-dir', default=PROCESSED_DIR, help='Directory for the cleaned CSVs')
+    parser.add_argument('--db-url', default=None,
+                        help='SQLAlchemy URL of the target database, e.g. sqlite:///dw.db')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows per load batch')
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='Stream the raw files through the cleaners in chunks of this many rows')
+    parser.add_argument('--staging', choices=sorted(STAGING_FORMATS), default='csv',
+                        help='Format of the cleaned files handed from the cleaners to the loaders')
+    parser.add_argument('--workers', type=int, default=None, help='Size of the process and thread pools')
+    parser.add_argument('--skip-clean', action='store_true', help='Load the existing cleaned files')
+    parser.add_argument('--skip-load', action='store_true', help='Only clean the raw files')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Load only rows added since the last run, upserting on natural IDs')
+    parser.add_argument('--refresh-summary', action='store_true',
+                        help='Refresh customer_summary_mat for the customers touched by each load')
+    parser.add_argument('--refresh-cubes', action='store_true',
+                        help='Update the aggregate cubes from each load and export them afterwards')
+    parser.add_argument('--cube-format', choices=sorted(EXPORT_FORMATS), default='csv',
+                        help='Format of the cube extracts written with --refresh-cubes')
+    parser.add_argument('--partition', action='store_true',
+                        help='Partition the fact tables by month (PostgreSQL) before loading them')
+    add_arguments(parser)
+    args = parser.parse_args()
+    # Before the pools start, so forked stage workers inherit the settings
+    configure_from_args(args)
+
+    engine = None
+    cache = None
+    if not args.skip_load:
+        # One pooled engine and dimension cache shared by every load stage
+        engine = create_db_engine(args.db_url)
+        if not engine:
+            return
+        Base.metadata.create_all(engine)
+        if args.partition:
+            with engine.begin() as connection:
+                install_partitioning(connection)
+        cache = DimensionCache()
+
+    stages = build_stages(
+        args.raw_dir, args.processed_dir, engine, cache, args.batch_size, args.chunksize,
+        clean=not args.skip_clean, load=not args.skip_load, incremental=args.incremental,
+        refresh_summary=args.refresh_summary, staging=args.staging, refresh_cubes=args.refresh_cubes
+    )
+
+    start = time.perf_counter()
+    timings = run_stages(stages, args.workers)
+    total = time.perf_counter() - start
+
+    print("Stage timings:")
+    for name, elapsed in timings.items():
+        print(f"  {name:<20} {elapsed:8.2f}s")
+    print(f"  {'total (wall clock)':<20} {total:8.2f}s")
+
+    if args.refresh_cubes and engine is not None:
+        with engine.connect() as connection:
+            installed = cubes_installed(connection)
+        if installed:
+            export_cubes(engine, fmt=args.cube_format)
+        else:
+            print("Cubes are not installed, skipping the cube export")
+
+    if cache is not None:
+        cache.report()
+    if engine is not None:
+        report_pool_metrics(engine)
+
+if __name__ == '__main__':
+    main()
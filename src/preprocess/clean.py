@@ -1,88 +1,238 @@
-import pandas as pd
-from numpy.random import randint
-from datetime import datetime
-
-def convert_date(date_str):
-    try:
-        return pd.to_datetime(date_str, format="%m/%d/%Y")
-    except:
-        return None
-
-def clean_customers(file_path, dest_path):
-    customers = pd.read_csv(file_path)
-
-    customers['city'] = customers['city'].fillna('Unknown')
-    customers['state'] = customers['state'].fillna('Unknown')
-    customers['country'] = customers['country'].fillna('Unknown')
-
-    customers['is_active'] = customers['is_active'].apply( lambda x: True if ( x ) else False )
+import argparse
+import os
 
-    customers['dob'] = customers['dob'].apply(convert_date)
-    customers['signup_date'] = customers['signup_date'].apply(convert_date)
-
-    customers.drop_duplicates(subset='customer_id', inplace=True)
-
-    valid_genders = ['Male', 'Female', 'Other']
-    customers['gender'] = customers['gender'].apply(lambda x: x if x in valid_genders else 'Other')
+import numpy as np
+import pandas as pd
 
-    customers.to_csv(dest_path, index=False)
+from ..instrumentation import add_arguments, configure_from_args, file_size, instrumented, record_bytes, record_rows
+from ..schema import conform, read_csv
+from ..staging import PARTITION_COLUMNS, STAGING_FORMATS, rejects_path, write_staged
+from .key_mapping import CustomerKeyMap, map_customer_keys
+from .validate import Validator
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+RAW_DIR = os.path.join(PROJECT_ROOT, 'data', 'raw')
+PROCESSED_DIR = os.path.join(PROJECT_ROOT, 'data', 'processed')
+
+VALID_GENDERS = ['Male', 'Female', 'Other']
+VALID_STATUSES = ['completed', 'pending', 'refunded']
+
+ENGAGEMENT_METRICS = ['login_frequency', 'time_spent', 'pages_visited', 'purchase_clicks',
+                      'feedback_score', 'email_open_rate', 'promo_redemptions']
+
+# Values each transform replaces rather than rejects, counted by the validator
+COERCIONS = {
+    'customers': {'dob': 'date', 'signup_date': 'date', 'gender': 'replaced',
+                  'city': 'filled', 'state': 'filled', 'country': 'filled'},
+    'transactions': {'transaction_date': 'date', 'transaction_status': 'replaced', 'product_category': 'filled'},
+    'engagements': dict({'engagement_date': 'date'}, **{column: 'filled' for column in ENGAGEMENT_METRICS}),
+}
+
+def convert_dates(dates):
+    """
+    Parse a whole column of m/d/Y dates, unparseable values become NaT
+    """
+    return pd.to_datetime(dates, format="%m/%d/%Y", errors="coerce")
+
+class SeenIds:
+    """
+    Compact record of the IDs already written by a streaming cleaner.
+    Non-negative integer IDs are kept in a growable bitmap (one bit per ID),
+    anything else falls back to a set.
+    """
+
+    def __init__(self, capacity=1 << 20):
+        self.bits = np.zeros((capacity + 7) // 8, dtype=np.uint8)
+        self.other = set()
+
+    def grow(self, max_id):
+        size = len(self.bits)
+        while size * 8 <= max_id:
+            size *= 2
+        if size != len(self.bits):
+            self.bits = np.concatenate([self.bits, np.zeros(size - len(self.bits), dtype=np.uint8)])
+
+    def add_new(self, ids):
+        """
+        Mark a chunk of IDs as seen and return a mask of the rows whose ID
+        has not been seen before (the first occurrence wins)
+        """
+        ids = pd.Series(ids).reset_index(drop=True)
+        keep = ~ids.duplicated().to_numpy()
+
+        numeric = pd.to_numeric(ids, errors='coerce')
+        in_bitmap = (numeric >= 0) & (numeric % 1 == 0)
+        in_bitmap = in_bitmap.to_numpy()
+
+        # Bitmap path for non-negative integer IDs
+        values = numeric[in_bitmap].to_numpy(dtype=np.int64)
+        if len(values):
+            self.grow(values.max())
+            byte, bit = values >> 3, (values & 7).astype(np.uint8)
+            seen = (self.bits[byte] >> bit) & 1
+            keep[in_bitmap] &= seen == 0
+            np.bitwise_or.at(self.bits, byte, np.left_shift(1, bit).astype(np.uint8))
+
+        # Set path for everything else
+        for position in np.flatnonzero(~in_bitmap):
+            value = ids.iat[position]
+            value = 'nan' if pd.isna(value) else value
+            if value in self.other:
+                keep[position] = False
+            self.other.add(value)
+
+        return keep
+
+def table_validator(table, dest_path):
+    return Validator(table, rejects_path(dest_path, table, 'invalid'), coercions=COERCIONS[table])
+
+def clean_frame(frame, transform, validator):
+    """
+    Transform a raw frame, keeping a copy of the columns the transform
+    coerces so the validator can count what changed
+    """
+    raw = frame[[column for column in validator.raw_columns if column in frame.columns]].copy()
+    return transform(frame), raw
+
+def clean_in_chunks(file_path, dest_path, transform, id_column, chunksize, partition_on=None, validator=None):
+    """
+    Stream a raw file through a cleaning transform chunk by chunk, appending
+    to the destination and dropping IDs already written by earlier chunks
+    and rows the validator rejects. Rows that pass are cast to the dtypes
+    of src/schema.py.
+    """
+    seen = SeenIds()
+    table = validator.table_name
+
+    for part, chunk in enumerate(read_csv(file_path, table, raw=True, chunksize=chunksize)):
+        chunk, raw = clean_frame(chunk, transform, validator)
+        chunk = chunk[seen.add_new(chunk[id_column])]
+        chunk = conform(validator.filter(chunk, raw), table)
+        record_rows(len(chunk))
+
+        write_staged(chunk, dest_path, partition_on, part)
+    validator.report()
+
+def clean_whole(file_path, dest_path, transform, id_column, partition_on, validator):
+    """
+    Clean a raw file read in one piece
+    """
+    table = validator.table_name
+    frame, raw = clean_frame(read_csv(file_path, table, raw=True), transform, validator)
+    frame = frame.drop_duplicates(subset=id_column)
+    frame = conform(validator.filter(frame, raw), table)
+    record_rows(len(frame))
+    write_staged(frame, dest_path, partition_on)
+    validator.report()
+
+def transform_customers(customers):
+    location_columns = ['city', 'state', 'country']
+    customers[location_columns] = customers[location_columns].fillna('Unknown')
+
+    customers['is_active'] = customers['is_active'].astype(bool)
+
+    customers['dob'] = convert_dates(customers['dob'])
+    customers['signup_date'] = convert_dates(customers['signup_date'])
+
+    gender = customers['gender'].where(customers['gender'].isin(VALID_GENDERS), 'Other')
+    customers['gender'] = pd.Categorical(gender, categories=VALID_GENDERS)
+    customers['customer_tier'] = customers['customer_tier'].astype('category')
+
+    return customers
+
+@instrumented('clean_customers')
+def clean_customers(file_path, dest_path, chunksize=None):
+    record_bytes(file_size(file_path))
+    validator = table_validator('customers', dest_path)
+    if chunksize:
+        clean_in_chunks(file_path, dest_path, transform_customers, 'customer_id', chunksize,
+                        PARTITION_COLUMNS['customers'], validator)
+    else:
+        clean_whole(file_path, dest_path, transform_customers, 'customer_id', PARTITION_COLUMNS['customers'],
+                    validator)
     print("Cleaned customers.csv saved!")
 
 
-def clean_engagement(file_path, dest_path):
-    engagements = pd.read_csv(file_path)
-
-    engagements['customer_id'] = engagements['customer_id'].apply( lambda x: randint(1,1000) )
-
+def transform_engagement(engagements):
     engagements.fillna(0, inplace=True)
 
-    engagements['engagement_date'] = engagements['engagement_date'].apply(convert_date)
+    engagements['engagement_date'] = convert_dates(engagements['engagement_date'])
 
-    numeric_columns = ['login_frequency', 'time_spent', 'pages_visited', 
-                       'purchase_clicks', 'feedback_score', 'email_open_rate', 
-                       'promo_redemptions']
-    engagements[numeric_columns] = engagements[numeric_columns].apply(pd.to_numeric)
+    engagements[ENGAGEMENT_METRICS] = engagements[ENGAGEMENT_METRICS].apply(pd.to_numeric)
 
     engagements['time_spent'] = ( engagements['time_spent'] / 60 ).round(2)
 
-    engagements.drop_duplicates(subset='engagement_id', inplace=True)
-
-    engagements.to_csv(dest_path, index=False)
+    return engagements
+
+@instrumented('clean_engagements')
+def clean_engagement(file_path, dest_path, chunksize=None):
+    record_bytes(file_size(file_path))
+    validator = table_validator('engagements', dest_path)
+    if chunksize:
+        clean_in_chunks(file_path, dest_path, transform_engagement, 'engagement_id', chunksize,
+                        PARTITION_COLUMNS['engagements'], validator)
+    else:
+        clean_whole(file_path, dest_path, transform_engagement, 'engagement_id', PARTITION_COLUMNS['engagements'],
+                    validator)
     print("Cleaned engagements.csv saved!")
 
-def clean_transactions(file_path, dest_path):
-    transactions = pd.read_csv(file_path)
-
-    transactions['customer_id'] = transactions['customer_id'].apply( lambda x: randint(1,1000) )
+def transform_transactions(transactions):
+    transactions['product_category'] = transactions['product_category'].fillna('Unknown').astype('category')
+    transactions['payment_method'] = transactions['payment_method'].astype('category')
 
-    transactions['product_category'] = transactions['product_category'].fillna('Unknown')
-    transactions['transaction_status'] = transactions['transaction_status'].fillna('unknown')
-
-    transactions['transaction_date'] = transactions['transaction_date'].apply(convert_date)
+    transactions['transaction_date'] = convert_dates(transactions['transaction_date'])
 
     numeric_columns = ['amount', 'quantity']
     transactions[numeric_columns] = transactions[numeric_columns].apply(pd.to_numeric)
 
-    transactions['discount_applied'] = transactions['discount_applied'].apply( lambda x: True if x > 0 else False )
-
-    transactions.drop_duplicates(subset='transaction_id', inplace=True)
-
-    valid_statuses = ['completed', 'pending', 'refunded']
-    transactions['transaction_status'] = transactions['transaction_status'].apply(
-        lambda x: x if x in valid_statuses else 'unknown'
-    )
-
-    transactions.to_csv(dest_path, index=False)
+    transactions['discount_applied'] = transactions['discount_applied'] > 0
+
+    # Missing and unrecognised statuses both become 'unknown'
+    status = transactions['transaction_status']
+    status = status.where(status.isin(VALID_STATUSES), 'unknown')
+    transactions['transaction_status'] = pd.Categorical(status, categories=VALID_STATUSES + ['unknown'])
+
+    return transactions
+
+@instrumented('clean_transactions')
+def clean_transactions(file_path, dest_path, chunksize=None):
+    record_bytes(file_size(file_path))
+    validator = table_validator('transactions', dest_path)
+    if chunksize:
+        clean_in_chunks(file_path, dest_path, transform_transactions, 'transaction_id', chunksize,
+                        PARTITION_COLUMNS['transactions'], validator)
+    else:
+        clean_whole(file_path, dest_path, transform_transactions, 'transaction_id',
+                    PARTITION_COLUMNS['transactions'], validator)
     print("Cleaned transactions.csv saved!")
 
-customers_path = r'E:\Programs\CustomerSegmentation_DW\data\raw\customers.csv'
-engagements_path = r'E:\Programs\CustomerSegmentation_DW\data\raw\engagements.csv'
-transactions_path = r'E:\Programs\CustomerSegmentation_DW\data\raw\transactions.csv'
-
-customers_dest = r'E:\Programs\CustomerSegmentation_DW\data\processed\cleaned_customers.csv'
-engagements_dest = r'E:\Programs\CustomerSegmentation_DW\data\processed\cleaned_engagements.csv'
-transactions_dest = r'E:\Programs\CustomerSegmentation_DW\data\processed\cleaned_transactions.csv'
-
-clean_customers(customers_path, customers_dest)
-clean_engagement(engagements_path, engagements_dest)
-clean_transactions(transactions_path, transactions_dest)
+def main():
+    parser = argparse.ArgumentParser(description='Clean the raw customer, engagement and transaction files')
+    parser.add_argument('--raw-dir', default=RAW_DIR, help='Directory with the raw CSVs')
+    parser.add_argument('--processed-dir', default=PROCESSED_DIR, help='Directory for the cleaned files')
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='Stream each file in chunks of this many rows instead of loading it whole')
+    parser.add_argument('--staging', choices=sorted(STAGING_FORMATS), default='csv',
+                        help='Format of the cleaned files')
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+
+    def raw(table):
+        return os.path.join(args.raw_dir, f'{table}.csv')
+
+    def staged(table):
+        return os.path.join(args.processed_dir, f'cleaned_{table}{STAGING_FORMATS[args.staging]}')
+
+    os.makedirs(args.processed_dir, exist_ok=True)
+    clean_customers(raw('customers'), staged('customers'), args.chunksize)
+    clean_engagement(raw('engagements'), staged('engagements'), args.chunksize)
+    clean_transactions(raw('transactions'), staged('transactions'), args.chunksize)
+
+    # Resolve the facts' customer IDs against the cleaned customers
+    key_map = CustomerKeyMap.from_staged(staged('customers'))
+    map_customer_keys('engagements', staged('engagements'), key_map)
+    map_customer_keys('transactions', staged('transactions'), key_map)
+
+if __name__ == '__main__':
+    main()
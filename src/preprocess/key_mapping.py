@@ -0,0 +1,95 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from ..instrumentation import file_size, instrumented, record_bytes, record_rows
+from ..schema import conform
+from ..staging import PARTITION_COLUMNS, iter_staged, read_staged, rejects_path, replace_staged, write_staged
+
+# Fact tables whose customer_id is resolved against the customer dimension
+MAPPED_TABLES = ('transactions', 'engagements')
+
+# Rows read, mapped and written per batch
+DEFAULT_BATCH_SIZE = 100000
+
+REJECT_REASON = 'unknown customer_id'
+
+class CustomerKeyMap:
+    """
+    Source customer IDs and the warehouse keys they resolve to, held in a
+    hash index so a whole column is mapped with one lookup
+    """
+
+    def __init__(self, source_ids, keys=None):
+        source_ids = np.asarray(source_ids, dtype=np.int64)
+        self.index = pd.Index(source_ids)
+        self.keys = source_ids if keys is None else np.asarray(keys, dtype=np.int64)
+
+        if not self.index.is_unique:
+            raise ValueError("Customer dimension has duplicate source IDs")
+
+    @classmethod
+    def from_database(cls, engine):
+        """
+        Keys of the customers already loaded into the warehouse
+        """
+        customers = pd.read_sql("SELECT customer_id FROM customers", engine)
+        return cls(customers['customer_id'])
+
+    @classmethod
+    def from_staged(cls, path):
+        """
+        Keys of the customers in a cleaned customers file, for runs that
+        clean without loading
+        """
+        customers = read_staged(path, columns=['customer_id'], table='customers')
+        return cls(pd.to_numeric(customers['customer_id'], errors='coerce').dropna())
+
+    def resolve(self, source_ids):
+        """
+        Map a column of source IDs to warehouse keys, returning the keys and
+        a mask of the orphans, rows whose customer is not in the dimension
+        """
+        positions = self.index.get_indexer(pd.to_numeric(source_ids, errors='coerce'))
+        orphans = positions < 0
+        keys = np.zeros(len(positions), dtype=np.int64)
+        keys[~orphans] = self.keys[positions[~orphans]]
+        return keys, orphans
+
+@instrumented('map_{table}')
+def map_customer_keys(table, path, key_map, reject_path=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Rewrite the customer_id of a cleaned fact file with warehouse keys.
+    Rows whose customer is not in the dimension go to a reject file with
+    the reason instead. The output only depends on the inputs, so reruns
+    produce identical files.
+    """
+    reject_path = reject_path or rejects_path(path, table, 'orphan')
+    root, extension = os.path.splitext(path)
+    tmp_path = f'{root}.tmp{extension}'
+
+    if os.path.exists(reject_path):
+        os.remove(reject_path)
+
+    record_bytes(file_size(path))
+    mapped = rejected = 0
+    for part, chunk in enumerate(iter_staged(path, batch_size, table=table)):
+        keys, orphans = key_map.resolve(chunk['customer_id'])
+        record_rows(len(chunk))
+
+        if orphans.any():
+            orphan_rows = chunk[orphans].assign(reject_reason=REJECT_REASON)
+            orphan_rows.to_csv(reject_path, mode='a', header=rejected == 0, index=False)
+            rejected += len(orphan_rows)
+
+        chunk = conform(chunk[~orphans].assign(customer_id=keys[~orphans]), table)
+        write_staged(chunk, tmp_path, PARTITION_COLUMNS[table], part)
+        mapped += len(chunk)
+
+    replace_staged(tmp_path, path)
+    message = f"Mapped customer keys of {mapped} {table} rows"
+    if rejected:
+        message += f", {rejected} orphans written to {reject_path}"
+    print(message)
+    return mapped, rejected
@@ -0,0 +1,299 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import BigInteger, Boolean, Date, DateTime, Integer, Numeric, String
+
+from ..instrumentation import (
+    add_arguments, configure_from_args, file_size, instrumented, record_bytes, record_fields, record_rows,
+)
+from ..models import Base
+from ..schema import conform
+from ..staging import PARTITION_COLUMNS, STAGING_FORMATS, iter_staged, rejects_path, replace_staged, write_staged
+from .key_mapping import DEFAULT_BATCH_SIZE, MAPPED_TABLES, CustomerKeyMap
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PROCESSED_DIR = os.path.join(PROJECT_ROOT, 'data', 'processed')
+
+BOOLEAN_VALUES = ['true', 'false', '1', '0', '1.0', '0.0']
+
+class Rule:
+    """
+    A named check of one column, evaluated over a whole chunk at once.
+
+    check(values, raw) returns a boolean mask of the failing rows; raw is
+    the column as read before cleaning, when there is one. Rows failing a
+    'reject' rule are kept out of the cleaned file, 'warn' rules are only
+    counted.
+    """
+
+    def __init__(self, name, column, check, severity='reject'):
+        self.name = name
+        self.column = column
+        self.check = check
+        self.severity = severity
+
+    def failures(self, frame, raw=None):
+        raw_values = raw[self.column] if raw is not None and self.column in raw.columns else None
+        return np.asarray(self.check(frame[self.column], raw_values), dtype=bool)
+
+def required(values, raw=None):
+    return values.isna()
+
+def max_length(length):
+    def check(values, raw=None):
+        return values.notna() & (values.astype(str).str.len() > length)
+    return check
+
+def integer(bits):
+    limit = 2 ** (bits - 1) - 1
+
+    def check(values, raw=None):
+        numbers = pd.to_numeric(values, errors='coerce')
+        return values.notna() & (numbers.isna() | (numbers % 1 != 0) | (numbers.abs() > limit))
+    return check
+
+def numeric(precision, scale):
+    limit = 10 ** (precision - scale)
+
+    def check(values, raw=None):
+        numbers = pd.to_numeric(values, errors='coerce')
+        return values.notna() & (numbers.isna() | (numbers.round(scale).abs() >= limit))
+    return check
+
+def boolean(values, raw=None):
+    if pd.api.types.is_bool_dtype(values):
+        return np.zeros(len(values), dtype=bool)
+    return values.notna() & ~values.astype(str).str.lower().isin(BOOLEAN_VALUES)
+
+def date(values, raw=None):
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return np.zeros(len(values), dtype=bool)
+    parsed = pd.to_datetime(values.astype('string'), format='ISO8601', errors='coerce')
+    return values.notna() & parsed.isna()
+
+def member_of(key_map):
+    def check(values, raw=None):
+        return values.notna() & key_map.resolve(values)[1]
+    return check
+
+# How the cleaners coerce values they cannot use. The rows are kept, so
+# these only count how much data was changed.
+def coerced_date(values, raw):
+    return raw.notna() & values.isna()
+
+def filled(values, raw):
+    return raw.isna()
+
+def replaced(values, raw):
+    return raw.astype(str).to_numpy() != values.astype(str).to_numpy()
+
+COERCIONS = {
+    'date': ('{column} unparseable, set to null', coerced_date),
+    'filled': ('{column} missing, filled in', filled),
+    'replaced': ('{column} invalid, replaced', replaced),
+}
+
+def dimension_length(column):
+    """
+    Length of the name a dimension key is resolved from
+    """
+    dimension = next(iter(column.foreign_keys)).column.table
+    names = [other for other in dimension.columns if isinstance(other.type, String)]
+    return names[0].type.length if names else None
+
+def model_rules(table_name):
+    """
+    Rules for the constraints of a table in src/models.py
+    """
+    table = Base.metadata.tables[table_name]
+    rules = []
+    for column in table.columns:
+        name = column.name
+        if not column.nullable:
+            rules.append(Rule(f'{name} missing', name, required))
+
+        # Dimension keys are still names in the cleaned files
+        if column.foreign_keys and name != 'customer_id':
+            length = dimension_length(column)
+            if length:
+                rules.append(Rule(f'{name} longer than {length}', name, max_length(length)))
+            continue
+
+        if isinstance(column.type, String) and column.type.length:
+            rules.append(Rule(f'{name} longer than {column.type.length}', name, max_length(column.type.length)))
+        elif isinstance(column.type, Integer):
+            bits = 64 if isinstance(column.type, BigInteger) else 32
+            rules.append(Rule(f'{name} not a {bits}-bit integer', name, integer(bits)))
+        elif isinstance(column.type, Numeric):
+            precision, scale = column.type.precision, column.type.scale
+            rules.append(Rule(f'{name} exceeds NUMERIC({precision}, {scale})', name, numeric(precision, scale)))
+        elif isinstance(column.type, Boolean):
+            rules.append(Rule(f'{name} not a boolean', name, boolean))
+        elif isinstance(column.type, (Date, DateTime)):
+            rules.append(Rule(f'{name} not a date', name, date))
+    return rules
+
+class Validator:
+    """
+    Checks cleaned chunks of a table against its rules before they are
+    staged for loading.
+
+    Every rule is a vectorized mask over the chunk, so a chunk costs a few
+    passes over its columns however many rows fail. Rows failing any reject
+    rule, or repeating a value of a unique column seen earlier in the file,
+    are appended to reject_path with every reason they failed, and the
+    number of rows failing each rule is counted.
+    """
+
+    def __init__(self, table_name, reject_path=None, references=None, coercions=None):
+        table = Base.metadata.tables[table_name]
+        self.table_name = table_name
+        self.reject_path = reject_path
+        self.rules = model_rules(table_name)
+        for column, key_map in (references or {}).items():
+            self.rules.append(Rule(f'unknown {column}', column, member_of(key_map)))
+        for column, kind in (coercions or {}).items():
+            reason, check = COERCIONS[kind]
+            self.rules.append(Rule(reason.format(column=column), column, check, severity='warn'))
+
+        self.unique_columns = [column.name for column in table.columns if column.unique]
+        # Hashes of the unique values already accepted, kept sorted
+        self.seen = {column: np.empty(0, dtype=np.uint64) for column in self.unique_columns}
+        self.counts = {rule.name: 0 for rule in self.rules}
+        self.counts.update({f'duplicate {column}': 0 for column in self.unique_columns})
+        self.checked = 0
+        self.rejected = 0
+
+        if reject_path and os.path.exists(reject_path):
+            os.remove(reject_path)
+
+    @property
+    def raw_columns(self):
+        """
+        Columns to keep a copy of before cleaning, for the coercion counts
+        """
+        return [rule.column for rule in self.rules if rule.severity == 'warn']
+
+    def filter(self, frame, raw=None):
+        """
+        Return the rows of a chunk that pass, writing the others out
+        """
+        if raw is not None:
+            raw = raw.reindex(frame.index)
+
+        failed = []
+        reject = np.zeros(len(frame), dtype=bool)
+        for rule in self.rules:
+            if rule.column not in frame.columns:
+                continue
+            mask = rule.failures(frame, raw)
+            count = int(mask.sum())
+            if not count:
+                continue
+            self.counts[rule.name] += count
+            if rule.severity == 'reject':
+                reject |= mask
+                failed.append((rule.name, mask))
+
+        for column in self.unique_columns:
+            if column not in frame.columns:
+                continue
+            mask = self.duplicates(frame[column], reject)
+            count = int(mask.sum())
+            if count:
+                self.counts[f'duplicate {column}'] += count
+                reject |= mask
+                failed.append((f'duplicate {column}', mask))
+
+        self.checked += len(frame)
+        if reject.any():
+            self.write_rejects(frame[reject], [(name, mask[reject]) for name, mask in failed])
+        return frame[~reject]
+
+    def duplicates(self, values, reject):
+        """
+        Mask of the rows repeating a value accepted before, in this chunk or
+        an earlier one. Rows already rejected do not claim their value.
+        """
+        column = values.name
+        present = values.notna().to_numpy() & ~reject
+        hashes = pd.util.hash_pandas_object(values[present], index=False).to_numpy()
+
+        repeated = pd.Series(hashes).duplicated().to_numpy() | np.isin(hashes, self.seen[column])
+        self.seen[column] = np.union1d(self.seen[column], hashes[~repeated])
+        mask = np.zeros(len(values), dtype=bool)
+        mask[present] = repeated
+        return mask
+
+    def write_rejects(self, rows, failed):
+        reasons = np.full(len(rows), '', dtype=object)
+        for name, mask in failed:
+            reasons[mask] = reasons[mask] + '; ' + name
+        # Written with the table's dtypes where the values allow it
+        rows = conform(rows, self.table_name, errors='ignore')
+        rows = rows.assign(reject_reason=[reason[2:] for reason in reasons])
+        self.rejected += len(rows)
+        if self.reject_path:
+            rows.to_csv(self.reject_path, mode='a', header=not os.path.exists(self.reject_path), index=False)
+
+    def report(self):
+        """
+        Print the rows failing each rule and add the counts to the running
+        stage's metrics record
+        """
+        counts = {name: count for name, count in self.counts.items() if count}
+        record_fields(rows_checked=self.checked, rows_rejected=self.rejected, rule_counts=counts)
+
+        message = f"Validated {self.checked} {self.table_name} rows, {self.rejected} rejected"
+        if self.rejected and self.reject_path:
+            message += f" to {self.reject_path}"
+        print(message)
+        for rule in self.rules:
+            if self.counts[rule.name]:
+                print(f"  {rule.name}: {self.counts[rule.name]} rows" + (' (kept)' if rule.severity == 'warn' else ''))
+        for column in self.unique_columns:
+            if self.counts[f'duplicate {column}']:
+                print(f"  duplicate {column}: {self.counts[f'duplicate {column}']} rows")
+        return counts
+
+@instrumented('validate_{table}')
+def validate_staged(table, path, references=None, reject_path=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Check a cleaned file in place, for files that did not come through the
+    cleaners. Failing rows are moved to a reject file.
+    """
+    validator = Validator(table, reject_path or rejects_path(path, table, 'invalid'), references)
+    root, extension = os.path.splitext(path)
+    tmp_path = f'{root}.tmp{extension}'
+
+    record_bytes(file_size(path))
+    for part, chunk in enumerate(iter_staged(path, batch_size, table=table)):
+        record_rows(len(chunk))
+        write_staged(validator.filter(chunk), tmp_path, PARTITION_COLUMNS[table], part)
+
+    replace_staged(tmp_path, path)
+    return validator.report()
+
+def main():
+    parser = argparse.ArgumentParser(description='Validate the cleaned files against the warehouse constraints')
+    parser.add_argument('--processed-dir', default=PROCESSED_DIR, help='Directory with the cleaned files')
+    parser.add_argument('--staging', choices=sorted(STAGING_FORMATS), default='csv',
+                        help='Format of the cleaned files')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows checked per chunk')
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+
+    def staged(table):
+        return os.path.join(args.processed_dir, f'cleaned_{table}{STAGING_FORMATS[args.staging]}')
+
+    validate_staged('customers', staged('customers'), batch_size=args.batch_size)
+    # Facts must point at a customer that passed
+    key_map = CustomerKeyMap.from_staged(staged('customers'))
+    for table in MAPPED_TABLES:
+        validate_staged(table, staged(table), {'customer_id': key_map}, batch_size=args.batch_size)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+import importlib.util
+
+import pandas as pd
+from sqlalchemy import Boolean, Date, DateTime, Integer, Numeric, String
+
+from .models import Base
+
+# Tables read from the raw and cleaned files
+FILE_TABLES = ('customers', 'transactions', 'engagements')
+
+# Text columns with few distinct values, held as categoricals. Dimension
+# keys are still names in the files.
+CATEGORICAL_COLUMNS = {
+    'customers': ['gender', 'city', 'state', 'country', 'customer_tier'],
+    'transactions': ['payment_method', 'product_category', 'transaction_status'],
+    'engagements': [],
+}
+
+# Other text, such as names and emails, is held in pyarrow string arrays
+# instead of one Python object per value, when pyarrow is installed
+STRING_DTYPE = 'string[pyarrow]' if importlib.util.find_spec('pyarrow') else object
+
+# Significant digits a float32 keeps, so a NUMERIC(p, s) with p up to
+# this rounds back to the same value
+FLOAT32_DIGITS = 6
+
+DATE_DTYPE = 'datetime64[ns]'
+
+def column_dtype(table_name, column):
+    """
+    pandas dtype of a column of src/models.py in the cleaned files
+    """
+    if column.name in CATEGORICAL_COLUMNS.get(table_name, ()):
+        return 'category'
+    if isinstance(column.type, String):
+        return STRING_DTYPE
+    if isinstance(column.type, Integer):
+        # The models' INTEGER is 32 bits; keys are never missing once cleaned
+        return 'int32' if column.primary_key else 'Int32'
+    if isinstance(column.type, Numeric):
+        return 'float32' if column.type.precision <= FLOAT32_DIGITS else 'float64'
+    if isinstance(column.type, Boolean):
+        return 'boolean'
+    if isinstance(column.type, (Date, DateTime)):
+        return DATE_DTYPE
+    return object
+
+TABLE_DTYPES = {
+    name: {column.name: column_dtype(name, column) for column in Base.metadata.tables[name].columns}
+    for name in FILE_TABLES
+}
+
+def date_columns(table_name, columns=None):
+    return [name for name, dtype in TABLE_DTYPES[table_name].items()
+            if dtype == DATE_DTYPE and (columns is None or name in columns)]
+
+def read_dtypes(table_name, columns=None, raw=False):
+    """
+    dtype argument of pd.read_csv for a table's file; dates are left to
+    parse_dates. Raw files only have their text typed, as pyarrow strings:
+    the cleaners still rewrite those values, and numbers that do not fit
+    the warehouse types are rejected by the validator rather than the
+    reader.
+    """
+    dtypes = {}
+    for name, dtype in TABLE_DTYPES[table_name].items():
+        if columns is not None and name not in columns or dtype in (DATE_DTYPE, object):
+            continue
+        if raw:
+            if dtype in ('category', STRING_DTYPE):
+                dtypes[name] = STRING_DTYPE
+        else:
+            dtypes[name] = dtype
+    return dtypes
+
+def read_csv(path, table_name, columns=None, raw=False, **kwargs):
+    """
+    pd.read_csv with the table's dtypes, and its dates parsed for cleaned files
+    """
+    if not raw and 'parse_dates' not in kwargs:
+        # Only the date columns the file has
+        present = columns or kwargs.get('names') or pd.read_csv(path, nrows=0).columns
+        kwargs['parse_dates'] = date_columns(table_name, present)
+    return pd.read_csv(path, usecols=columns, dtype=read_dtypes(table_name, columns, raw), **kwargs)
+
+def conform(frame, table_name, errors='raise'):
+    """
+    Cast a cleaned frame's columns to the table's dtypes before it is
+    staged. With errors='ignore', columns that cannot be cast are left as
+    they are, for rejected rows that hold the values they failed on. With
+    errors='coerce', dates that cannot be parsed become NaT and other
+    columns are cast as with 'raise'.
+    """
+    frame = frame.copy()
+    for name, dtype in TABLE_DTYPES[table_name].items():
+        if name not in frame.columns or dtype is object or frame[name].dtype == dtype:
+            continue
+        try:
+            if dtype == DATE_DTYPE:
+                frame[name] = pd.to_datetime(frame[name], errors='coerce' if errors == 'coerce' else 'raise')
+            else:
+                frame[name] = frame[name].astype(dtype)
+        except (TypeError, ValueError, OverflowError):
+            if errors != 'ignore':
+                raise
+    return frame
@@ -0,0 +1,175 @@
+import os
+import shutil
+
+import pandas as pd
+
+from .schema import conform, read_csv
+
+# Cleaned files whose path ends in .parquet are written as Parquet datasets,
+# anything else as CSV. pyarrow is only needed for the Parquet format.
+PARQUET_SUFFIX = '.parquet'
+STAGING_FORMATS = {'csv': '.csv', 'parquet': PARQUET_SUFFIX}
+
+# Date column each cleaned table is partitioned on, one directory per month
+PARTITION_COLUMNS = {
+    'customers': 'signup_date',
+    'transactions': 'transaction_date',
+    'engagements': 'engagement_date',
+}
+PARTITION_KEY = 'month'
+NULL_PARTITION = 'none'
+
+# Reject files written next to a table's cleaned file, by kind
+REJECT_FILES = {
+    # Rows failing the warehouse constraints, see src/preprocess/validate.py
+    'invalid': 'invalid_{table}.csv',
+    # Fact rows whose customer is not in the dimension, see src/preprocess/key_mapping.py
+    'orphan': 'rejected_{table}.csv',
+}
+
+def is_columnar(path):
+    """
+    Check whether a cleaned file is staged as Parquet
+    """
+    return str(path).endswith(PARQUET_SUFFIX)
+
+def rejects_path(path, table, kind):
+    """
+    Path of a table's reject file of the given kind, next to its cleaned file
+    """
+    return os.path.join(os.path.dirname(path), REJECT_FILES[kind].format(table=table))
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.fs
+    except ImportError as error:
+        raise ImportError("Parquet staging needs pyarrow: pip install pyarrow") from error
+    return pyarrow
+
+def write_staged(df, path, partition_on=None, part=0):
+    """
+    Write a cleaned frame to CSV, or to a Parquet dataset partitioned by
+    month of the partition_on date column. part 0 replaces the existing
+    file, later parts are appended to it.
+    """
+    if not is_columnar(path):
+        df.to_csv(path, mode='w' if part == 0 else 'a', header=part == 0, index=False)
+        return
+
+    pa = import_pyarrow()
+    if part == 0 and os.path.isdir(path):
+        shutil.rmtree(path)
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    partitioning = None
+    if partition_on:
+        months = df[partition_on].dt.strftime('%Y-%m').fillna(NULL_PARTITION)
+        table = table.append_column(PARTITION_KEY, pa.array(months.to_numpy(dtype=object), pa.string()))
+        partitioning = pa.dataset.partitioning(pa.schema([(PARTITION_KEY, pa.string())]), flavor='hive')
+
+    pa.dataset.write_dataset(
+        table, path, format='parquet', partitioning=partitioning,
+        basename_template=f'part-{part}-{{i}}.parquet',
+        existing_data_behavior='overwrite_or_ignore',
+    )
+
+def to_frame(table, table_name=None):
+    """
+    Convert an Arrow table to pandas. With table_name the columns get the
+    dtypes of src/schema.py, strings staying in Arrow memory.
+    """
+    if table_name is None:
+        return table.to_pandas()
+    pa = import_pyarrow()
+    return conform(table.to_pandas(types_mapper={pa.string(): pd.StringDtype('pyarrow')}.get), table_name)
+
+def open_dataset(path):
+    """
+    Open a Parquet dataset with memory-mapped reads
+    """
+    pa = import_pyarrow()
+    return pa.dataset.dataset(
+        os.path.abspath(path), format='parquet', partitioning='hive',
+        filesystem=pa.fs.LocalFileSystem(use_mmap=True),
+    )
+
+def data_columns(dataset):
+    return [name for name in dataset.schema.names if name != PARTITION_KEY]
+
+def staged_rows(path):
+    """
+    Rows in a Parquet dataset, from the file footers rather than a scan
+    """
+    return open_dataset(path).count_rows()
+
+def read_staged(path, columns=None, parse_dates=None, table=None):
+    """
+    Read a whole cleaned file, optionally only some of its columns. With
+    table, columns get the dtypes of src/schema.py and CSV dates are
+    parsed; otherwise parse_dates only matters for CSV, Parquet keeps the
+    date types.
+    """
+    if not is_columnar(path):
+        if table is None:
+            return pd.read_csv(path, usecols=columns, parse_dates=parse_dates)
+        return read_csv(path, table, columns)
+
+    dataset = open_dataset(path)
+    return to_frame(dataset.to_table(columns=columns or data_columns(dataset)), table)
+
+def iter_staged(path, batch_size, columns=None, above=None, table=None):
+    """
+    Yield a cleaned file as DataFrames of at most batch_size rows, with the
+    dtypes of src/schema.py when table is given. With above=(column,
+    value), only rows whose column is greater than value are returned; on
+    Parquet the filter is pushed down into the scan.
+    """
+    column, value = above if above else (None, None)
+
+    if not is_columnar(path):
+        chunks = (pd.read_csv(path, usecols=columns, chunksize=batch_size) if table is None
+                  else read_csv(path, table, columns, chunksize=batch_size))
+        for chunk in chunks:
+            yield chunk if value is None else chunk[chunk[column] > value]
+        return
+
+    pa = import_pyarrow()
+    dataset = open_dataset(path)
+    scan_filter = None if value is None else pa.dataset.field(column) > value
+
+    # Each partition file yields its own record batches, so small ones are
+    # coalesced up to batch_size rows before converting to pandas
+    pending, rows = [], 0
+    for batch in dataset.to_batches(columns=columns or data_columns(dataset), filter=scan_filter,
+                                    batch_size=batch_size):
+        pending.append(batch)
+        rows += batch.num_rows
+        if rows >= batch_size:
+            yield to_frame(pa.Table.from_batches(pending), table)
+            pending, rows = [], 0
+
+    if rows:
+        yield to_frame(pa.Table.from_batches(pending), table)
+
+def replace_staged(tmp_path, path):
+    """
+    Swap a rewritten cleaned file or dataset into place
+    """
+    if is_columnar(path):
+        os.makedirs(tmp_path, exist_ok=True)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+    elif not os.path.exists(tmp_path):
+        return
+    os.replace(tmp_path, path)
+
+def remove_staged(path):
+    """
+    Delete a cleaned file or dataset if it exists
+    """
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)